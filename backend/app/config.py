@@ -3,7 +3,7 @@ Configuration and environment variables
 """
 
 from pydantic_settings import BaseSettings
-from typing import List
+from typing import Dict, List
 import os
 
 
@@ -20,9 +20,58 @@ class Settings(BaseSettings):
     FIREBASE_TOKEN_URI: str = os.getenv("FIREBASE_TOKEN_URI", "https://oauth2.googleapis.com/token")
     FIREBASE_STORAGE_BUCKET: str = os.getenv("FIREBASE_STORAGE_BUCKET", "")
     
+    # Image storage
+    STORAGE_BACKEND: str = os.getenv("STORAGE_BACKEND", "firebase")  # "firebase" | "local"
+    LOCAL_STORAGE_DIR: str = os.getenv("LOCAL_STORAGE_DIR", "storage")  # Root for the local backend
+    IMAGE_CACHE_DIR: str = os.getenv("IMAGE_CACHE_DIR", "")  # Disk cache for served images, empty = disabled
+    IMAGE_CACHE_MAX_BYTES: int = 1024 * 1024 * 1024  # 1 GB
+    DIRECT_UPLOAD_URL_TTL: int = 300  # Seconds a signed upload URL stays valid
+    UPLOAD_SIGNING_SECRET: str = os.getenv("UPLOAD_SIGNING_SECRET", "")  # HMAC key for local backend upload URLs
+    STORAGE_UPLOAD_WORKERS: int = 8  # Concurrent uploads across all requests
+    STORAGE_UPLOAD_TIMEOUT: float = 30.0  # Seconds per upload attempt
+    STORAGE_UPLOAD_RETRIES: int = 2  # Extra attempts after a failed upload
+    STORAGE_URL_CACHE_MAX_ENTRIES: int = 50000  # Known blob URLs kept in memory
+    STORAGE_URL_NEGATIVE_TTL: float = 30.0  # Seconds a missing blob is remembered as missing
+    STORAGE_CAS_ENABLED: bool = True  # Store images once under blobs/sha256/ instead of per shoot
+    CAS_INDEX_MAX_ENTRIES: int = 100000  # In-memory LRU of known blobs
+    CAS_INDEX_SQLITE_PATH: str = os.getenv("CAS_INDEX_SQLITE_PATH", "")  # Must be writable, empty = memory only
+    
+    # Responsive renditions of generated images
+    RENDITIONS_ENABLED: bool = True
+    RENDITION_WIDTHS: List[int] = [256, 512, 768]  # Pixels, widths >= the original are skipped
+    RENDITION_QUALITY: int = 75
+    RENDITION_PLACEHOLDER_WIDTH: int = 16  # Inline blur placeholder
+    
     # Nano Banana API
     NANO_BANANA_API_KEY: str = os.getenv("NANO_BANANA_API_KEY", "")
     NANO_BANANA_MODEL_ID: str = os.getenv("NANO_BANANA_MODEL_ID", "")
+    PROVIDER_POOL_SIZE: int = 50  # Max keep-alive connections to the provider
+    PROVIDER_CONNECT_TIMEOUT: float = 10.0  # Seconds
+    PROVIDER_READ_TIMEOUT: float = 60.0  # Seconds, generation can be slow
+    
+    # Generation result cache
+    GENERATION_CACHE_ENABLED: bool = True
+    GENERATION_CACHE_TTL_SECONDS: int = 86400  # 24 hours
+    GENERATION_CACHE_MAX_ENTRIES: int = 1000
+    GENERATION_CACHE_MAX_BYTES: int = 64 * 1024 * 1024  # 64 MB in memory
+    GENERATION_CACHE_DIR: str = os.getenv("GENERATION_CACHE_DIR", "")  # Empty = no disk tier
+    SINGLEFLIGHT_MAX_WAITERS: int = 10  # Identical requests allowed to share one provider call
+    
+    # Provider admission control and fair scheduling
+    GENERATION_MAX_CONCURRENCY: int = 8  # Provider calls in flight at once
+    GENERATION_EXPECTED_SECONDS: float = 30.0  # Initial service-time estimate for Retry-After
+    # Per priority class: purchased credits, first-login bonus, anonymous trial
+    GENERATION_CLASS_WEIGHTS: Dict[str, int] = {"paid": 6, "bonus": 3, "anon": 1}
+    GENERATION_CLASS_MAX_CONCURRENCY: Dict[str, int] = {"paid": 8, "bonus": 6, "anon": 2}
+    GENERATION_CLASS_MAX_QUEUE: Dict[str, int] = {"paid": 32, "bonus": 16, "anon": 8}  # Waiting calls before 503
+    
+    # Reference image ingestion
+    MAX_REFERENCE_IMAGES: int = 5
+    INGEST_MAX_BYTES: int = 10 * 1024 * 1024  # 10 MB per encoded source image
+    INGEST_MAX_SOURCE_PIXELS: int = 40_000_000  # Rejected from the header, before decoding
+    INGEST_MAX_DIMENSION: int = 1024  # Longest side sent to the provider
+    INGEST_JPEG_QUALITY: int = 85
+    UPLOAD_MAX_REQUEST_BYTES: int = 52 * 1024 * 1024  # 5 images x 10 MB plus form overhead
     
     # JazzCash / EasyPaisa
     JAZZCASH_MERCHANT_ID: str = os.getenv("JAZZCASH_MERCHANT_ID", "")
@@ -42,6 +91,34 @@ class Settings(BaseSettings):
     # Credit system
     FREE_TRIAL_LIMIT: int = 3  # 3 free generations per IP
     FIRST_LOGIN_BONUS: int = 5  # 5 free credits at first login
+    CREDIT_HOLD_TTL_SECONDS: int = 600  # Held credits are returned after this if never settled
+    CREDIT_HOLD_SWEEP_SECONDS: int = 60  # How often expired holds are looked for
+    TRIAL_FILTER_CAPACITY: int = 1_000_000  # Exhausted IPs before the false-positive rate degrades
+    TRIAL_FILTER_ERROR_RATE: float = 0.0001  # Chance of refusing an eligible IP
+    TRIAL_FILTER_SNAPSHOT_PATH: str = os.getenv("TRIAL_FILTER_SNAPSHOT_PATH", "")  # Must be writable, empty = no snapshot
+    TRIAL_FILTER_SNAPSHOT_SECONDS: int = 300
+    
+    # Idempotency-Key handling
+    IDEMPOTENCY_TTL_SECONDS: int = 86400  # Replay stored responses for 24 hours
+    IDEMPOTENCY_MAX_ENTRIES: int = 10000  # In-memory LRU size
+    IDEMPOTENCY_SQLITE_PATH: str = os.getenv("IDEMPOTENCY_SQLITE_PATH", "")  # Must be writable, empty = memory only
+    
+    # Verified ID token cache
+    TOKEN_CACHE_MAX_ENTRIES: int = 10000
+    
+    # ID token signing keys, verified locally and refreshed in the background
+    FIREBASE_CERTS_URL: str = os.getenv(
+        "FIREBASE_CERTS_URL",
+        "https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com"
+    )  # Point at scripts/key_server.py for offline testing
+    SIGNING_KEYS_REFRESH_FRACTION: float = 0.8  # Refresh after this share of the Cache-Control max-age
+    SIGNING_KEYS_MIN_REFRESH_SECONDS: int = 60  # Floor between refreshes triggered by unknown key ids
+    SIGNING_KEYS_RETRY_SECONDS: int = 30  # Retry delay after a failed fetch
+    
+    # User document cache
+    USER_CACHE_TTL_SECONDS: float = 30.0  # Staleness bound for writes made by other processes
+    USER_CACHE_MAX_ENTRIES: int = 10000
+    USER_CACHE_SQLITE_PATH: str = os.getenv("USER_CACHE_SQLITE_PATH", "")  # Shared by local workers, empty = per process
     
     # Rate limiting
     RATE_LIMIT_REQUESTS_PER_MINUTE: int = 10
@@ -49,6 +126,15 @@ class Settings(BaseSettings):
     # Backend API
     BACKEND_URL: str = os.getenv("BACKEND_URL", "http://localhost:8000")
     
+    # Generation job queue
+    JOB_QUEUE_BACKEND: str = os.getenv("JOB_QUEUE_BACKEND", "memory")  # "memory" | "sqlite"
+    JOB_QUEUE_SQLITE_PATH: str = os.getenv("JOB_QUEUE_SQLITE_PATH", "jobs.db")
+    JOB_QUEUE_WORKERS: int = 4  # Concurrent background generations
+    JOB_QUEUE_MAX_PENDING: int = 100  # Jobs waiting before 503
+    JOB_RESULT_TTL_SECONDS: int = 3600  # Keep finished jobs for 1 hour
+    JOB_STREAM_TOKEN_SECRET: str = os.getenv("JOB_STREAM_TOKEN_SECRET", "")  # HMAC key for event stream tokens (random per process if empty)
+    JOB_STREAM_TOKEN_TTL: int = 3600  # Seconds a job's event stream token stays valid
+    
     class Config:
         env_file = ".env"
         case_sensitive = True
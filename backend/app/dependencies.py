@@ -0,0 +1,128 @@
+"""
+Request-scoped FastAPI dependencies
+"""
+
+from typing import Any, Dict, Optional
+
+from fastapi import HTTPException, Request
+
+from app.services.auth import AuthService
+from app.services.firestore import FirestoreService
+
+_UNSET = object()
+
+
+class AuthContext:
+    """
+    Caller identity for one request
+    
+    The token is verified on first use and the user document is loaded on
+    first use, each at most once per request, so handlers and the helpers
+    they call can ask for the uid or user freely.
+    """
+    
+    def __init__(self, id_token: Optional[str] = None, uid: Optional[str] = None):
+        self.id_token = id_token or None
+        self._claims: Any = _UNSET
+        self._revocation_checked = False
+        self._user: Any = _UNSET
+        if uid:
+            # Already verified, e.g. when the request was queued as a job
+            self._claims = {"uid": uid}
+    
+    @classmethod
+    def for_uid(cls, uid: Optional[str]) -> "AuthContext":
+        """Context for a uid verified earlier, or an anonymous one"""
+        return cls(uid=uid)
+    
+    @property
+    def authenticated(self) -> bool:
+        """Whether the caller presented credentials (not whether they are valid)"""
+        return self.id_token is not None or self._claims is not _UNSET
+    
+    def use_token(self, id_token: Optional[str]) -> None:
+        """Fall back to a token found elsewhere, e.g. a multipart form field"""
+        if not self.authenticated and id_token:
+            self.id_token = id_token
+    
+    def claims(self, check_revoked: bool = False) -> Optional[Dict[str, Any]]:
+        """Verified token claims, or None if there is no valid token"""
+        if self._claims is _UNSET or (check_revoked and not self._revocation_checked and self.id_token):
+            self._claims = AuthService.verify_id_token(self.id_token, check_revoked=check_revoked)
+            self._revocation_checked = check_revoked
+        return self._claims
+    
+    @property
+    def uid(self) -> Optional[str]:
+        claims = self.claims()
+        return claims.get("uid") if claims else None
+    
+    def require_claims(self, check_revoked: bool = False) -> Dict[str, Any]:
+        """
+        Verified token claims
+        
+        Raises:
+            HTTPException: 401 if the token is missing, invalid or expired
+        """
+        claims = self.claims(check_revoked=check_revoked)
+        if not claims:
+            raise HTTPException(
+                status_code=401,
+                detail="Invalid or expired token",
+                headers={"WWW-Authenticate": "Bearer"}
+            )
+        return claims
+    
+    def require_uid(self, check_revoked: bool = False) -> str:
+        return self.require_claims(check_revoked=check_revoked)["uid"]
+    
+    def user(self, fresh: bool = False) -> Optional[Dict[str, Any]]:
+        """
+        The caller's user document
+        
+        Args:
+            fresh: Re-read from Firestore, e.g. after a write made elsewhere
+        
+        Raises:
+            HTTPException: 401 if the token is missing, invalid or expired
+        """
+        if self._user is _UNSET or fresh:
+            self._user = FirestoreService.get_user(self.require_uid(), fresh=fresh)
+        return self._user
+    
+    def require_user(self) -> Dict[str, Any]:
+        """
+        The caller's user document
+        
+        Raises:
+            HTTPException: 401 for a bad token, 404 if the user is not registered
+        """
+        user_data = self.user()
+        if not user_data:
+            raise HTTPException(status_code=404, detail="User not found")
+        return user_data
+
+
+async def get_auth(request: Request) -> AuthContext:
+    """
+    Authentication for the current request
+    
+    Reads `Authorization: Bearer <token>`, falling back to an `idToken` field
+    in a JSON body for older clients. Tokens in the query string are not
+    accepted, since URLs end up in access logs. Nothing is verified until the
+    handler asks for the caller's identity.
+    """
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() == "bearer" and token.strip():
+        return AuthContext(token.strip())
+    
+    if request.headers.get("content-type", "").startswith("application/json"):
+        try:
+            # FastAPI has already read the body for the route; this reuses it
+            body = await request.json()
+        except (ValueError, UnicodeDecodeError):
+            body = None
+        if isinstance(body, dict) and isinstance(body.get("idToken"), str) and body["idToken"]:
+            return AuthContext(body["idToken"])
+    
+    return AuthContext()
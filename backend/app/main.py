@@ -6,20 +6,55 @@ FastAPI application for image generation, credit management, and authentication.
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
+from contextlib import asynccontextmanager
 import logging
 
-from app.routes import generate, auth, credits
+from app.routes import generate, auth, credits, uploads, images
+from app.services.admission import generation_admission
+from app.services.blob_store import blob_store
+from app.services.credit_holds import credit_hold_sweeper
+from app.services.generation_cache import generation_cache
+from app.services.idempotency import idempotency_store
+from app.services.image_cache import image_cache
+from app.services.storage import url_cache
+from app.services.jobs import job_queue
+from app.services.singleflight import generation_flight
+from app.services.stage_timings import generation_stages
+from app.services.trial_filter import exhausted_ips
+from app.services.signing_keys import signing_keys
+from app.services.token_cache import token_cache
+from app.services.firestore import FirestoreService
+from app.services.user_cache import user_cache
+from app.services.nano_banana import ProviderClient
 from app.config import settings
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start background services on startup and stop them on shutdown"""
+    await ProviderClient.start()
+    await signing_keys.start()
+    await job_queue.start(generate.process_generation_job)
+    await credit_hold_sweeper.start()
+    await exhausted_ips.start(FirestoreService.exhausted_ip_hashes)
+    yield
+    await exhausted_ips.stop()
+    await credit_hold_sweeper.stop()
+    await job_queue.stop()
+    await signing_keys.stop()
+    await ProviderClient.close()
+
+
 # Initialize FastAPI app
 app = FastAPI(
     title="Fashion Photoshoot Studio API",
     description="AI-powered fashion photoshoot generation platform",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # CORS configuration
@@ -35,6 +70,8 @@ app.add_middleware(
 app.include_router(auth.router, prefix="/api/auth", tags=["auth"])
 app.include_router(generate.router, prefix="/api", tags=["generation"])
 app.include_router(credits.router, prefix="/api", tags=["credits"])
+app.include_router(uploads.router, prefix="/api", tags=["uploads"])
+app.include_router(images.router, prefix="/api", tags=["images"])
 
 
 @app.get("/health")
@@ -43,6 +80,27 @@ async def health_check():
     return {"status": "ok", "service": "fashion-photoshoot-api"}
 
 
+@app.get("/metrics")
+async def metrics():
+    """Runtime counters for caches and queues"""
+    return {
+        "admission": generation_admission.stats(),
+        "generationCache": generation_cache.stats(),
+        "singleFlight": generation_flight.stats(),
+        "jobQueue": job_queue.stats(),
+        "idempotency": idempotency_store.stats(),
+        "blobStore": blob_store.stats(),
+        "imageCache": image_cache.stats(),
+        "storageUrls": url_cache.stats(),
+        "generationStages": generation_stages.stats(),
+        "userCache": user_cache.stats(),
+        "creditHolds": credit_hold_sweeper.stats(),
+        "exhaustedIps": exhausted_ips.stats(),
+        "tokenCache": token_cache.stats(),
+        "signingKeys": signing_keys.stats()
+    }
+
+
 @app.exception_handler(Exception)
 async def general_exception_handler(request: Request, exc: Exception):
     """Global exception handler"""
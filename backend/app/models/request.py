@@ -8,17 +8,35 @@ from typing import List, Optional
 
 class GenerateRequest(BaseModel):
     """Request to generate photoshoot"""
-    idToken: str = Field(..., description="Firebase ID token for authenticated users")
+    idToken: str = Field("", description="Deprecated: send the Firebase ID token as Authorization: Bearer instead")
     articleType: str = Field(..., description="Type of article (shirt, dress, pants, etc.)")
     styleNotes: Optional[str] = Field(None, description="Optional style notes")
     imageSize: str = Field(..., description="Output size: small, medium, large")
-    uploadedImageUrls: List[str] = Field(..., description="URLs of uploaded reference images")
+    uploadedImageUrls: List[str] = Field(..., description="Reference images: upload IDs from /api/uploads, URLs or base64 data URLs")
     clientIp: Optional[str] = Field(None, description="Client IP address for anonymous tracking")
 
 
+class DirectUploadFile(BaseModel):
+    """One image the client wants to upload directly to storage"""
+    contentType: str = Field(..., description="image/jpeg, image/png or image/webp")
+    size: int = Field(..., description="File size in bytes")
+
+
+class DirectUploadRequest(BaseModel):
+    """Request for signed direct upload URLs"""
+    idToken: str = Field("", description="Deprecated: send the Firebase ID token as Authorization: Bearer instead")
+    files: List[DirectUploadFile] = Field(..., description="Images to upload, at most 5")
+
+
+class CompleteUploadRequest(BaseModel):
+    """Request to register images uploaded through signed URLs"""
+    idToken: str = Field("", description="Deprecated: send the Firebase ID token as Authorization: Bearer instead")
+    uploadKeys: List[str] = Field(..., description="uploadKey of each finished upload")
+
+
 class RegisterRequest(BaseModel):
     """Request to register new user"""
-    idToken: str = Field(..., description="Firebase ID token")
+    idToken: str = Field("", description="Deprecated: send the Firebase ID token as Authorization: Bearer instead")
     email: str = Field(..., description="User email")
     displayName: str = Field(..., description="User display name")
     ipAddress: Optional[str] = Field(None, description="Client IP for tracking")
@@ -26,7 +44,7 @@ class RegisterRequest(BaseModel):
 
 class PurchaseCreditsRequest(BaseModel):
     """Request to purchase credits"""
-    idToken: str = Field(..., description="Firebase ID token")
+    idToken: str = Field("", description="Deprecated: send the Firebase ID token as Authorization: Bearer instead")
     amount: int = Field(..., description="Number of credits to purchase")
     paymentMethod: str = Field(..., description="jazzcash or easypaisa")
     phoneNumber: str = Field(..., description="Phone number for payment")
@@ -35,4 +53,4 @@ class PurchaseCreditsRequest(BaseModel):
 
 class VerifyTokenRequest(BaseModel):
     """Request to verify Firebase token"""
-    idToken: str = Field(..., description="Firebase ID token")
+    idToken: str = Field("", description="Deprecated: send the Firebase ID token as Authorization: Bearer instead")
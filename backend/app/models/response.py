@@ -3,7 +3,7 @@ Response models and schemas
 """
 
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 
 
 class GenerateResponse(BaseModel):
@@ -13,6 +13,45 @@ class GenerateResponse(BaseModel):
     generatedImages: List[str]
     creditsCost: int
     creditsRemaining: int
+    # Per image: {"placeholder": str, "sources": [{"type", "width", "url"}]}, None if unavailable
+    renditions: Optional[List[Optional[Dict[str, Any]]]] = None
+
+
+class JobAcceptedResponse(BaseModel):
+    """Response when a generation is queued as a background job"""
+    shoot_id: str
+    status: str  # "queued"
+    statusUrl: str
+    streamUrl: str  # Server-Sent Events, authorized by the token it carries
+
+
+class JobStatusResponse(BaseModel):
+    """Status of a queued generation job"""
+    shoot_id: str
+    status: str  # "queued" | "running" | "completed" | "failed"
+    result: Optional[GenerateResponse] = None
+    error: Optional[Dict[str, Any]] = None  # {"status_code": int, "detail": str}
+    createdAt: str
+    updatedAt: str
+
+
+class UploadResponse(BaseModel):
+    """Response from a reference image upload"""
+    uploadIds: List[str]  # "upload:<id>", usable in GenerateRequest.uploadedImageUrls
+
+
+class DirectUpload(BaseModel):
+    """Signed URL for uploading one image straight to storage"""
+    uploadKey: str  # Passed to /api/uploads/complete once the PUT succeeds
+    url: str
+    method: str  # "PUT"
+    headers: Dict[str, str]  # Must be sent unchanged with the upload
+    expiresAt: int  # Unix time
+
+
+class DirectUploadResponse(BaseModel):
+    """Response with signed direct upload URLs"""
+    uploads: List[DirectUpload]
 
 
 class UserProfileResponse(BaseModel):
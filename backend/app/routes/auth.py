@@ -2,10 +2,11 @@
 Authentication routes
 """
 
-from fastapi import APIRouter, HTTPException, Request
+from fastapi import APIRouter, Depends, HTTPException, Request
 from typing import Optional
 import logging
 
+from app.dependencies import AuthContext, get_auth
 from app.models.request import RegisterRequest, VerifyTokenRequest
 from app.models.response import UserProfileResponse, TokenVerificationResponse
 from app.services.auth import AuthService
@@ -17,16 +18,14 @@ router = APIRouter()
 
 
 @router.post("/verify")
-async def verify_token(request: VerifyTokenRequest):
+async def verify_token(request: Optional[VerifyTokenRequest] = None, auth: AuthContext = Depends(get_auth)):
     """
     Verify Firebase ID token
     
-    Returns user information if token is valid
+    Returns user information if token is valid. Called when a session
+    starts, so revoked sessions are checked with Firebase here.
     """
-    decoded = AuthService.verify_id_token(request.idToken)
-    
-    if not decoded:
-        raise HTTPException(status_code=401, detail="Invalid or expired token")
+    decoded = auth.require_claims(check_revoked=True)
     
     uid = decoded.get("uid")
     email = decoded.get("email")
@@ -40,8 +39,25 @@ async def verify_token(request: VerifyTokenRequest):
     )
 
 
+@router.post("/signout")
+async def sign_out(auth: AuthContext = Depends(get_auth)):
+    """
+    Sign the user out everywhere
+    
+    Revokes the user's refresh tokens, so no device can mint new ID tokens,
+    and stops this process accepting the ones already issued.
+    """
+    uid = auth.require_uid()
+    
+    if not AuthService.revoke_sessions(uid):
+        raise HTTPException(status_code=500, detail="Sign-out failed")
+    
+    logger.info(f"User signed out: {uid}")
+    return {"status": "signed_out"}
+
+
 @router.post("/register")
-async def register_user(request: RegisterRequest, req: Request):
+async def register_user(request: RegisterRequest, req: Request, auth: AuthContext = Depends(get_auth)):
     """
     Register or create new user after Firebase authentication
     
@@ -49,14 +65,10 @@ async def register_user(request: RegisterRequest, req: Request):
     """
     try:
         # Verify token
-        decoded = AuthService.verify_id_token(request.idToken)
-        if not decoded:
-            raise HTTPException(status_code=401, detail="Invalid token")
-        
-        uid = decoded.get("uid")
+        uid = auth.require_uid()
         
         # Check if user already exists
-        existing_user = FirestoreService.get_user(uid)
+        existing_user = auth.user(fresh=True)
         if existing_user:
             # User already registered
             return {
@@ -66,7 +78,7 @@ async def register_user(request: RegisterRequest, req: Request):
             }
         
         # Get client IP
-        client_ip = request.client.host if request.client else None
+        client_ip = req.client.host if req.client else None
         
         # Create new user with first-login bonus
         user_data = FirestoreService.create_user(
@@ -96,19 +108,13 @@ async def register_user(request: RegisterRequest, req: Request):
 
 
 @router.get("/user/profile")
-async def get_user_profile(id_token: str):
+async def get_user_profile(auth: AuthContext = Depends(get_auth)):
     """Get user profile information"""
     try:
-        uid = AuthService.get_uid_from_token(id_token)
-        if not uid:
-            raise HTTPException(status_code=401, detail="Invalid token")
-        
-        user_data = FirestoreService.get_user(uid)
-        if not user_data:
-            raise HTTPException(status_code=404, detail="User not found")
+        user_data = auth.require_user()
         
         return UserProfileResponse(
-            uid=uid,
+            uid=auth.uid,
             email=user_data.get("email"),
             displayName=user_data.get("displayName"),
             credits=user_data.get("credits", 0),
@@ -2,13 +2,18 @@
 Credits management routes
 """
 
-from fastapi import APIRouter, HTTPException, Request
+from fastapi import APIRouter, Depends, HTTPException, Request, Header
+from fastapi.responses import JSONResponse
+from typing import Any, Dict, Optional, Tuple
 import logging
 
+from app.dependencies import AuthContext, get_auth
 from app.models.request import PurchaseCreditsRequest
 from app.models.response import CreditsResponse, PurchaseResponse
-from app.services.auth import AuthService
 from app.services.firestore import FirestoreService
+from app.services.idempotency import (
+    idempotency_store, scoped_key, request_hash, IdempotencyConflictError, MAX_KEY_LENGTH
+)
 from app.services.payment import PaymentVerificationService
 from app.config import settings
 
@@ -18,20 +23,14 @@ router = APIRouter()
 
 
 @router.get("/user/credits")
-async def get_user_credits(id_token: str):
+async def get_user_credits(auth: AuthContext = Depends(get_auth)):
     """
     Get user's current credit balance
     
     Fetches from server to prevent frontend tampering
     """
     try:
-        uid = AuthService.get_uid_from_token(id_token)
-        if not uid:
-            raise HTTPException(status_code=401, detail="Invalid token")
-        
-        user_data = FirestoreService.get_user(uid)
-        if not user_data:
-            raise HTTPException(status_code=404, detail="User not found")
+        user_data = auth.require_user()
         
         return CreditsResponse(
             credits=user_data.get("credits", 0),
@@ -69,79 +68,46 @@ async def get_anon_trial_status(request: Request):
 
 
 @router.post("/credits/purchase")
-async def purchase_credits(request: PurchaseCreditsRequest):
+async def purchase_credits(
+    request: PurchaseCreditsRequest,
+    idempotency_key: Optional[str] = Header(None),
+    auth: AuthContext = Depends(get_auth)
+):
     """
     Process credit purchase via Pakistani payment methods
     
     Validates payment with JazzCash or EasyPaisa API
     Credits only added after successful verification
+    
+    Send an `Idempotency-Key` header to make retries safe: repeats with the
+    same key replay the first response without re-verifying the payment or
+    adding credits again.
     """
     try:
-        # Verify token
-        uid = AuthService.get_uid_from_token(request.idToken)
-        if not uid:
-            raise HTTPException(status_code=401, detail="Invalid token")
-        
-        # Verify user exists
-        user_data = FirestoreService.get_user(uid)
-        if not user_data:
-            raise HTTPException(status_code=404, detail="User not found")
-        
-        # Verify payment based on method
-        payment_method = request.paymentMethod.lower()
-        
-        if payment_method == "jazzcash":
-            verification = PaymentVerificationService.verify_jazzcash_payment(
-                transaction_id=request.transactionId,
-                amount=0,  # Amount calculated from transaction
-                phone_number=request.phoneNumber
-            )
-        elif payment_method == "easypaisa":
-            verification = PaymentVerificationService.verify_easypaisa_payment(
-                transaction_id=request.transactionId,
-                amount=0,
-                phone_number=request.phoneNumber
-            )
-        else:
-            raise HTTPException(status_code=400, detail="Invalid payment method")
-        
-        if not verification.get("verified"):
-            logger.warning(f"Payment verification failed for user {uid}: {verification.get('message')}")
-            raise HTTPException(
-                status_code=402,
-                detail=verification.get("message", "Payment verification failed")
-            )
+        # Verify token, including revocation since this spends money
+        uid = auth.require_uid(check_revoked=True)
         
-        # Calculate credits based on amount
-        amount = verification.get("amount", request.amount)
-        credits_to_add = PaymentVerificationService.calculate_credits_for_amount(amount)
+        if not idempotency_key:
+            return await _process_purchase(auth, request)
         
-        # Add credits to user account
-        success = FirestoreService.add_credits(
-            uid=uid,
-            amount=credits_to_add,
-            reason="purchase",
-            payment_method=payment_method
-        )
-        
-        if not success:
-            logger.error(f"Failed to add credits for user {uid}")
-            raise HTTPException(status_code=500, detail="Failed to process credits")
-        
-        # Get updated balance
-        updated_user = FirestoreService.get_user(uid)
-        new_balance = updated_user.get("credits", 0) if updated_user else 0
+        if len(idempotency_key) > MAX_KEY_LENGTH:
+            raise HTTPException(status_code=400, detail="Idempotency-Key is too long")
         
-        logger.info(f"Credit purchase successful: {uid} purchased {credits_to_add} credits")
+        async def purchase() -> Tuple[int, Dict[str, Any]]:
+            response = await _process_purchase(auth, request)
+            return 200, response.model_dump()
         
-        return PurchaseResponse(
-            status="success",
-            creditsAdded=credits_to_add,
-            newBalance=new_balance,
-            transactionId=request.transactionId,
-            message=f"Successfully added {credits_to_add} credits to your account"
+        status_code, content, replayed = await idempotency_store.run(
+            scoped_key("credits.purchase", uid, idempotency_key),
+            request_hash(request.model_dump(exclude={"idToken"})),
+            purchase
         )
+        headers = {"Idempotent-Replayed": "true"} if replayed else {}
+        return JSONResponse(status_code=status_code, content=content, headers=headers)
         
+    except IdempotencyConflictError as e:
+        logger.warning(str(e))
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
     except HTTPException:
         raise
     except Exception as e:
@@ -149,6 +115,69 @@ async def purchase_credits(request: PurchaseCreditsRequest):
         raise HTTPException(status_code=500, detail="Purchase processing failed")
 
 
+async def _process_purchase(auth: AuthContext, request: PurchaseCreditsRequest) -> PurchaseResponse:
+    """Verify the payment and add the purchased credits"""
+    uid = auth.require_uid()
+    
+    # Verify user exists
+    auth.require_user()
+    
+    # Verify payment based on method
+    payment_method = request.paymentMethod.lower()
+    
+    if payment_method == "jazzcash":
+        verification = PaymentVerificationService.verify_jazzcash_payment(
+            transaction_id=request.transactionId,
+            amount=0,  # Amount calculated from transaction
+            phone_number=request.phoneNumber
+        )
+    elif payment_method == "easypaisa":
+        verification = PaymentVerificationService.verify_easypaisa_payment(
+            transaction_id=request.transactionId,
+            amount=0,
+            phone_number=request.phoneNumber
+        )
+    else:
+        raise HTTPException(status_code=400, detail="Invalid payment method")
+    
+    if not verification.get("verified"):
+        logger.warning(f"Payment verification failed for user {uid}: {verification.get('message')}")
+        raise HTTPException(
+            status_code=402,
+            detail=verification.get("message", "Payment verification failed")
+        )
+    
+    # Calculate credits based on amount
+    amount = verification.get("amount", request.amount)
+    credits_to_add = PaymentVerificationService.calculate_credits_for_amount(amount)
+    
+    # Add credits to user account
+    success = FirestoreService.add_credits(
+        uid=uid,
+        amount=credits_to_add,
+        reason="purchase",
+        payment_method=payment_method
+    )
+    
+    if not success:
+        logger.error(f"Failed to add credits for user {uid}")
+        raise HTTPException(status_code=500, detail="Failed to process credits")
+    
+    # Get updated balance
+    updated_user = auth.user(fresh=True)
+    new_balance = updated_user.get("credits", 0) if updated_user else 0
+    
+    logger.info(f"Credit purchase successful: {uid} purchased {credits_to_add} credits")
+    
+    return PurchaseResponse(
+        status="success",
+        creditsAdded=credits_to_add,
+        newBalance=new_balance,
+        transactionId=request.transactionId,
+        message=f"Successfully added {credits_to_add} credits to your account"
+    )
+
+
 @router.get("/credits/packages")
 async def get_credit_packages():
     """
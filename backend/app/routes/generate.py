@@ -3,16 +3,33 @@ Image generation routes
 Handles both anonymous and authenticated photoshoot generation
 """
 
-from fastapi import APIRouter, HTTPException, Request
+from fastapi import APIRouter, Depends, HTTPException, Request, Header
+from fastapi.responses import JSONResponse, StreamingResponse
+from typing import Any, Dict, Optional, Tuple
+import asyncio
+import json
 import uuid
 import logging
 from datetime import datetime
 
+from app.dependencies import AuthContext, get_auth
 from app.models.request import GenerateRequest
-from app.models.response import GenerateResponse
-from app.services.auth import AuthService
-from app.services.firestore import FirestoreService
-from app.services.nano_banana import GenerationService
+from app.models.response import GenerateResponse, JobAcceptedResponse, JobStatusResponse
+from app.services.admission import (
+    generation_admission, AdmissionRejectedError, PRIORITY_PAID, PRIORITY_BONUS, PRIORITY_ANON
+)
+from app.services.blob_store import blob_store
+from app.services.firestore import FirestoreService, InsufficientCreditsError, AnonTrialExhaustedError
+from app.services.idempotency import (
+    idempotency_store, scoped_key, request_hash, IdempotencyConflictError, MAX_KEY_LENGTH
+)
+from app.services.ingestion import ImageIngestionService, ImageIngestionError
+from app.services.jobs import (
+    job_queue, issue_stream_token, verify_stream_token, JobQueueFullError, KEEPALIVE_EVENT
+)
+from app.services.nano_banana import GenerationService, OnImage
+from app.services.singleflight import SingleFlightLimitError
+from app.services.stage_timings import generation_stages
 from app.services.storage import StorageService
 from app.config import settings
 
@@ -22,37 +39,74 @@ router = APIRouter()
 
 
 @router.post("/photoshoots/create")
-async def create_photoshoot(request: GenerateRequest, req: Request):
+async def create_photoshoot(
+    request: GenerateRequest,
+    req: Request,
+    prefer: Optional[str] = Header(None),
+    idempotency_key: Optional[str] = Header(None),
+    auth: AuthContext = Depends(get_auth)
+):
     """
     Create and generate a photoshoot
     
     Handles both anonymous users (free trial) and authenticated users (credit-based)
     
+    Send `Prefer: respond-async` to run the generation as a background job;
+    the shoot ID is returned immediately and the result is fetched from
+    GET /api/photoshoots/{shoot_id}.
+    
+    Send an `Idempotency-Key` header to make retries safe: repeats with the
+    same key replay the first response instead of generating (and charging)
+    again.
+    
     Returns:
         - 200: Generation successful
+        - 202: Generation queued (job mode)
         - 402: Insufficient credits
         - 401: Invalid token
         - 400: Bad request
+        - 422: Idempotency key reused with a different request
         - 500: Generation failed
+        - 503: Generation capacity full (see Retry-After)
     """
     try:
         client_ip = req.client.host if req.client else "unknown"
-        shoot_id = str(uuid.uuid4())
+        job_mode = bool(prefer and "respond-async" in prefer.lower())
         
-        # Determine if user is authenticated
-        is_authenticated = bool(request.idToken)
+        async def generate() -> Tuple[int, Dict[str, Any]]:
+            shoot_id = str(uuid.uuid4())
+            if job_mode:
+                return 202, _enqueue_generation(request, auth, shoot_id, client_ip).model_dump()
+            response = await _run_generation(request, auth, shoot_id, client_ip)
+            return 200, response.model_dump()
         
-        if is_authenticated:
-            # Authenticated user - check credits
-            return await _handle_authenticated_generation(
-                request, shoot_id, client_ip
+        replayed = False
+        if idempotency_key:
+            if len(idempotency_key) > MAX_KEY_LENGTH:
+                raise HTTPException(status_code=400, detail="Idempotency-Key is too long")
+            
+            principal = auth.require_uid() if auth.authenticated else f"ip-{FirestoreService.hash_ip(client_ip)}"
+            body = request.model_dump(exclude={"idToken", "clientIp"})
+            body["jobMode"] = job_mode
+            
+            status_code, content, replayed = await idempotency_store.run(
+                scoped_key("photoshoots.create", principal, idempotency_key),
+                request_hash(body),
+                generate
             )
         else:
-            # Anonymous user - check free trial
-            return await _handle_anonymous_generation(
-                request, shoot_id, client_ip
-            )
+            status_code, content = await generate()
+        
+        headers = {}
+        if status_code == 202:
+            headers["Location"] = content["statusUrl"]
+        if replayed:
+            headers["Idempotent-Replayed"] = "true"
+        return JSONResponse(status_code=status_code, content=content, headers=headers)
         
+    except IdempotencyConflictError as e:
+        logger.warning(str(e))
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
     except HTTPException:
         raise
     except Exception as e:
@@ -60,73 +114,328 @@ async def create_photoshoot(request: GenerateRequest, req: Request):
         raise HTTPException(status_code=500, detail="Generation failed")
 
 
-async def _handle_authenticated_generation(request: GenerateRequest, shoot_id: str, client_ip: str):
-    """Handle generation for authenticated users (credit-based)"""
+@router.get("/photoshoots/{shoot_id}")
+async def get_photoshoot_status(shoot_id: str, req: Request, auth: AuthContext = Depends(get_auth)):
+    """
+    Get the status of a queued photoshoot generation
     
-    # Verify token
-    uid = AuthService.get_uid_from_token(request.idToken)
-    if not uid:
-        raise HTTPException(status_code=401, detail="Invalid or expired token")
+    Only the caller who queued the job can read it: the same user, or for
+    anonymous jobs the same client IP.
     
-    # Check user exists
-    user_data = FirestoreService.get_user(uid)
-    if not user_data:
-        raise HTTPException(status_code=404, detail="User not found")
+    Returns:
+        - 200: Job status, with the generation result once completed
+        - 401: Invalid token
+        - 404: Unknown or expired shoot ID, or queued by someone else
+    """
+    job = _get_own_job(shoot_id, auth, req)
     
-    # Calculate credit cost (1 credit per image)
-    credit_cost = 1  # Fixed cost: 1 credit per generation
+    return JobStatusResponse(
+        shoot_id=shoot_id,
+        status=job["status"],
+        result=job.get("result"),
+        error=job.get("error"),
+        createdAt=job["createdAt"],
+        updatedAt=job["updatedAt"]
+    )
+
+
+@router.get("/photoshoots/{shoot_id}/events")
+async def stream_photoshoot_events(shoot_id: str, token: str = ""):
+    """
+    Stream a queued photoshoot's progress as Server-Sent Events
     
-    # Check credit balance
-    current_credits = user_data.get("credits", 0)
-    if current_credits < credit_cost:
-        logger.warning(f"Insufficient credits for user {uid}: {current_credits} < {credit_cost}")
-        raise HTTPException(
-            status_code=402,
-            detail=f"Insufficient credits. You have {current_credits}, need {credit_cost}"
-        )
+    EventSource cannot set headers, so the stream is authorized by the
+    short-lived `token` in the streamUrl returned when the job was queued,
+    not by the caller's ID token.
     
-    # Lock credits (attempt deduction - will fail if insufficient in transaction)
-    logger.info(f"Generating photoshoot for user {uid}: {request.articleType}")
+    Events:
+        - status: {"status": "running"}
+        - image: {"index": int, "image": str}, sent as soon as each image is ready
+        - completed: credits summary (GenerateResponse without generatedImages)
+        - failed: {"status_code": int, "detail": str}
+    
+    Returns:
+        - 200: text/event-stream
+        - 404: Unknown or expired shoot ID, or missing, wrong or expired token
+    """
+    job = job_queue.get(shoot_id)
+    if not job or not job.get("owner") or not verify_stream_token(shoot_id, job["owner"], token):
+        raise HTTPException(status_code=404, detail="Photoshoot not found")
     
-    # Call generation service
-    generation_result = GenerationService.generate_photoshoot(
-        reference_images=request.uploadedImageUrls,
-        article_type=request.articleType,
-        style_notes=request.styleNotes or "",
-        image_size=request.imageSize
+    async def event_stream():
+        async for event, data in job_queue.events(shoot_id):
+            if event == KEEPALIVE_EVENT:
+                yield ": keep-alive\n\n"
+            else:
+                yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
     )
+
+
+async def process_generation_job(shoot_id: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Job queue handler: run a queued generation and return the response body"""
+    request = GenerateRequest(**payload["request"])
+    auth = AuthContext.for_uid(payload["uid"])
+    
+    async def publish_image(index: int, image: str) -> None:
+        job_queue.publish(shoot_id, "image", {"index": index, "image": image})
+    
+    response = await _run_generation(request, auth, shoot_id, payload["client_ip"], on_image=publish_image)
+    return response.model_dump()
+
+
+async def _run_generation(
+    request: GenerateRequest,
+    auth: AuthContext,
+    shoot_id: str,
+    client_ip: str,
+    on_image: Optional[OnImage] = None
+) -> GenerateResponse:
+    """Dispatch to the authenticated or anonymous generation flow"""
+    # Determine if user is authenticated
+    if auth.authenticated:
+        # Authenticated user - check credits
+        return await _handle_authenticated_generation(
+            request, auth, shoot_id, client_ip, on_image
+        )
+    else:
+        # Anonymous user - check free trial
+        return await _handle_anonymous_generation(
+            request, shoot_id, client_ip, on_image
+        )
+
+
+async def _generate(
+    request: GenerateRequest,
+    priority: str,
+    owner: str,
+    shoot_id: str,
+    on_image: Optional[OnImage] = None
+) -> Dict[str, Any]:
+    """Call the generation service and map its failures to HTTP errors"""
+    try:
+        generation_result = await GenerationService.generate_photoshoot(
+            reference_images=request.uploadedImageUrls,
+            article_type=request.articleType,
+            style_notes=request.styleNotes or "",
+            image_size=request.imageSize,
+            on_image=on_image,
+            priority=priority,
+            output_prefix=f"generated-images/{owner}/{shoot_id}",
+            owner=owner
+        )
+    except SingleFlightLimitError as e:
+        logger.warning(f"Rejected duplicate generation: {str(e)}")
+        raise HTTPException(status_code=429, detail="An identical generation is already in progress")
+    except AdmissionRejectedError as e:
+        logger.warning(str(e))
+        raise _capacity_exceeded(e.retry_after)
     
     if not generation_result.get("success"):
         logger.error(f"Generation failed: {generation_result.get('message')}")
         raise HTTPException(status_code=500, detail=generation_result.get("message"))
     
-    # Save generated images to Firebase Storage
-    generated_images = generation_result.get("images", [])
+    return generation_result
+
+
+async def _ingest_reference_images(request: GenerateRequest, owner: str) -> GenerateRequest:
+    """Downscale and store the reference images, returning the request with short references"""
+    try:
+        references = await asyncio.to_thread(
+            ImageIngestionService.ingest_reference_images,
+            request.uploadedImageUrls,
+            owner
+        )
+    except ImageIngestionError as e:
+        logger.warning(f"Rejected reference images for {owner}: {str(e)}")
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    return request.model_copy(update={"uploadedImageUrls": references})
+
+
+async def _write_manifest(
+    owner: str,
+    shoot_id: str,
+    request: GenerateRequest,
+    generated_images: list
+) -> Optional[str]:
+    """Record the blobs a shoot uses (content-addressed storage only)"""
+    if not settings.STORAGE_CAS_ENABLED or not StorageService.is_configured():
+        return None
+    return await asyncio.to_thread(
+        blob_store.write_manifest,
+        owner,
+        shoot_id,
+        request.uploadedImageUrls,
+        generated_images
+    )
+
+
+def _capacity_exceeded(retry_after: int) -> HTTPException:
+    """503 telling the client when generation capacity is likely to free up"""
+    return HTTPException(
+        status_code=503,
+        detail="Generation capacity is full, please retry shortly",
+        headers={"Retry-After": str(retry_after)}
+    )
+
+
+def _check_capacity(priority: str) -> None:
+    """Fail fast, before any further Firestore reads, when new generations would be rejected"""
+    if generation_admission.saturated(priority):
+        retry_after = generation_admission.retry_after(priority)
+        logger.warning(f"Generation capacity full for {priority}, rejecting (retry after {retry_after}s)")
+        raise _capacity_exceeded(retry_after)
+
+
+def _priority_class(user_data: Dict[str, Any]) -> str:
+    """Scheduling class for an authenticated user"""
+    if user_data.get("plan", "free") != "free" or user_data.get("creditsPurchased", 0) > 0:
+        return PRIORITY_PAID
+    return PRIORITY_BONUS
+
+
+def _job_owner(auth: AuthContext, client_ip: str) -> str:
+    """User ID of an authenticated caller, or "anon-{ipHash}" without a token"""
+    if auth.authenticated:
+        return auth.require_uid()
+    return f"anon-{FirestoreService.hash_ip(client_ip)}"
+
+
+def _get_own_job(shoot_id: str, auth: AuthContext, req: Request) -> Dict[str, Any]:
+    """
+    A queued job, if the caller is the one who queued it
+    
+    Raises:
+        HTTPException: 401 for a bad token, 404 if the job is unknown or not
+            the caller's (so shoot IDs of other users can't be probed)
+    """
+    client_ip = req.client.host if req.client else "unknown"
+    job = job_queue.get(shoot_id)
+    if not job or job.get("owner") != _job_owner(auth, client_ip):
+        raise HTTPException(status_code=404, detail="Photoshoot not found")
+    return job
+
+
+def _enqueue_generation(
+    request: GenerateRequest,
+    auth: AuthContext,
+    shoot_id: str,
+    client_ip: str
+) -> JobAcceptedResponse:
+    """Queue a generation job and return the 202 Accepted body"""
+    # Reject bad tokens now rather than from inside the job, which only
+    # carries the verified uid (the token may expire while it waits)
+    uid = auth.require_uid() if auth.authenticated else None
+    if not uid:
+        _check_capacity(PRIORITY_ANON)
+    owner = _job_owner(auth, client_ip)
+    
+    try:
+        job_queue.enqueue(shoot_id, {
+            "request": request.model_dump(exclude={"idToken"}),
+            "client_ip": client_ip,
+            "uid": uid
+        }, owner=owner)
+    except JobQueueFullError as e:
+        logger.warning(str(e))
+        raise _capacity_exceeded(generation_admission.retry_after(PRIORITY_PAID))
     
-    # For now, we just store the image URLs/data returned from API
-    # In production, you might want to upload to Firebase Storage and get permanent URLs
+    return JobAcceptedResponse(
+        shoot_id=shoot_id,
+        status="queued",
+        statusUrl=f"/api/photoshoots/{shoot_id}",
+        streamUrl=f"/api/photoshoots/{shoot_id}/events?token={issue_stream_token(shoot_id, owner)}"
+    )
+
+
+async def _handle_authenticated_generation(
+    request: GenerateRequest,
+    auth: AuthContext,
+    shoot_id: str,
+    client_ip: str,
+    on_image: Optional[OnImage] = None
+):
+    """Handle generation for authenticated users (credit-based)"""
     
-    # Deduct credits (atomic transaction)
-    deduction_success = FirestoreService.deduct_credits(uid, credit_cost, shoot_id)
+    # Verify token
+    with generation_stages.measure("verifyToken"):
+        uid = auth.require_uid()
     
-    if not deduction_success:
-        logger.error(f"Failed to deduct credits for user {uid}")
-        raise HTTPException(status_code=500, detail="Failed to process credits")
+    # Check user exists
+    with generation_stages.measure("loadUser"):
+        user_data = auth.require_user()
     
-    # Save photoshoot record
-    FirestoreService.save_photoshoot(uid, {
-        "articleType": request.articleType,
-        "styleNotes": request.styleNotes,
-        "imageSize": request.imageSize,
-        "uploadedImages": request.uploadedImageUrls,
-        "generatedImages": generated_images,
-        "creditsCost": credit_cost,
-        "isFreeTrial": False,
-        "status": "completed"
-    })
+    # Calculate credit cost (1 credit per image)
+    credit_cost = 1  # Fixed cost: 1 credit per generation
     
-    # Get updated credits
-    new_credits = FirestoreService.get_credits(uid)
+    priority = _priority_class(user_data)
+    _check_capacity(priority)
+    
+    # Hold the credits before calling the provider, so concurrent requests
+    # that the balance cannot cover are rejected up front
+    try:
+        with generation_stages.measure("reserve"):
+            await asyncio.to_thread(FirestoreService.reserve_credits, uid, credit_cost, shoot_id)
+    except InsufficientCreditsError as e:
+        logger.warning(f"Insufficient credits for user {uid}: {str(e)}")
+        raise HTTPException(status_code=402, detail=str(e))
+    except ValueError:
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    logger.info(f"Generating photoshoot for user {uid} ({priority}): {request.articleType}")
+    
+    try:
+        with generation_stages.measure("ingest"):
+            request = await _ingest_reference_images(request, uid)
+        
+        # Call generation service (images are streamed into Firebase Storage)
+        with generation_stages.measure("generate"):
+            generation_result = await _generate(request, priority, uid, shoot_id, on_image)
+        
+        # A repeat of the user's own earlier shoot, or a duplicate that joined
+        # their in-flight one, cost no provider call of its own, so the hold
+        # is returned instead of charged: one credit per provider call
+        if generation_result.get("cached") or generation_result.get("shared"):
+            credit_cost = 0
+        
+        generated_images = generation_result.get("images", [])
+        
+        with generation_stages.measure("manifest"):
+            manifest = await _write_manifest(uid, shoot_id, request, generated_images)
+        
+        # Settle the hold, log the transaction and save the photoshoot in one transaction
+        try:
+            with generation_stages.measure("commit"):
+                new_credits = await asyncio.to_thread(
+                    FirestoreService.commit_generation,
+                    uid,
+                    credit_cost,
+                    shoot_id,
+                    {
+                        "articleType": request.articleType,
+                        "styleNotes": request.styleNotes,
+                        "imageSize": request.imageSize,
+                        "uploadedImages": request.uploadedImageUrls,
+                        "generatedImages": generated_images,
+                        "renditions": generation_result.get("renditions"),
+                        "manifest": manifest,
+                        "creditsCost": credit_cost,
+                        "isFreeTrial": False,
+                        "status": "completed"
+                    }
+                )
+        except Exception as e:
+            logger.error(f"Failed to commit generation for user {uid}: {str(e)}")
+            raise HTTPException(status_code=500, detail="Failed to process credits")
+    except BaseException:
+        # Refund the hold; a no-op if the commit went through
+        await asyncio.shield(asyncio.to_thread(FirestoreService.release_credits, shoot_id))
+        raise
     
     logger.info(f"Generation completed for user {uid}. Credits: {new_credits}")
     
@@ -135,57 +444,68 @@ async def _handle_authenticated_generation(request: GenerateRequest, shoot_id: s
         status="completed",
         generatedImages=generated_images,
         creditsCost=credit_cost,
-        creditsRemaining=new_credits or 0
+        creditsRemaining=new_credits,
+        renditions=generation_result.get("renditions")
     )
 
 
-async def _handle_anonymous_generation(request: GenerateRequest, shoot_id: str, client_ip: str):
-    """Handle generation for anonymous users (3-image free trial per IP)"""
+async def _handle_anonymous_generation(
+    request: GenerateRequest,
+    shoot_id: str,
+    client_ip: str,
+    on_image: Optional[OnImage] = None
+):
+    """Handle generation for anonymous users (FREE_TRIAL_LIMIT free generations per IP)"""
     
-    # Check anonymous trial status
-    trial_status = FirestoreService.check_anon_trial(client_ip)
+    _check_capacity(PRIORITY_ANON)
     
-    if not trial_status.get("eligible"):
+    # Claim a free trial slot up front; refunded below if generation fails
+    try:
+        count = await asyncio.to_thread(FirestoreService.reserve_anon_trial, client_ip)
+    except AnonTrialExhaustedError:
         logger.warning(f"Anonymous trial exhausted for IP {client_ip}")
         raise HTTPException(
             status_code=402,
-            detail="Free trial limit reached (3 images). Please log in to continue."
+            detail=f"Free trial limit reached ({settings.FREE_TRIAL_LIMIT} images). Please log in to continue."
         )
     
     logger.info(f"Anonymous generation for IP {client_ip}: {request.articleType}")
     
-    # Call generation service
-    generation_result = GenerationService.generate_photoshoot(
-        reference_images=request.uploadedImageUrls,
-        article_type=request.articleType,
-        style_notes=request.styleNotes or "",
-        image_size=request.imageSize
-    )
-    
-    if not generation_result.get("success"):
-        logger.error(f"Generation failed: {generation_result.get('message')}")
-        raise HTTPException(status_code=500, detail=generation_result.get("message"))
-    
-    generated_images = generation_result.get("images", [])
-    
-    # Increment anonymous trial counter
-    count = FirestoreService.increment_anon_trial(client_ip)
-    
     # Create anon user identifier
     ip_hash = FirestoreService.hash_ip(client_ip)
     anon_uid = f"anon-{ip_hash}"
     
-    # Save photoshoot record
-    FirestoreService.save_photoshoot(anon_uid, {
-        "articleType": request.articleType,
-        "styleNotes": request.styleNotes,
-        "imageSize": request.imageSize,
-        "uploadedImages": request.uploadedImageUrls,
-        "generatedImages": generated_images,
-        "creditsCost": 0,
-        "isFreeTrial": True,
-        "status": "completed"
-    })
+    try:
+        request = await _ingest_reference_images(request, anon_uid)
+        
+        # Call generation service (images are streamed into Firebase Storage)
+        generation_result = await _generate(request, PRIORITY_ANON, anon_uid, shoot_id, on_image)
+        
+        generated_images = generation_result.get("images", [])
+        
+        manifest = await _write_manifest(anon_uid, shoot_id, request, generated_images)
+        
+        # Confirm the trial slot and save the photoshoot in one transaction
+        try:
+            await asyncio.to_thread(FirestoreService.commit_anon_generation, client_ip, shoot_id, {
+                "articleType": request.articleType,
+                "styleNotes": request.styleNotes,
+                "imageSize": request.imageSize,
+                "uploadedImages": request.uploadedImageUrls,
+                "generatedImages": generated_images,
+                "renditions": generation_result.get("renditions"),
+                "manifest": manifest,
+                "creditsCost": 0,
+                "isFreeTrial": True,
+                "status": "completed"
+            })
+        except Exception as e:
+            logger.error(f"Failed to commit anonymous generation for IP {client_ip}: {str(e)}")
+            raise HTTPException(status_code=500, detail="Failed to save photoshoot")
+    except BaseException:
+        # Nothing was recorded, so the reserved slot is given back
+        await asyncio.shield(asyncio.to_thread(FirestoreService.refund_anon_trial, client_ip))
+        raise
     
     remaining_free = settings.FREE_TRIAL_LIMIT - count
     
@@ -196,5 +516,6 @@ async def _handle_anonymous_generation(request: GenerateRequest, shoot_id: str,
         status="completed",
         generatedImages=generated_images,
         creditsCost=0,
-        creditsRemaining=remaining_free  # For anonymous, show remaining free generations
+        creditsRemaining=remaining_free,  # For anonymous, show remaining free generations
+        renditions=generation_result.get("renditions")
     )
@@ -0,0 +1,120 @@
+"""
+Image serving routes
+Serves stored images from the local backend or the local disk cache
+"""
+
+from fastapi import APIRouter, HTTPException, Header
+from fastapi.responses import RedirectResponse, Response, StreamingResponse
+from typing import BinaryIO, Iterator, Optional
+import asyncio
+import logging
+import mimetypes
+import mmap
+import os
+
+from app.services.blob_store import CAS_PREFIX, IMMUTABLE_CACHE_CONTROL
+from app.services.image_cache import image_cache
+from app.services.storage_backends import LocalStorageBackend, get_backend, validate_blob_path
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+CHUNK_BYTES = 256 * 1024
+
+# Leading bytes of the formats we store; content-addressed blobs have no extension
+_MAGIC = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG", "image/png"),
+    (b"GIF8", "image/gif"),
+    (b"{", "application/json")
+)
+
+
+@router.get("/images/{blob_path:path}")
+async def get_image(blob_path: str, if_none_match: Optional[str] = Header(None)):
+    """
+    Serve a stored image
+
+    With the local backend files are served directly; otherwise they are read
+    through the disk cache (IMAGE_CACHE_DIR), or redirected to the bucket's
+    public URL when the cache is disabled.
+
+    Returns:
+        - 200: Image bytes
+        - 304: Not modified (If-None-Match)
+        - 307: Redirect to the public URL
+        - 400: Invalid path
+        - 404: Image not found
+    """
+    try:
+        validate_blob_path(blob_path)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid image path")
+
+    backend = get_backend(settings.FIREBASE_STORAGE_BUCKET)
+    path = backend.local_path(blob_path)
+    if path is not None:
+        f = _open(path)
+    elif isinstance(backend, LocalStorageBackend):
+        f = None
+    elif not image_cache.enabled:
+        return RedirectResponse(backend.public_url(blob_path), status_code=307)
+    else:
+        f = await asyncio.to_thread(image_cache.fetch, backend, blob_path)
+    if f is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+
+    stat = os.fstat(f.fileno())
+    immutable = blob_path.startswith(CAS_PREFIX + "/")
+    etag = f'"{blob_path.rsplit("/", 1)[-1]}"' if immutable else f'"{stat.st_size:x}-{int(stat.st_mtime):x}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": IMMUTABLE_CACHE_CONTROL if immutable else "public, max-age=3600"
+    }
+    if if_none_match == etag:
+        f.close()
+        return Response(status_code=304, headers=headers)
+
+    headers["Content-Length"] = str(stat.st_size)
+    return StreamingResponse(
+        _mapped_chunks(f),
+        media_type=_content_type(f, blob_path),
+        headers=headers
+    )
+
+
+def _open(path: str) -> Optional[BinaryIO]:
+    """A local file opened for reading, or None if it has since been removed"""
+    try:
+        return open(path, "rb")
+    except FileNotFoundError:
+        return None
+
+
+def _mapped_chunks(f: BinaryIO) -> Iterator[bytes]:
+    """Read an open file through a memory map, chunk by chunk, then close it"""
+    with f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            for offset in range(0, size, CHUNK_BYTES):
+                yield mapped[offset:offset + CHUNK_BYTES]
+
+
+def _content_type(f: BinaryIO, blob_path: str) -> str:
+    guessed, _ = mimetypes.guess_type(blob_path)
+    if guessed:
+        return guessed
+    head = f.read(16)
+    f.seek(0)
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head[4:12] in (b"ftypavif", b"ftypavis"):
+        return "image/avif"
+    for magic, content_type in _MAGIC:
+        if head.startswith(magic):
+            return content_type
+    return "application/octet-stream"
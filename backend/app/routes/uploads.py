@@ -0,0 +1,260 @@
+"""
+Reference image upload routes
+Accepts multipart uploads, or issues signed URLs so clients upload straight to
+storage, so images don't travel as base64 in the generation request
+"""
+
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import Response
+from starlette.datastructures import FormData, UploadFile
+from starlette.formparsers import MultiPartException, MultiPartParser
+from tempfile import SpooledTemporaryFile
+import asyncio
+import hmac
+import logging
+import time
+
+from app.dependencies import AuthContext, get_auth
+from app.models.request import DirectUploadRequest, CompleteUploadRequest
+from app.models.response import UploadResponse, DirectUploadResponse, DirectUpload
+from app.services.firestore import FirestoreService
+from app.services.ingestion import ImageIngestionService, ImageIngestionError
+from app.services.storage_backends import LocalStorageBackend, get_backend, validate_blob_path
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+
+@router.post("/uploads")
+async def upload_reference_images(req: Request, auth: AuthContext = Depends(get_auth)):
+    """
+    Upload reference images as multipart/form-data
+    
+    Form fields:
+        - files: one or more image files (JPEG, PNG or WebP, max 5)
+        - idToken: Firebase ID token if there is no Authorization header
+          (deprecated), empty for anonymous users
+    
+    Files are spooled to disk while the form is parsed and decoded straight
+    from there, so memory use does not grow with file size. The request size
+    limit is enforced as the body arrives, including chunked bodies without a
+    Content-Length, and each file's limit once the form is parsed. The
+    returned upload IDs go in
+    GenerateRequest.uploadedImageUrls.
+    
+    Returns:
+        - 200: Upload IDs, in the same order as the files
+        - 400: Missing or invalid images
+        - 401: Invalid token
+        - 413: Request or file too large
+        - 500: Storage failed
+    """
+    content_length = req.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > settings.UPLOAD_MAX_REQUEST_BYTES:
+        raise HTTPException(status_code=413, detail="Upload too large")
+    
+    form = await _read_form(req)
+    try:
+        files = [value for value in form.getlist("files") if isinstance(value, UploadFile)]
+        if not files:
+            raise HTTPException(status_code=400, detail="No files uploaded")
+        
+        auth.use_token(form.get("idToken"))
+        owner = _upload_owner(auth, req)
+        
+        upload_ids = []
+        for index, upload in enumerate(files):
+            try:
+                upload_id = await asyncio.to_thread(ImageIngestionService.ingest_upload, upload.file, owner)
+            except ImageIngestionError as e:
+                raise HTTPException(status_code=400, detail=f"File {index + 1}: {str(e)}")
+            
+            if upload_id is None:
+                raise HTTPException(status_code=500, detail="Failed to store upload")
+            upload_ids.append(upload_id)
+        
+        return UploadResponse(uploadIds=upload_ids)
+    finally:
+        await form.close()
+
+
+@router.post("/uploads/sign")
+async def sign_direct_uploads(request: DirectUploadRequest, req: Request, auth: AuthContext = Depends(get_auth)):
+    """
+    Issue short-lived signed URLs for uploading reference images directly to storage
+    
+    The client PUTs each file to its URL with the returned headers, then calls
+    /api/uploads/complete with the upload keys. Image bytes never pass
+    through the API server.
+    
+    Returns:
+        - 200: One signed upload per file, in the same order
+        - 400: No files, too many files or unsupported content type
+        - 401: Invalid token
+        - 413: File too large
+    """
+    if not request.files:
+        raise HTTPException(status_code=400, detail="No files requested")
+    if len(request.files) > settings.MAX_REFERENCE_IMAGES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {settings.MAX_REFERENCE_IMAGES} reference images are allowed"
+        )
+    
+    owner = _upload_owner(auth, req)
+    
+    uploads = []
+    for index, file in enumerate(request.files):
+        if file.size > settings.INGEST_MAX_BYTES:
+            raise HTTPException(
+                status_code=413,
+                detail=f"File {index + 1} exceeds {settings.INGEST_MAX_BYTES} bytes"
+            )
+        try:
+            signed = await asyncio.to_thread(ImageIngestionService.create_direct_upload, file.contentType, owner)
+        except ImageIngestionError as e:
+            raise HTTPException(status_code=400, detail=f"File {index + 1}: {str(e)}")
+        uploads.append(DirectUpload(**signed))
+    
+    return DirectUploadResponse(uploads=uploads)
+
+
+@router.post("/uploads/complete")
+async def complete_direct_uploads(request: CompleteUploadRequest, req: Request, auth: AuthContext = Depends(get_auth)):
+    """
+    Register images uploaded through signed URLs
+    
+    Checks that each object exists and looks like an image, without
+    downloading it. The returned upload IDs go in
+    GenerateRequest.uploadedImageUrls.
+    
+    Returns:
+        - 200: Upload IDs, in the same order as the keys
+        - 400: Unknown key, missing upload or not an image
+        - 401: Invalid token
+    """
+    if not request.uploadKeys or len(request.uploadKeys) > settings.MAX_REFERENCE_IMAGES:
+        raise HTTPException(status_code=400, detail="Invalid number of upload keys")
+    
+    owner = _upload_owner(auth, req)
+    
+    upload_ids = []
+    for upload_key in request.uploadKeys:
+        try:
+            upload_id = await asyncio.to_thread(ImageIngestionService.complete_direct_upload, upload_key, owner)
+        except ImageIngestionError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        upload_ids.append(upload_id)
+    
+    return UploadResponse(uploadIds=upload_ids)
+
+
+@router.put("/uploads/direct/{blob_path:path}")
+async def put_direct_upload(
+    blob_path: str,
+    req: Request,
+    contentType: str,
+    maxBytes: int,
+    expires: int,
+    signature: str
+):
+    """
+    Signed upload target for the local storage backend
+    
+    Stands in for the bucket's signed PUT URLs when STORAGE_BACKEND=local.
+    The body is spooled to disk while it is received.
+    
+    Returns:
+        - 200: Stored
+        - 403: Bad or expired signature, or wrong Content-Type
+        - 404: Not using the local backend
+        - 413: Body larger than the signed limit
+    """
+    backend = get_backend(settings.FIREBASE_STORAGE_BUCKET)
+    if not isinstance(backend, LocalStorageBackend):
+        raise HTTPException(status_code=404, detail="Not found")
+    
+    try:
+        validate_blob_path(blob_path)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid upload path")
+    
+    expected = backend.upload_signature(blob_path, contentType, maxBytes, expires)
+    if not hmac.compare_digest(expected, signature) or expires < time.time():
+        raise HTTPException(status_code=403, detail="Invalid or expired signature")
+    if req.headers.get("content-type") != contentType:
+        raise HTTPException(status_code=403, detail="Content-Type does not match the signature")
+    
+    with SpooledTemporaryFile(max_size=1024 * 1024) as body:
+        received = 0
+        async for chunk in req.stream():
+            received += len(chunk)
+            if received > maxBytes:
+                raise HTTPException(status_code=413, detail="Upload too large")
+            body.write(chunk)
+        await asyncio.to_thread(backend.upload, blob_path, body, contentType)
+    
+    return Response(status_code=200)
+
+
+class _UploadTooLarge(MultiPartException):
+    """Body over its limit; a MultiPartException so the parser closes its files"""
+
+
+async def _limited_stream(req: Request, max_bytes: int):
+    """The request body, stopped once it passes max_bytes"""
+    received = 0
+    async for chunk in req.stream():
+        received += len(chunk)
+        if received > max_bytes:
+            raise _UploadTooLarge("Upload too large")
+        yield chunk
+
+
+async def _read_form(req: Request) -> FormData:
+    """
+    Parse a multipart upload form, counting bytes as they are received
+    
+    The request limit stops the body as it arrives, which also bounds what a
+    single file can spool; each file's own limit is checked once it is parsed.
+    
+    Raises:
+        HTTPException: 400 for a malformed form, 413 when the body or a file
+            is over its limit
+    """
+    content_type = req.headers.get("content-type", "")
+    if not content_type.startswith("multipart/form-data"):
+        raise HTTPException(status_code=400, detail="No files uploaded")
+    
+    parser = MultiPartParser(
+        req.headers,
+        _limited_stream(req, settings.UPLOAD_MAX_REQUEST_BYTES),
+        max_files=settings.MAX_REFERENCE_IMAGES,
+        max_fields=10
+    )
+    try:
+        form = await parser.parse()
+    except _UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=e.message)
+    except MultiPartException as e:
+        raise HTTPException(status_code=400, detail=e.message)
+    
+    files = [value for value in form.getlist("files") if isinstance(value, UploadFile)]
+    for index, upload in enumerate(files):
+        if upload.size > settings.INGEST_MAX_BYTES:
+            await form.close()
+            raise HTTPException(
+                status_code=413,
+                detail=f"File {index + 1} exceeds {settings.INGEST_MAX_BYTES} bytes"
+            )
+    return form
+
+
+def _upload_owner(auth: AuthContext, req: Request) -> str:
+    """User ID of an authenticated caller, or "anon-{ipHash}" without a token"""
+    if auth.authenticated:
+        return auth.require_uid()
+    client_ip = req.client.host if req.client else "unknown"
+    return f"anon-{FirestoreService.hash_ip(client_ip)}"
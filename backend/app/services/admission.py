@@ -0,0 +1,230 @@
+"""
+Admission control and fair scheduling for provider calls
+Bounds concurrent generations, shares capacity between priority classes with
+weighted fair queueing, and fails fast when a class's wait queue is full
+"""
+
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Dict, Optional
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Priority classes, from most to least important
+PRIORITY_PAID = "paid"  # Users who have purchased credits
+PRIORITY_BONUS = "bonus"  # Users spending first-login bonus credits
+PRIORITY_ANON = "anon"  # Anonymous free trial
+
+# Weight of the newest sample in the service-time moving average
+_EWMA_ALPHA = 0.2
+
+# Queue-wait samples kept per class for percentile metrics
+_WAIT_SAMPLES = 1000
+
+
+class AdmissionRejectedError(Exception):
+    """Raised when a priority class's wait queue is full"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Generation capacity exhausted, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    """A queued call and its fair-queueing finish tag"""
+
+    def __init__(self, finish_tag: float):
+        self.finish_tag = finish_tag
+        self.future = asyncio.get_running_loop().create_future()
+        self.enqueued_at = time.monotonic()
+
+
+class _PriorityClass:
+    """Per-class limits, queue and wait statistics"""
+
+    def __init__(self, name: str, weight: int, max_concurrency: int, max_queue: int):
+        self.name = name
+        self.weight = weight
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self.waiters: Deque[_Waiter] = deque()
+        self.last_finish = 0.0
+        self.waits: Deque[float] = deque(maxlen=_WAIT_SAMPLES)
+        self.stats = {"admitted": 0, "queued": 0, "rejected": 0}
+
+    def eligible(self) -> bool:
+        # Waiters cancelled since they were queued are dropped, never admitted
+        while self.waiters and self.waiters[0].future.done():
+            self.waiters.popleft()
+        return bool(self.waiters) and self.in_flight < self.max_concurrency
+
+    def wait_stats(self) -> Dict[str, float]:
+        if not self.waits:
+            return {"p50WaitSeconds": 0.0, "p99WaitSeconds": 0.0, "maxWaitSeconds": 0.0}
+        ordered = sorted(self.waits)
+        return {
+            "p50WaitSeconds": round(ordered[int(0.50 * (len(ordered) - 1))], 3),
+            "p99WaitSeconds": round(ordered[int(0.99 * (len(ordered) - 1))], 3),
+            "maxWaitSeconds": round(ordered[-1], 3)
+        }
+
+
+class AdmissionController:
+    """
+    Global concurrency limiter with weighted fair queueing between classes
+
+    Each class has its own concurrency cap and bounded FIFO queue. When a slot
+    frees up it goes to the eligible class whose head-of-line waiter has the
+    smallest start-time-fair-queueing finish tag, so under contention classes
+    receive capacity in proportion to their weights.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int,
+        weights: Dict[str, int],
+        class_concurrency: Dict[str, int],
+        class_queue: Dict[str, int],
+        expected_seconds: float
+    ):
+        self.max_concurrency = max_concurrency
+        self._classes = {
+            name: _PriorityClass(
+                name,
+                weight=weight,
+                max_concurrency=min(class_concurrency.get(name, max_concurrency), max_concurrency),
+                max_queue=class_queue.get(name, 0)
+            )
+            for name, weight in weights.items()
+        }
+        self._in_flight = 0
+        self._virtual_time = 0.0
+        self._avg_service_seconds = expected_seconds
+
+    @asynccontextmanager
+    async def slot(self, priority: str) -> AsyncIterator[None]:
+        """
+        Hold one concurrency slot for the duration of the block
+
+        Raises:
+            AdmissionRejectedError: no slot is free and the class queue is full
+        """
+        cls = self._class(priority)
+        await self._acquire(cls)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - started
+            self._avg_service_seconds += _EWMA_ALPHA * (elapsed - self._avg_service_seconds)
+            self._release(cls)
+
+    def saturated(self, priority: str) -> bool:
+        """True if a new call in this class would be rejected right now"""
+        cls = self._class(priority)
+        return not self._can_admit(cls) and len(cls.waiters) >= cls.max_queue
+
+    def retry_after(self, priority: str) -> int:
+        """Seconds until the class backlog has likely drained enough to admit a new call"""
+        cls = self._class(priority)
+        backlog = len(cls.waiters) + 1
+        return max(1, math.ceil(self._avg_service_seconds * backlog / cls.max_concurrency))
+
+    def stats(self) -> Dict[str, Any]:
+        """Current in-flight and queued counts plus per-class counters and queue waits"""
+        return {
+            "inFlight": self._in_flight,
+            "waiting": sum(len(cls.waiters) for cls in self._classes.values()),
+            "maxConcurrency": self.max_concurrency,
+            "avgServiceSeconds": round(self._avg_service_seconds, 2),
+            "classes": {
+                name: {
+                    **cls.stats,
+                    **cls.wait_stats(),
+                    "inFlight": cls.in_flight,
+                    "waiting": len(cls.waiters),
+                    "weight": cls.weight,
+                    "maxConcurrency": cls.max_concurrency,
+                    "maxQueue": cls.max_queue
+                }
+                for name, cls in self._classes.items()
+            }
+        }
+
+    def _class(self, priority: str) -> _PriorityClass:
+        return self._classes.get(priority) or self._classes[PRIORITY_ANON]
+
+    def _can_admit(self, cls: _PriorityClass) -> bool:
+        return (
+            self._in_flight < self.max_concurrency
+            and cls.in_flight < cls.max_concurrency
+            and not cls.waiters
+        )
+
+    def _tag(self, cls: _PriorityClass) -> float:
+        start = max(self._virtual_time, cls.last_finish)
+        cls.last_finish = start + 1.0 / cls.weight
+        return cls.last_finish
+
+    async def _acquire(self, cls: _PriorityClass) -> None:
+        if self._can_admit(cls):
+            self._virtual_time = self._tag(cls) - 1.0 / cls.weight
+            self._admit(cls, wait_seconds=0.0)
+            return
+
+        if len(cls.waiters) >= cls.max_queue:
+            cls.stats["rejected"] += 1
+            raise AdmissionRejectedError(self.retry_after(cls.name))
+
+        waiter = _Waiter(self._tag(cls))
+        cls.waiters.append(waiter)
+        cls.stats["queued"] += 1
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # The slot was granted just as we were cancelled: give it back
+                self._release(cls)
+            elif waiter in cls.waiters:
+                cls.waiters.remove(waiter)
+            raise
+
+    def _admit(self, cls: _PriorityClass, wait_seconds: float) -> None:
+        self._in_flight += 1
+        cls.in_flight += 1
+        cls.stats["admitted"] += 1
+        cls.waits.append(wait_seconds)
+
+    def _release(self, cls: _PriorityClass) -> None:
+        self._in_flight -= 1
+        cls.in_flight -= 1
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        while self._in_flight < self.max_concurrency:
+            chosen: Optional[_PriorityClass] = None
+            for cls in self._classes.values():
+                if cls.eligible() and (chosen is None or cls.waiters[0].finish_tag < chosen.waiters[0].finish_tag):
+                    chosen = cls
+            if chosen is None:
+                return
+            waiter = chosen.waiters.popleft()
+            self._virtual_time = waiter.finish_tag - 1.0 / chosen.weight
+            self._admit(chosen, wait_seconds=time.monotonic() - waiter.enqueued_at)
+            waiter.future.set_result(None)
+
+
+generation_admission = AdmissionController(
+    max_concurrency=settings.GENERATION_MAX_CONCURRENCY,
+    weights=settings.GENERATION_CLASS_WEIGHTS,
+    class_concurrency=settings.GENERATION_CLASS_MAX_CONCURRENCY,
+    class_queue=settings.GENERATION_CLASS_MAX_QUEUE,
+    expected_seconds=settings.GENERATION_EXPECTED_SECONDS
+)
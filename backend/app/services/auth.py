@@ -7,6 +7,9 @@ from firebase_admin import credentials, auth
 import logging
 from typing import Optional, Tuple
 
+from app.services.signing_keys import signing_keys
+from app.services.token_cache import token_cache
+
 logger = logging.getLogger(__name__)
 
 
@@ -14,20 +17,42 @@ class AuthService:
     """Firebase authentication service"""
     
     @staticmethod
-    def verify_id_token(id_token: str) -> Optional[dict]:
+    def verify_id_token(id_token: str, check_revoked: bool = False) -> Optional[dict]:
         """
         Verify Firebase ID token
         
+        Verified claims are cached until the token expires, so only the first
+        request with a token pays for signature verification. That check uses
+        the prefetched signing keys; firebase_admin (which may fetch them
+        itself) is only used when they cannot decide or for check_revoked.
+        
         Args:
             id_token: Firebase ID token from client
+            check_revoked: Also ask Firebase whether the user's sessions were
+                revoked (a network call; bypasses the cache)
             
         Returns:
             Decoded token dict with user info, or None if invalid
         """
+        if not id_token:
+            return None
+        
+        if not check_revoked:
+            cached = token_cache.get(id_token)
+            if cached is not None:
+                return cached
+        
         try:
-            decoded = auth.verify_id_token(id_token)
+            decoded = None if check_revoked else signing_keys.verify(id_token)
+            if decoded is None:
+                decoded = auth.verify_id_token(id_token, check_revoked=check_revoked)
             logger.info(f"Token verified for user: {decoded.get('email')}")
+            token_cache.put(id_token, decoded)
             return decoded
+        except auth.RevokedIdTokenError:
+            logger.warning("Revoked ID token")
+            AuthService._forget_revoked(id_token)
+            return None
         except auth.InvalidIdTokenError:
             logger.warning("Invalid ID token")
             return None
@@ -39,16 +64,32 @@ class AuthService:
             return None
     
     @staticmethod
-    def get_uid_from_token(id_token: str) -> Optional[str]:
-        """Extract user ID from Firebase token"""
-        decoded = AuthService.verify_id_token(id_token)
-        return decoded.get("uid") if decoded else None
+    def revoke_sessions(uid: str) -> bool:
+        """
+        Revoke all of a user's sessions
+        
+        Firebase stops issuing tokens from the user's refresh tokens, and this
+        process stops accepting their cached ID tokens. Other processes keep
+        accepting already-cached tokens until those expire (at most an hour).
+        """
+        token_cache.revoke_user(uid)
+        try:
+            auth.revoke_refresh_tokens(uid)
+            logger.info(f"Revoked sessions of user {uid}")
+            return True
+        except Exception as e:
+            logger.error(f"Failed to revoke sessions of user {uid}: {str(e)}")
+            return False
     
     @staticmethod
-    def get_email_from_token(id_token: str) -> Optional[str]:
-        """Extract email from Firebase token"""
-        decoded = AuthService.verify_id_token(id_token)
-        return decoded.get("email") if decoded else None
+    def _forget_revoked(id_token: str) -> None:
+        """Drop cached tokens of a user Firebase reports as revoked"""
+        try:
+            # Signature and expiry were fine; only the revocation check failed
+            claims = signing_keys.verify(id_token) or auth.verify_id_token(id_token)
+        except Exception:
+            return
+        token_cache.revoke_user(claims.get("uid"))
     
     @staticmethod
     def create_user(email: str, password: str = None, display_name: str = None):
@@ -0,0 +1,308 @@
+"""
+Content-addressed blob store
+Stores each distinct file once under blobs/sha256/, keyed by its SHA-256,
+with a local index so known blobs are never uploaded twice
+"""
+
+import hashlib
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, BinaryIO, Dict, List, Optional, Tuple, Union
+
+from app.config import settings
+from app.services.storage import StorageService
+
+logger = logging.getLogger(__name__)
+
+CAS_PREFIX = "blobs/sha256"
+MANIFEST_PREFIX = "manifests"
+
+# Blobs never change once written, so clients and CDNs may cache them forever
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+_DIGEST_IN_URL = re.compile(r"blobs/sha256/[0-9a-f]{2}/([0-9a-f]{64})")
+_HASH_CHUNK_BYTES = 1024 * 1024
+
+
+def blob_path(digest: str) -> str:
+    """Bucket path of the blob with this SHA-256 (hex)"""
+    return f"{CAS_PREFIX}/{digest[:2]}/{digest}"
+
+
+def digest_from_url(url: str) -> Optional[str]:
+    """SHA-256 of a content-addressed blob URL, or None for other URLs"""
+    match = _DIGEST_IN_URL.search(url)
+    return match.group(1) if match else None
+
+
+def file_digest(file_obj: BinaryIO) -> str:
+    """SHA-256 of a file, read in chunks"""
+    file_obj.seek(0)
+    sha = hashlib.sha256()
+    while True:
+        chunk = file_obj.read(_HASH_CHUNK_BYTES)
+        if not chunk:
+            break
+        sha.update(chunk)
+    file_obj.seek(0)
+    return sha.hexdigest()
+
+
+class BlobIndex:
+    """
+    Local record of blobs known to exist in the bucket
+
+    An in-memory LRU in front of an optional SQLite table. Also records which
+    owners stored each blob, so upload IDs stay private to their uploader even
+    though the bytes are shared.
+    """
+
+    def __init__(self, max_entries: int, sqlite_path: Optional[str] = None):
+        self.max_entries = max_entries
+        # digest -> {"url", "size", "contentType", "renditions"}
+        self._memory: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._claims: Dict[str, set] = {}
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+        if sqlite_path:
+            try:
+                self._conn = sqlite3.connect(sqlite_path, check_same_thread=False, isolation_level=None)
+                self._conn.execute("PRAGMA journal_mode=WAL")
+                self._conn.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS blobs (
+                        digest TEXT PRIMARY KEY,
+                        url TEXT NOT NULL,
+                        size INTEGER NOT NULL,
+                        contentType TEXT NOT NULL,
+                        renditions TEXT,
+                        createdAt REAL NOT NULL
+                    )
+                    """
+                )
+                self._conn.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS claims (
+                        digest TEXT NOT NULL,
+                        owner TEXT NOT NULL,
+                        PRIMARY KEY (digest, owner)
+                    )
+                    """
+                )
+            except sqlite3.Error as e:
+                logger.warning(f"Blob index falling back to memory only: {str(e)}")
+                self._conn = None
+
+    def get(self, digest: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            record = self._memory.get(digest)
+            if record:
+                self._memory.move_to_end(digest)
+                return record
+            if self._conn is None:
+                return None
+            row = self._conn.execute(
+                "SELECT url, size, contentType, renditions FROM blobs WHERE digest = ?",
+                (digest,)
+            ).fetchone()
+            if not row:
+                return None
+            record = {
+                "url": row[0],
+                "size": row[1],
+                "contentType": row[2],
+                "renditions": json.loads(row[3]) if row[3] else None
+            }
+            self._remember(digest, record)
+            return record
+
+    def put(self, digest: str, record: Dict[str, Any]) -> None:
+        with self._lock:
+            self._remember(digest, record)
+            if self._conn is None:
+                return
+            try:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO blobs (digest, url, size, contentType, renditions, createdAt) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (
+                        digest,
+                        record["url"],
+                        record["size"],
+                        record["contentType"],
+                        json.dumps(record["renditions"]) if record.get("renditions") else None,
+                        time.time()
+                    )
+                )
+            except sqlite3.Error as e:
+                logger.warning(f"Failed to persist blob index entry {digest[:12]}: {str(e)}")
+
+    def claim(self, digest: str, owner: str) -> None:
+        with self._lock:
+            if self._conn is None:
+                self._claims.setdefault(digest, set()).add(owner)
+                return
+            try:
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO claims (digest, owner) VALUES (?, ?)",
+                    (digest, owner)
+                )
+            except sqlite3.Error as e:
+                logger.warning(f"Failed to persist blob claim {digest[:12]}: {str(e)}")
+
+    def claimed(self, digest: str, owner: str) -> bool:
+        with self._lock:
+            if self._conn is None:
+                return owner in self._claims.get(digest, ())
+            row = self._conn.execute(
+                "SELECT 1 FROM claims WHERE digest = ? AND owner = ?",
+                (digest, owner)
+            ).fetchone()
+            return row is not None
+
+    def __len__(self) -> int:
+        return len(self._memory)
+
+    def _remember(self, digest: str, record: Dict[str, Any]) -> None:
+        self._memory[digest] = record
+        self._memory.move_to_end(digest)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+
+class ContentAddressedStore:
+    """Deduplicating blob storage on top of StorageService"""
+
+    def __init__(self, bucket_name: str, index: BlobIndex):
+        self.bucket_name = bucket_name
+        self.index = index
+        self._stats = {"hits": 0, "uploads": 0, "failures": 0, "bytesSaved": 0}
+
+    def put(
+        self,
+        data: Union[bytes, BinaryIO],
+        content_type: str,
+        digest: Optional[str] = None
+    ) -> Optional[Tuple[str, str]]:
+        """
+        Store data once, skipping the upload if the blob is already indexed
+
+        Args:
+            data: Bytes or a seekable binary file
+            content_type: MIME type stored with the blob
+            digest: SHA-256 of data if already known
+
+        Returns:
+            (digest, public URL) or None if the upload failed
+        """
+        if digest is None:
+            digest = hashlib.sha256(data).hexdigest() if isinstance(data, bytes) else file_digest(data)
+
+        record = self.index.get(digest)
+        if record:
+            self._stats["hits"] += 1
+            self._stats["bytesSaved"] += record["size"]
+            return digest, record["url"]
+
+        path = blob_path(digest)
+        if isinstance(data, bytes):
+            size = len(data)
+            url = StorageService.upload_bytes(
+                self.bucket_name, path, data, content_type, cache_control=IMMUTABLE_CACHE_CONTROL
+            )
+        else:
+            data.seek(0, 2)
+            size = data.tell()
+            url = StorageService.upload_file(
+                self.bucket_name, path, data, content_type, cache_control=IMMUTABLE_CACHE_CONTROL
+            )
+        if url is None:
+            self._stats["failures"] += 1
+            return None
+
+        self._stats["uploads"] += 1
+        self.index.put(digest, {"url": url, "size": size, "contentType": content_type, "renditions": None})
+        return digest, url
+
+    def claim(self, digest: str, owner: str) -> None:
+        """Record that owner stored this blob"""
+        self.index.claim(digest, owner)
+
+    def claimed(self, digest: str, owner: str) -> bool:
+        """True if owner has stored this blob"""
+        return self.index.claimed(digest, owner)
+
+    def lookup(self, digest: str) -> Optional[str]:
+        """URL of a stored blob, checking the bucket if the index doesn't know it"""
+        record = self.index.get(digest)
+        if record:
+            return record["url"]
+        return StorageService.get_download_url(self.bucket_name, blob_path(digest))
+
+    def renditions(self, digest: str) -> Optional[Dict[str, Any]]:
+        """Renditions already created for a blob"""
+        record = self.index.get(digest)
+        return record.get("renditions") if record else None
+
+    def set_renditions(self, digest: str, renditions: Dict[str, Any]) -> None:
+        """Remember a blob's renditions so identical images are rendered once"""
+        record = self.index.get(digest)
+        if record:
+            self.index.put(digest, {**record, "renditions": renditions})
+
+    def write_manifest(
+        self,
+        owner: str,
+        shoot_id: str,
+        uploaded: List[str],
+        generated: List[str]
+    ) -> Optional[str]:
+        """
+        Store a per-shoot manifest listing the blobs it uses
+
+        Images that are not content-addressed (external URLs) are listed by URL.
+
+        Returns:
+            Manifest path in the bucket, or None if it could not be written
+        """
+        def entries(urls: List[str]) -> List[Dict[str, str]]:
+            result = []
+            for url in urls:
+                digest = digest_from_url(url)
+                result.append({"sha256": digest} if digest else {"url": url})
+            return result
+
+        manifest = {
+            "shoot_id": shoot_id,
+            "owner": owner,
+            "blobPrefix": CAS_PREFIX,
+            "uploaded": entries(uploaded),
+            "generated": entries(generated)
+        }
+        path = f"{MANIFEST_PREFIX}/{owner}/{shoot_id}.json"
+        url = StorageService.upload_bytes(
+            self.bucket_name,
+            path,
+            json.dumps(manifest).encode(),
+            content_type="application/json"
+        )
+        return path if url else None
+
+    def stats(self) -> Dict[str, int]:
+        """Dedup counters"""
+        return {**self._stats, "indexed": len(self.index)}
+
+
+blob_store = ContentAddressedStore(
+    bucket_name=settings.FIREBASE_STORAGE_BUCKET,
+    index=BlobIndex(
+        max_entries=settings.CAS_INDEX_MAX_ENTRIES,
+        sqlite_path=settings.CAS_INDEX_SQLITE_PATH or None
+    )
+)
@@ -0,0 +1,51 @@
+"""
+Credit hold sweeper
+Periodically returns credits held by generations that never finished
+"""
+
+import asyncio
+import logging
+from typing import Dict, Optional
+
+from app.config import settings
+from app.services.firestore import FirestoreService
+
+logger = logging.getLogger(__name__)
+
+
+class CreditHoldSweeper:
+    """Background task releasing expired credit holds"""
+
+    def __init__(self, interval_seconds: float):
+        self.interval_seconds = interval_seconds
+        self._task: Optional[asyncio.Task] = None
+        self._stats = {"sweeps": 0, "released": 0, "failures": 0}
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run(), name="credit-hold-sweeper")
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def stats(self) -> Dict[str, int]:
+        """Sweep counters"""
+        return dict(self._stats)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                released = await asyncio.to_thread(FirestoreService.release_expired_holds)
+                self._stats["sweeps"] += 1
+                self._stats["released"] += released
+                if released:
+                    logger.warning(f"Released {released} expired credit holds")
+            except Exception as e:
+                self._stats["failures"] += 1
+                logger.error(f"Credit hold sweep failed: {str(e)}")
+            await asyncio.sleep(self.interval_seconds)
+
+
+credit_hold_sweeper = CreditHoldSweeper(interval_seconds=settings.CREDIT_HOLD_SWEEP_SECONDS)
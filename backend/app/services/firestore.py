@@ -5,11 +5,17 @@ Handles user data, credits, transactions, and anonymous trial tracking
 
 import firebase_admin
 from firebase_admin import credentials, firestore
-from datetime import datetime
-from typing import Optional, Dict, Any
+from datetime import datetime, timedelta
+from typing import Optional, Dict, Any, Iterator
 import logging
 import hashlib
 
+from google.cloud.firestore_v1.base_query import FieldFilter
+
+from app.config import settings
+from app.services.trial_filter import exhausted_ips
+from app.services.user_cache import user_cache
+
 logger = logging.getLogger(__name__)
 
 # Initialize Firebase (assume credentials are set via environment or service account)
@@ -24,6 +30,14 @@ except ValueError:
 db = firestore.client()
 
 
+class InsufficientCreditsError(ValueError):
+    """Raised when a user's balance cannot cover a generation"""
+
+
+class AnonTrialExhaustedError(ValueError):
+    """Raised when an IP has used all of its free trial generations"""
+
+
 class FirestoreService:
     """Firestore database service"""
     
@@ -60,6 +74,7 @@ class FirestoreService:
         }
         
         db.collection("users").document(uid).set(user_data)
+        user_cache.put(uid, user_data)
         
         # Log transaction
         db.collection("users").document(uid).collection("transactions").document().set({
@@ -74,10 +89,28 @@ class FirestoreService:
         return user_data
     
     @staticmethod
-    def get_user(uid: str) -> Optional[Dict[str, Any]]:
-        """Get user document"""
+    def get_user(uid: str, fresh: bool = False) -> Optional[Dict[str, Any]]:
+        """
+        Get user document
+        
+        Served from the user cache when possible, so it may be up to
+        USER_CACHE_TTL_SECONDS behind writes made by other processes.
+        
+        Args:
+            uid: User ID
+            fresh: Always read from Firestore (for balance-critical reads)
+        """
+        if not fresh:
+            cached = user_cache.get(uid)
+            if cached is not None:
+                return cached
+        
         doc = db.collection("users").document(uid).get()
-        return doc.to_dict() if doc.exists else None
+        if not doc.exists:
+            return None
+        user_data = doc.to_dict()
+        user_cache.put(uid, user_data)
+        return user_data
     
     @staticmethod
     def check_anon_trial(ip_address: str) -> Dict[str, Any]:
@@ -92,6 +125,13 @@ class FirestoreService:
             }
         """
         ip_hash = FirestoreService.hash_ip(ip_address)
+        if ip_hash in exhausted_ips:
+            return {
+                "eligible": False,
+                "generationCount": settings.FREE_TRIAL_LIMIT,
+                "status": "exhausted"
+            }
+        
         doc = db.collection("anonUsers").document(ip_hash).get()
         
         if not doc.exists:
@@ -104,68 +144,180 @@ class FirestoreService:
         
         data = doc.to_dict()
         return {
-            "eligible": data.get("generationCount", 0) < 3,
+            "eligible": data.get("generationCount", 0) < settings.FREE_TRIAL_LIMIT,
             "generationCount": data.get("generationCount", 0),
             "status": data.get("status", "eligible")
         }
     
     @staticmethod
-    def increment_anon_trial(ip_address: str) -> int:
+    def reserve_anon_trial(ip_address: str) -> int:
         """
-        Increment anonymous trial counter
+        Claim one free trial generation for an IP before generating
+        
+        Checks and increments the counter in a single transaction, so parallel
+        requests from one IP cannot exceed FREE_TRIAL_LIMIT. Give the slot back
+        with refund_anon_trial if generation fails, or make it final with
+        commit_anon_generation once it succeeds. Only committed generations
+        mark the IP as exhausted.
         
         Returns:
-            New generation count
+            Generation count including this one
+            
+        Raises:
+            AnonTrialExhaustedError: the IP has no free generations left
         """
         ip_hash = FirestoreService.hash_ip(ip_address)
+        if ip_hash in exhausted_ips:
+            raise AnonTrialExhaustedError(f"Free trial exhausted for IP {ip_hash}")
+        
         now = datetime.utcnow().isoformat()
+        doc_ref = db.collection("anonUsers").document(ip_hash)
         
-        def increment_counter(txn):
-            doc_ref = db.collection("anonUsers").document(ip_hash)
-            doc = txn.get(doc_ref)
-            
-            if doc.exists:
-                current_count = doc.get("generationCount", 0)
-                new_count = current_count + 1
-            else:
-                new_count = 1
+        @firestore.transactional
+        def reserve(txn):
+            doc = doc_ref.get(transaction=txn)
+            current_count = doc.get("generationCount", 0) if doc.exists else 0
             
-            new_status = "exhausted" if new_count >= 3 else "eligible"
+            if current_count >= settings.FREE_TRIAL_LIMIT:
+                raise AnonTrialExhaustedError(f"Free trial exhausted for IP {ip_hash}")
             
-            txn.set(doc_ref, {
+            new_count = current_count + 1
+            fields = {
                 "ipAddress": ip_address,
                 "ipHash": ip_hash,
                 "generationCount": new_count,
-                "firstGenerationAt": doc.get("firstGenerationAt") if doc.exists else now,
-                "lastGenerationAt": now,
-                "status": new_status
-            })
+                "lastGenerationAt": now
+            }
+            if not doc.exists:
+                fields.update({"firstGenerationAt": now, "confirmedCount": 0, "status": "eligible"})
+            txn.set(doc_ref, fields, merge=True)
             
             return new_count
         
-        transaction = db.transaction()
-        count = transaction(increment_counter)
-        logger.info(f"Incremented anon trial for IP {ip_hash}: {count}/3")
+        count = reserve(db.transaction())
+        logger.info(f"Reserved anon trial for IP {ip_hash}: {count}/{settings.FREE_TRIAL_LIMIT}")
         return count
     
     @staticmethod
-    def deduct_credits(uid: str, amount: int, shoot_id: str) -> bool:
+    def commit_anon_generation(ip_address: str, shoot_id: str, shoot_data: Dict[str, Any]) -> int:
         """
-        Atomically deduct credits from user
+        Make a reserved trial generation final and record it in one transaction
+        
+        Counts the generation as confirmed and writes the photoshoot document
+        (under "anon-{ipHash}", with shoot_id as its ID) atomically, the
+        anonymous counterpart of commit_generation. Once FREE_TRIAL_LIMIT
+        generations are confirmed, the IP is marked exhausted and added to the
+        exhausted-IP filter, so later requests are refused without a read.
+        Reservations that were refunded never count.
         
         Args:
-            uid: User ID
-            amount: Credits to deduct
-            shoot_id: Photoshoot ID for transaction log
+            ip_address: Client IP address
+            shoot_id: Photoshoot ID
+            shoot_data: Photoshoot fields, as for save_photoshoot
             
         Returns:
-            Success status
+            Number of confirmed generations for the IP
         """
         now = datetime.utcnow().isoformat()
+        ip_hash = FirestoreService.hash_ip(ip_address)
+        doc_ref = db.collection("anonUsers").document(ip_hash)
+        shoot_ref = db.collection("photoshoots").document(f"anon-{ip_hash}").collection("shoots").document(shoot_id)
         
-        def deduct(txn):
-            user_ref = db.collection("users").document(uid)
-            user_doc = txn.get(user_ref)
+        @firestore.transactional
+        def commit(txn):
+            doc = doc_ref.get(transaction=txn)
+            data = doc.to_dict() or {}
+            # Older documents only counted usage in generationCount, which
+            # already includes this reservation
+            confirmed = data.get("confirmedCount", max(data.get("generationCount", 1) - 1, 0)) + 1
+            fields = {"confirmedCount": confirmed}
+            if confirmed >= settings.FREE_TRIAL_LIMIT:
+                fields["status"] = "exhausted"
+            txn.set(doc_ref, fields, merge=True)
+            txn.set(shoot_ref, {**shoot_data, "createdAt": now})
+            return confirmed
+        
+        confirmed = commit(db.transaction())
+        if confirmed >= settings.FREE_TRIAL_LIMIT:
+            exhausted_ips.add(ip_hash)
+        logger.info(f"Committed anonymous photoshoot {shoot_id} for IP {ip_hash}: {confirmed}/{settings.FREE_TRIAL_LIMIT}")
+        return confirmed
+    
+    @staticmethod
+    def exhausted_ip_hashes() -> Iterator[str]:
+        """
+        IP hashes whose trial is used up, for warming the filter
+        
+        Matches on status, which commit_anon_generation sets once confirmed
+        usage reaches the limit and which older documents (written before
+        confirmedCount existed) already carry, so both are loaded.
+        """
+        query = (
+            db.collection("anonUsers")
+            .where(filter=FieldFilter("status", "==", "exhausted"))
+            .select([])
+        )
+        for doc in query.stream():
+            yield doc.id
+    
+    @staticmethod
+    def refund_anon_trial(ip_address: str) -> bool:
+        """
+        Give back a free trial generation reserved by reserve_anon_trial
+        
+        Returns:
+            Success status
+        """
+        ip_hash = FirestoreService.hash_ip(ip_address)
+        doc_ref = db.collection("anonUsers").document(ip_hash)
+        
+        @firestore.transactional
+        def refund(txn):
+            doc = doc_ref.get(transaction=txn)
+            if not doc.exists:
+                return 0
+            
+            new_count = max(0, doc.get("generationCount", 0) - 1)
+            txn.update(doc_ref, {"generationCount": new_count})
+            return new_count
+        
+        try:
+            count = refund(db.transaction())
+            logger.info(f"Refunded anon trial for IP {ip_hash}: {count}/{settings.FREE_TRIAL_LIMIT}")
+            return True
+        except Exception as e:
+            logger.error(f"Failed to refund anon trial for IP {ip_hash}: {str(e)}")
+            return False
+    
+    @staticmethod
+    def reserve_credits(uid: str, amount: int, shoot_id: str) -> int:
+        """
+        Hold credits for a generation before the provider is called
+        
+        The credits leave the balance immediately, so concurrent requests
+        cannot spend them twice. The hold (creditHolds/{shoot_id}) is settled
+        by commit_generation or release_credits, or released by
+        release_expired_holds once CREDIT_HOLD_TTL_SECONDS have passed.
+        
+        Args:
+            uid: User ID
+            amount: Credits to hold
+            shoot_id: Photoshoot ID, also the hold ID
+            
+        Returns:
+            Balance left after the hold
+            
+        Raises:
+            InsufficientCreditsError: balance below amount
+            ValueError: user not found
+        """
+        now = datetime.utcnow()
+        user_ref = db.collection("users").document(uid)
+        hold_ref = db.collection("creditHolds").document(shoot_id)
+        
+        @firestore.transactional
+        def reserve(txn):
+            user_doc = user_ref.get(transaction=txn)
             
             if not user_doc.exists:
                 raise ValueError("User not found")
@@ -173,36 +325,158 @@ class FirestoreService:
             current_credits = user_doc.get("credits", 0)
             
             if current_credits < amount:
-                raise ValueError(f"Insufficient credits: {current_credits} < {amount}")
+                raise InsufficientCreditsError(f"Insufficient credits. You have {current_credits}, need {amount}")
             
             new_credits = current_credits - amount
             
-            # Update credits
             txn.update(user_ref, {"credits": new_credits})
+            txn.set(hold_ref, {
+                "uid": uid,
+                "amount": amount,
+                "createdAt": now.isoformat(),
+                "expiresAt": (now + timedelta(seconds=settings.CREDIT_HOLD_TTL_SECONDS)).isoformat()
+            })
+            
+            return new_credits
+        
+        new_balance = reserve(db.transaction())
+        user_cache.update(uid, {"credits": new_balance})
+        logger.info(f"Held {amount} credits of user {uid} for {shoot_id}. Available: {new_balance}")
+        return new_balance
+    
+    @staticmethod
+    def commit_generation(uid: str, amount: int, shoot_id: str, shoot_data: Dict[str, Any]) -> int:
+        """
+        Charge for a finished generation and record it in one transaction
+        
+        Settles the shoot's credit hold, logs the ledger entry and writes the
+        photoshoot document (with shoot_id as its ID) atomically, so a shoot is
+        never saved without being paid for or paid for without being saved.
+        Any part of the hold above amount is returned (e.g. 0 for a shoot
+        served from the result cache). If there is no hold (none was taken,
+        or it expired and was released), the credits are deducted here instead.
+        
+        Args:
+            uid: User ID
+            amount: Credits to charge
+            shoot_id: Photoshoot ID
+            shoot_data: Photoshoot fields, as for save_photoshoot
+            
+        Returns:
+            New credit balance
+            
+        Raises:
+            InsufficientCreditsError: no hold and balance below amount
+            ValueError: user not found
+        """
+        now = datetime.utcnow().isoformat()
+        user_ref = db.collection("users").document(uid)
+        hold_ref = db.collection("creditHolds").document(shoot_id)
+        shoot_ref = db.collection("photoshoots").document(uid).collection("shoots").document(shoot_id)
+        
+        @firestore.transactional
+        def commit(txn):
+            user_doc = user_ref.get(transaction=txn)
+            hold_doc = hold_ref.get(transaction=txn)
+            
+            if not user_doc.exists:
+                raise ValueError("User not found")
+            
+            current_credits = user_doc.get("credits", 0)
+            
+            held = 0
+            if hold_doc.exists and hold_doc.get("uid") == uid:
+                held = hold_doc.get("amount")
+                txn.delete(hold_ref)
+            
+            if current_credits + held < amount:
+                raise InsufficientCreditsError(f"Insufficient credits: {current_credits} < {amount}")
+            charged = amount
+            new_credits = current_credits + held - amount
+            if new_credits != current_credits:
+                txn.update(user_ref, {"credits": new_credits})
             
-            # Log transaction
             txn.set(
                 user_ref.collection("transactions").document(),
                 {
                     "type": "generation",
-                    "amount": amount,
+                    "amount": charged,
                     "status": "completed",
                     "shootId": shoot_id,
                     "timestamp": now,
                     "details": {"credits_remaining": new_credits}
                 }
             )
+            txn.set(shoot_ref, {**shoot_data, "createdAt": now})
             
             return new_credits
         
+        new_balance = commit(db.transaction())
+        user_cache.update(uid, {"credits": new_balance})
+        logger.info(f"Committed photoshoot {shoot_id} for user {uid}. New balance: {new_balance}")
+        return new_balance
+    
+    @staticmethod
+    def release_credits(shoot_id: str) -> bool:
+        """
+        Return a generation's held credits to the user
+        
+        Safe to call more than once and after the hold was settled; only an
+        outstanding hold is refunded.
+        
+        Returns:
+            True if a hold was released
+        """
+        hold_ref = db.collection("creditHolds").document(shoot_id)
+        
+        @firestore.transactional
+        def release(txn):
+            hold_doc = hold_ref.get(transaction=txn)
+            if not hold_doc.exists:
+                return None
+            
+            uid = hold_doc.get("uid")
+            user_ref = db.collection("users").document(uid)
+            user_doc = user_ref.get(transaction=txn)
+            
+            txn.delete(hold_ref)
+            if not user_doc.exists:
+                return uid, None
+            
+            new_credits = user_doc.get("credits", 0) + hold_doc.get("amount")
+            txn.update(user_ref, {"credits": new_credits})
+            return uid, new_credits
+        
         try:
-            transaction = db.transaction()
-            new_balance = transaction(deduct)
-            logger.info(f"Deducted {amount} credits from user {uid}. New balance: {new_balance}")
-            return True
+            released = release(db.transaction())
         except Exception as e:
-            logger.error(f"Failed to deduct credits: {str(e)}")
+            logger.error(f"Failed to release credit hold {shoot_id}: {str(e)}")
+            return False
+        
+        if released is None:
             return False
+        uid, new_balance = released
+        if new_balance is not None:
+            user_cache.update(uid, {"credits": new_balance})
+        logger.info(f"Released credit hold {shoot_id} for user {uid}. Balance: {new_balance}")
+        return True
+    
+    @staticmethod
+    def release_expired_holds(limit: int = 100) -> int:
+        """
+        Release holds abandoned by crashed or timed-out generations
+        
+        Returns:
+            Number of holds released
+        """
+        now = datetime.utcnow().isoformat()
+        expired = (
+            db.collection("creditHolds")
+            .where(filter=FieldFilter("expiresAt", "<", now))
+            .limit(limit)
+            .stream()
+        )
+        return sum(1 for hold in expired if FirestoreService.release_credits(hold.id))
     
     @staticmethod
     def add_credits(uid: str, amount: int, reason: str = "purchase", payment_method: Optional[str] = None) -> bool:
@@ -231,7 +505,12 @@ class FirestoreService:
             current_credits = user_doc.get("credits", 0)
             new_credits = current_credits + amount
             
-            user_ref.update({"credits": new_credits})
+            updates = {"credits": new_credits}
+            if reason == "purchase":
+                # Purchasing users are scheduled ahead of bonus-credit users
+                updates["creditsPurchased"] = (user_doc.get("creditsPurchased") or 0) + amount
+            user_ref.update(updates)
+            user_cache.update(uid, updates)
             
             # Log transaction
             user_ref.collection("transactions").document().set({
@@ -247,28 +526,31 @@ class FirestoreService:
             return True
         except Exception as e:
             logger.error(f"Failed to add credits: {str(e)}")
+            # The balance may or may not have been written
+            user_cache.invalidate(uid)
             return False
     
     @staticmethod
-    def get_credits(uid: str) -> Optional[int]:
+    def get_credits(uid: str, fresh: bool = False) -> Optional[int]:
         """Get user's current credit balance"""
-        user = FirestoreService.get_user(uid)
+        user = FirestoreService.get_user(uid, fresh=fresh)
         return user.get("credits", 0) if user else None
     
     @staticmethod
-    def save_photoshoot(uid_or_anon: str, shoot_data: Dict[str, Any]) -> str:
+    def save_photoshoot(uid_or_anon: str, shoot_data: Dict[str, Any], shoot_id: Optional[str] = None) -> str:
         """
         Save photoshoot document
         
         Args:
             uid_or_anon: User ID or "anon-{ipHash}"
             shoot_data: Photoshoot data
+            shoot_id: Document ID to use, generated if omitted
             
         Returns:
             Shoot ID
         """
         now = datetime.utcnow().isoformat()
-        shoot_id = db.collection("photoshoots").document().id
+        shoot_id = shoot_id or db.collection("photoshoots").document().id
         
         db.collection("photoshoots").document(uid_or_anon).collection("shoots").document(shoot_id).set({
             "articleType": shoot_data.get("articleType"),
@@ -276,6 +558,8 @@ class FirestoreService:
             "imageSize": shoot_data.get("imageSize"),
             "uploadedImages": shoot_data.get("uploadedImages", []),
             "generatedImages": shoot_data.get("generatedImages", []),
+            "renditions": shoot_data.get("renditions"),
+            "manifest": shoot_data.get("manifest"),
             "creditsCost": shoot_data.get("creditsCost", 0),
             "isFreeTrial": shoot_data.get("isFreeTrial", False),
             "status": shoot_data.get("status", "completed"),
@@ -0,0 +1,193 @@
+"""
+Generation result cache
+Content-addressed cache of provider results keyed on normalized request inputs
+"""
+
+import base64
+import binascii
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Decode base64 in slices of this many characters (multiple of 4)
+_B64_CHUNK_CHARS = 64 * 1024
+
+
+def _image_digest(image: str) -> str:
+    """
+    Hash a reference image
+
+    Data URLs and raw base64 strings are hashed on their decoded bytes, so the
+    same picture always gets the same digest regardless of how it was sent.
+    Anything else (e.g. an http URL) is hashed as a string.
+    """
+    data = image.split(",", 1)[1] if image.startswith("data:") and "," in image else image
+    if not data.startswith("http"):
+        digest = hashlib.sha256()
+        try:
+            for start in range(0, len(data), _B64_CHUNK_CHARS):
+                digest.update(base64.b64decode(data[start:start + _B64_CHUNK_CHARS], validate=True))
+            return f"sha256:{digest.hexdigest()}"
+        except (binascii.Error, ValueError):
+            pass
+    return f"ref:{hashlib.sha256(image.encode()).hexdigest()}"
+
+
+def fingerprint(
+    reference_images: List[str],
+    article_type: str,
+    style_notes: str,
+    image_size: str,
+    owner: str = ""
+) -> str:
+    """
+    Canonical hash of generation inputs
+
+    Text fields are trimmed, lower-cased and whitespace-collapsed; reference
+    images are replaced by digests of their content. The owner (uid or
+    "anon-{ipHash}") is part of the key, because a result's image URLs live
+    under its owner's storage prefix and must never be handed to someone else.
+    """
+    canonical = {
+        "owner": owner or "",
+        "articleType": " ".join((article_type or "").split()).lower(),
+        "styleNotes": " ".join((style_notes or "").split()).lower(),
+        "imageSize": (image_size or "").strip().lower(),
+        "referenceImages": [_image_digest(image) for image in reference_images]
+    }
+    encoded = json.dumps(canonical, sort_keys=True, separators=(",", ":")).encode()
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class GenerationCache:
+    """TTL + LRU cache of generation results with an optional on-disk tier"""
+
+    def __init__(self, ttl_seconds: int, max_entries: int, max_bytes: int, disk_dir: Optional[str] = None):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        # key -> (expires_at, size_bytes, result)
+        self._entries: "OrderedDict[str, Tuple[float, int, Dict[str, Any]]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "diskHits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return a cached result, or None on miss"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry:
+                expires_at, size, result = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return result
+                self._remove(key)
+                self._stats["expirations"] += 1
+
+        record = self._read_disk(key, now)
+        with self._lock:
+            if record is None:
+                self._stats["misses"] += 1
+                return None
+            self._stats["hits"] += 1
+            self._stats["diskHits"] += 1
+            expires_at, result = record
+            self._insert(key, result, expires_at)
+            return result
+
+    def put(self, key: str, result: Dict[str, Any]) -> None:
+        """Store a result under key"""
+        expires_at = time.time() + self.ttl_seconds
+        with self._lock:
+            self._insert(key, result, expires_at)
+        self._write_disk(key, result, expires_at)
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss/eviction counters and current size"""
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "hitRate": round(self._stats["hits"] / lookups, 4) if lookups else 0.0,
+                "entries": len(self._entries),
+                "bytes": self._bytes
+            }
+
+    def _insert(self, key: str, result: Dict[str, Any], expires_at: float) -> None:
+        size = len(json.dumps(result))
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (expires_at, size, result)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self._stats["evictions"] += 1
+
+    def _remove(self, key: str) -> None:
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, key[:2], f"{key}.json")
+
+    def _read_disk(self, key: str, now: float) -> Optional[Tuple[float, Dict[str, Any]]]:
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path) as f:
+                record = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Unreadable cache file {path}: {str(e)}")
+            return None
+
+        if record.get("expiresAt", 0) <= now:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            with self._lock:
+                self._stats["expirations"] += 1
+            return None
+        return record["expiresAt"], record["result"]
+
+    def _write_disk(self, key: str, result: Dict[str, Any], expires_at: float) -> None:
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, "w") as f:
+                json.dump({"expiresAt": expires_at, "result": result}, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Failed to write cache file {path}: {str(e)}")
+
+
+generation_cache = GenerationCache(
+    ttl_seconds=settings.GENERATION_CACHE_TTL_SECONDS,
+    max_entries=settings.GENERATION_CACHE_MAX_ENTRIES,
+    max_bytes=settings.GENERATION_CACHE_MAX_BYTES,
+    disk_dir=settings.GENERATION_CACHE_DIR or None
+)
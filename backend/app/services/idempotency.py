@@ -0,0 +1,211 @@
+"""
+Idempotency-Key support
+Stores the first response for a key and replays it for repeated requests
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+MAX_KEY_LENGTH = 255
+
+# (status_code, JSON body)
+StoredResponse = Tuple[int, Any]
+
+# Client errors caused by the request itself, which a retry with the same body
+# always repeats. Everything else (401, 402, 403, 404, 409, 429...) depends on
+# state that can change, e.g. a refreshed token, new credits or registration.
+DETERMINISTIC_STATUS_CODES = frozenset({400, 422})
+
+
+def _storable(status_code: int) -> bool:
+    """True for outcomes a retry with the same key could not change"""
+    return 200 <= status_code < 300 or status_code in DETERMINISTIC_STATUS_CODES
+
+
+class IdempotencyConflictError(Exception):
+    """Raised when a key is reused with a different request body"""
+
+
+def scoped_key(endpoint: str, principal: str, key: str) -> str:
+    """Namespace a client key by endpoint and caller so keys cannot collide"""
+    return f"{endpoint}:{principal}:{key}"
+
+
+def request_hash(body: Dict[str, Any]) -> str:
+    """Canonical hash of a request body"""
+    encoded = json.dumps(body, sort_keys=True, separators=(",", ":"), default=str).encode()
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class IdempotencyStore:
+    """In-memory LRU of stored responses with an optional SQLite tier"""
+
+    def __init__(self, ttl_seconds: int, max_entries: int, sqlite_path: Optional[str] = None):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        # key -> {"requestHash", "statusCode", "content", "expiresAt"}
+        self._memory: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        # key -> (request hash, future resolving to StoredResponse)
+        self._in_flight: Dict[str, Tuple[str, asyncio.Future]] = {}
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._stats = {"stored": 0, "replayed": 0, "joined": 0, "conflicts": 0}
+
+        if sqlite_path:
+            try:
+                self._conn = sqlite3.connect(sqlite_path, check_same_thread=False, isolation_level=None)
+                self._conn.execute("PRAGMA journal_mode=WAL")
+                self._conn.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS idempotency (
+                        key TEXT PRIMARY KEY,
+                        requestHash TEXT NOT NULL,
+                        statusCode INTEGER NOT NULL,
+                        content TEXT NOT NULL,
+                        expiresAt REAL NOT NULL
+                    )
+                    """
+                )
+            except sqlite3.Error as e:
+                logger.warning(f"Idempotency store falling back to memory only: {str(e)}")
+                self._conn = None
+
+    async def run(
+        self,
+        key: str,
+        body_hash: str,
+        handler: Callable[[], Awaitable[StoredResponse]]
+    ) -> Tuple[int, Any, bool]:
+        """
+        Run handler once per key and replay its response for repeats
+
+        A repeat that arrives while the first request is still running waits
+        for its result. Successes and DETERMINISTIC_STATUS_CODES (including
+        ones raised as exceptions with status_code/detail) are stored; every
+        other outcome is not, so the client can retry it.
+
+        Returns:
+            (status_code, content, replayed)
+
+        Raises:
+            IdempotencyConflictError: the key was used with a different body
+        """
+        record = self._lookup(key)
+        if record:
+            self._check_hash(key, record["requestHash"], body_hash)
+            self._stats["replayed"] += 1
+            return record["statusCode"], record["content"], True
+
+        if key in self._in_flight:
+            first_hash, future = self._in_flight[key]
+            self._check_hash(key, first_hash, body_hash)
+            self._stats["joined"] += 1
+            status_code, content = await asyncio.shield(future)
+            return status_code, content, True
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = (body_hash, future)
+        try:
+            status_code, content = await handler()
+        except Exception as e:
+            status_code = getattr(e, "status_code", 500)
+            if _storable(status_code):
+                self._save(key, body_hash, status_code, {"detail": getattr(e, "detail", str(e))})
+            future.set_exception(e)
+            # Waiters retrieve the exception; avoid "never retrieved" warnings otherwise
+            future.exception()
+            raise
+        except BaseException:
+            future.cancel()
+            raise
+        else:
+            if _storable(status_code):
+                self._save(key, body_hash, status_code, content)
+            future.set_result((status_code, content))
+            return status_code, content, False
+        finally:
+            del self._in_flight[key]
+
+    def stats(self) -> Dict[str, int]:
+        """Stored/replayed counters"""
+        return {**self._stats, "entries": len(self._memory), "inFlight": len(self._in_flight)}
+
+    def _check_hash(self, key: str, stored_hash: str, body_hash: str) -> None:
+        if stored_hash != body_hash:
+            self._stats["conflicts"] += 1
+            raise IdempotencyConflictError(f"Idempotency key reused with a different request: {key}")
+
+    def _lookup(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        record = self._memory.get(key)
+        if record:
+            if record["expiresAt"] > now:
+                self._memory.move_to_end(key)
+                return record
+            del self._memory[key]
+
+        if self._conn is None:
+            return None
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT requestHash, statusCode, content, expiresAt FROM idempotency "
+                "WHERE key = ? AND expiresAt > ?",
+                (key, now)
+            ).fetchone()
+        if not row:
+            return None
+        record = {
+            "requestHash": row[0],
+            "statusCode": row[1],
+            "content": json.loads(row[2]),
+            "expiresAt": row[3]
+        }
+        self._remember(key, record)
+        return record
+
+    def _save(self, key: str, body_hash: str, status_code: int, content: Any) -> None:
+        record = {
+            "requestHash": body_hash,
+            "statusCode": status_code,
+            "content": content,
+            "expiresAt": time.time() + self.ttl_seconds
+        }
+        self._remember(key, record)
+        self._stats["stored"] += 1
+
+        if self._conn is None:
+            return
+        try:
+            with self._lock:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO idempotency (key, requestHash, statusCode, content, expiresAt) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (key, body_hash, status_code, json.dumps(content, default=str), record["expiresAt"])
+                )
+                self._conn.execute("DELETE FROM idempotency WHERE expiresAt <= ?", (time.time(),))
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to persist idempotency record {key}: {str(e)}")
+
+    def _remember(self, key: str, record: Dict[str, Any]) -> None:
+        self._memory[key] = record
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+
+idempotency_store = IdempotencyStore(
+    ttl_seconds=settings.IDEMPOTENCY_TTL_SECONDS,
+    max_entries=settings.IDEMPOTENCY_MAX_ENTRIES,
+    sqlite_path=settings.IDEMPOTENCY_SQLITE_PATH or None
+)
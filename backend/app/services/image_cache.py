@@ -0,0 +1,148 @@
+"""
+Local disk cache for served images
+Size-bounded LRU of blobs fetched from the storage backend, read through by
+GET /api/images/{blob_path}
+"""
+
+import hashlib
+import logging
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from typing import Any, BinaryIO, Dict, Optional
+
+from app.config import settings
+from app.services.storage_backends import StorageBackend
+
+logger = logging.getLogger(__name__)
+
+
+class DiskImageCache:
+    """
+    Read-through LRU cache of blobs on local disk
+
+    Files are named by a hash of their blob path. The LRU order is kept in
+    memory and rebuilt from file modification times on startup.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        # file name -> size, least recently used first
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "notFound": 0}
+
+        if cache_dir:
+            self._load()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.cache_dir)
+
+    def fetch(self, backend: StorageBackend, blob_path: str) -> Optional[BinaryIO]:
+        """
+        Open a cached copy of the blob, downloading it on a miss
+
+        The file is opened while the lock is held, so a concurrent eviction
+        cannot remove it before the caller reads it. The caller closes it.
+
+        Returns:
+            File opened for binary reading, or None if the blob does not exist
+        """
+        name = hashlib.sha256(blob_path.encode()).hexdigest()
+        path = os.path.join(self.cache_dir, name[:2], name)
+
+        with self._lock:
+            f = self._open(path) if name in self._entries else None
+            if f is not None:
+                self._entries.move_to_end(name)
+                self._stats["hits"] += 1
+            else:
+                self._stats["misses"] += 1
+        if f is not None:
+            # Keeps the LRU order across restarts
+            os.utime(f.fileno())
+            return f
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, "wb") as tmp:
+                found = backend.download(blob_path, tmp)
+            if not found:
+                with self._lock:
+                    self._stats["notFound"] += 1
+                return None
+            size = os.path.getsize(tmp_path)
+            with self._lock:
+                os.replace(tmp_path, path)
+                f = open(path, "rb")
+                self._bytes -= self._entries.pop(name, 0)
+                self._entries[name] = size
+                self._bytes += size
+                self._evict()
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return f
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and current size"""
+        with self._lock:
+            stats = dict(self._stats)
+            entries = len(self._entries)
+            size = self._bytes
+        total = stats["hits"] + stats["misses"]
+        return {
+            **stats,
+            "hitRate": round(stats["hits"] / total, 3) if total else 0.0,
+            "entries": entries,
+            "bytes": size,
+            "enabled": self.enabled
+        }
+
+    @staticmethod
+    def _open(path: str) -> Optional[BinaryIO]:
+        """The cached file, or None if it was removed behind the cache's back"""
+        try:
+            return open(path, "rb")
+        except FileNotFoundError:
+            return None
+
+    def _evict(self) -> None:
+        """Drop least recently used files until under max_bytes; called with the lock held"""
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            name, size = self._entries.popitem(last=False)
+            self._bytes -= size
+            self._stats["evictions"] += 1
+            try:
+                # Readers holding the file open keep their copy until they close it
+                os.remove(os.path.join(self.cache_dir, name[:2], name))
+            except FileNotFoundError:
+                pass
+
+    def _load(self) -> None:
+        files = []
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                if name.endswith(".tmp"):
+                    os.remove(path)
+                    continue
+                stat = os.stat(path)
+                files.append((stat.st_mtime, name, stat.st_size))
+        for _, name, size in sorted(files):
+            self._entries[name] = size
+            self._bytes += size
+        self._evict()
+        if files:
+            logger.info(f"Loaded image cache: {len(self._entries)} files, {self._bytes} bytes")
+
+
+image_cache = DiskImageCache(
+    cache_dir=settings.IMAGE_CACHE_DIR,
+    max_bytes=settings.IMAGE_CACHE_MAX_BYTES
+)
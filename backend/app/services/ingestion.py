@@ -0,0 +1,347 @@
+"""
+Reference image ingestion
+Validates, downscales and re-encodes uploaded reference images before generation
+"""
+
+import base64
+import binascii
+import hashlib
+import logging
+import re
+import time
+import uuid
+from io import BytesIO
+from typing import Any, BinaryIO, Dict, List, Optional, Tuple
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from app.config import settings
+from app.services.blob_store import blob_store
+from app.services.storage import StorageService
+from app.services.storage_backends import get_backend
+
+logger = logging.getLogger(__name__)
+
+ALLOWED_FORMATS = {"JPEG", "PNG", "WEBP"}
+MIN_DIMENSION = 64  # Pixels, smaller images are useless as references
+
+# Reference to an image stored by POST /api/uploads
+UPLOAD_ID_PREFIX = "upload:"
+# SHA-256 for content-addressed uploads, 32-character prefix for per-owner ones
+_UPLOAD_ID_PATTERN = re.compile(r"^[0-9a-f]{32}([0-9a-f]{32})?$")
+
+# Images the client PUTs straight to the bucket through a signed URL
+DIRECT_UPLOAD_PREFIX = "direct-"
+_UPLOAD_KEY_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+DIRECT_UPLOAD_TYPES = {
+    "image/jpeg": (b"\xff\xd8\xff",),
+    "image/png": (b"\x89PNG\r\n\x1a\n",),
+    "image/webp": (b"RIFF",)
+}
+
+
+class ImageIngestionError(ValueError):
+    """Raised when a reference image is missing, malformed or unsupported"""
+
+
+class ImageIngestionService:
+    """Normalizes reference images and stores them once in the bucket"""
+
+    @staticmethod
+    def normalize_image(source: BinaryIO) -> bytes:
+        """
+        Validate and re-encode one image
+
+        Format and dimensions are checked from the header before any pixel data
+        is decoded. JPEGs are decoded directly at reduced scale where possible,
+        then the image is downscaled to INGEST_MAX_DIMENSION and re-encoded as
+        an optimized JPEG.
+
+        Args:
+            source: Binary file-like object with the encoded image
+
+        Returns:
+            JPEG bytes
+
+        Raises:
+            ImageIngestionError: unsupported format or dimensions
+        """
+        try:
+            image = Image.open(source)
+        except UnidentifiedImageError:
+            raise ImageIngestionError("Unrecognized image format")
+
+        with image:
+            if image.format not in ALLOWED_FORMATS:
+                raise ImageIngestionError(f"Unsupported image format: {image.format}")
+
+            width, height = image.size
+            if width * height > settings.INGEST_MAX_SOURCE_PIXELS:
+                raise ImageIngestionError(f"Image too large: {width}x{height}")
+            if min(width, height) < MIN_DIMENSION:
+                raise ImageIngestionError(f"Image too small: {width}x{height}")
+
+            max_side = settings.INGEST_MAX_DIMENSION
+            image.draft("RGB", (max_side, max_side))
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((max_side, max_side), Image.LANCZOS)
+
+            if image.mode in ("RGBA", "LA", "P"):
+                image = image.convert("RGBA")
+                background = Image.new("RGB", image.size, (255, 255, 255))
+                background.paste(image, mask=image.getchannel("A"))
+                image = background
+            elif image.mode != "RGB":
+                image = image.convert("RGB")
+
+            output = BytesIO()
+            image.save(
+                output,
+                format="JPEG",
+                quality=settings.INGEST_JPEG_QUALITY,
+                optimize=True,
+                progressive=True
+            )
+            return output.getvalue()
+
+    @staticmethod
+    def ingest_reference_images(images: List[str], owner: str) -> List[str]:
+        """
+        Normalize inline reference images and replace them with bucket URLs
+
+        Inline images (data URLs or raw base64) are normalized and stored under
+        a path derived from their content, so the same picture is stored once
+        per owner. Upload IDs are resolved to their stored URL and http(s)
+        URLs are passed through unchanged. If the upload
+        fails, the normalized image is kept inline as a data URL.
+
+        Args:
+            images: Reference images from GenerateRequest.uploadedImageUrls
+            owner: User ID or "anon-{ipHash}"
+
+        Returns:
+            List of short image references, in the same order
+
+        Raises:
+            ImageIngestionError: too many images or an invalid image
+        """
+        if len(images) > settings.MAX_REFERENCE_IMAGES:
+            raise ImageIngestionError(f"At most {settings.MAX_REFERENCE_IMAGES} reference images are allowed")
+
+        upload_ids = [image for image in images if image.startswith(UPLOAD_ID_PREFIX)]
+        resolved = dict(zip(upload_ids, ImageIngestionService.resolve_uploads(upload_ids, owner)))
+
+        references = []
+        for index, image in enumerate(images):
+            if image.startswith(("http://", "https://")):
+                references.append(image)
+                continue
+            if image.startswith(UPLOAD_ID_PREFIX):
+                references.append(resolved[image])
+                continue
+
+            encoded = image.split(",", 1)[1] if image.startswith("data:") else image
+            try:
+                raw = base64.b64decode(encoded, validate=True)
+            except (binascii.Error, ValueError):
+                raise ImageIngestionError(f"Reference image {index + 1} is not valid base64")
+            if len(raw) > settings.INGEST_MAX_BYTES:
+                raise ImageIngestionError(f"Reference image {index + 1} exceeds {settings.INGEST_MAX_BYTES} bytes")
+
+            try:
+                normalized = ImageIngestionService.normalize_image(BytesIO(raw))
+            except ImageIngestionError as e:
+                raise ImageIngestionError(f"Reference image {index + 1}: {str(e)}")
+
+            url = ImageIngestionService._store(normalized, owner)[1]
+            if url is None:
+                url = "data:image/jpeg;base64," + base64.b64encode(normalized).decode()
+
+            logger.info(f"Ingested reference image {index + 1}: {len(raw)} -> {len(normalized)} bytes")
+            references.append(url)
+
+        return references
+
+    @staticmethod
+    def ingest_upload(source: BinaryIO, owner: str) -> Optional[str]:
+        """
+        Normalize and store one uploaded file
+
+        The file is read by the decoder straight from the (spooled) upload, so
+        the original is never held in memory as a whole.
+
+        Args:
+            source: Uploaded file, positioned at the start
+            owner: User ID or "anon-{ipHash}"
+
+        Returns:
+            Upload ID ("upload:<id>") or None if storing failed
+
+        Raises:
+            ImageIngestionError: invalid or unsupported image
+        """
+        normalized = ImageIngestionService.normalize_image(source)
+        upload_id, url = ImageIngestionService._store(normalized, owner)
+        if url is None:
+            return None
+
+        logger.info(f"Stored upload {upload_id} for {owner} ({len(normalized)} bytes)")
+        return UPLOAD_ID_PREFIX + upload_id
+
+    @staticmethod
+    def create_direct_upload(content_type: str, owner: str) -> Dict[str, Any]:
+        """
+        Issue a signed URL for uploading one image directly to the bucket
+
+        The bytes never pass through the API server. Size and content type are
+        bound into the signature, and the object stays unusable until
+        complete_direct_upload registers it.
+
+        Args:
+            content_type: MIME type the client will upload
+            owner: User ID or "anon-{ipHash}"
+
+        Returns:
+            {"uploadKey": str, "url": str, "method": "PUT", "headers": {...}, "expiresAt": int}
+
+        Raises:
+            ImageIngestionError: unsupported content type
+        """
+        if content_type not in DIRECT_UPLOAD_TYPES:
+            raise ImageIngestionError(f"Unsupported content type: {content_type}")
+
+        upload_key = uuid.uuid4().hex
+        signed = get_backend(settings.FIREBASE_STORAGE_BUCKET).signed_upload(
+            ImageIngestionService._direct_path(owner, upload_key),
+            content_type,
+            max_bytes=settings.INGEST_MAX_BYTES,
+            expires_in=settings.DIRECT_UPLOAD_URL_TTL
+        )
+        return {
+            "uploadKey": upload_key,
+            **signed,
+            "expiresAt": int(time.time()) + settings.DIRECT_UPLOAD_URL_TTL
+        }
+
+    @staticmethod
+    def complete_direct_upload(upload_key: str, owner: str) -> str:
+        """
+        Register an image uploaded through a signed URL
+
+        Only the object's metadata and first bytes are read; the image is sent
+        to the provider as uploaded, without normalization.
+
+        Returns:
+            Upload ID ("upload:direct-<key>")
+
+        Raises:
+            ImageIngestionError: unknown key, missing object or not an image
+        """
+        if not _UPLOAD_KEY_PATTERN.match(upload_key):
+            raise ImageIngestionError(f"Invalid upload key: {upload_key}")
+
+        backend = get_backend(settings.FIREBASE_STORAGE_BUCKET)
+        path = ImageIngestionService._direct_path(owner, upload_key)
+        info = backend.stat(path)
+        if info is None:
+            raise ImageIngestionError(f"Upload {upload_key} not found")
+
+        head = backend.read_head(path, 16)
+        sniffed = next(
+            (
+                content_type
+                for content_type, magics in DIRECT_UPLOAD_TYPES.items()
+                if head.startswith(magics) and (content_type != "image/webp" or head[8:12] == b"WEBP")
+            ),
+            None
+        )
+        if sniffed is None or info["size"] > settings.INGEST_MAX_BYTES or (
+            info["contentType"] and info["contentType"] != sniffed
+        ):
+            backend.delete(path)
+            raise ImageIngestionError(f"Upload {upload_key} is not a supported image")
+
+        blob_store.claim(DIRECT_UPLOAD_PREFIX + upload_key, owner)
+        logger.info(f"Registered direct upload {upload_key} for {owner} ({info['size']} bytes)")
+        return UPLOAD_ID_PREFIX + DIRECT_UPLOAD_PREFIX + upload_key
+
+    @staticmethod
+    def resolve_upload(reference: str, owner: str) -> str:
+        """
+        Get the URL of an image stored by ingest_upload
+
+        Raises:
+            ImageIngestionError: malformed or unknown upload ID
+        """
+        return ImageIngestionService.resolve_uploads([reference], owner)[0]
+
+    @staticmethod
+    def resolve_uploads(references: List[str], owner: str) -> List[str]:
+        """
+        Get the URLs of several uploaded images, checking storage in one batch
+
+        An ID only resolves for the caller that uploaded it, even when the
+        blob itself is shared through the content-addressed store.
+
+        Args:
+            references: Upload IDs ("upload:<id>")
+            owner: User ID or "anon-{ipHash}"
+
+        Returns:
+            URL per upload ID, in order
+
+        Raises:
+            ImageIngestionError: malformed or unknown upload ID
+        """
+        urls: List[Optional[str]] = [None] * len(references)
+        # Uploads stored under per-owner paths, looked up together below
+        paths: Dict[int, str] = {}
+        for index, reference in enumerate(references):
+            upload_id = reference[len(UPLOAD_ID_PREFIX):]
+            if upload_id.startswith(DIRECT_UPLOAD_PREFIX):
+                upload_key = upload_id[len(DIRECT_UPLOAD_PREFIX):]
+                if _UPLOAD_KEY_PATTERN.match(upload_key) and blob_store.claimed(upload_id, owner):
+                    paths[index] = ImageIngestionService._direct_path(owner, upload_key)
+            elif _UPLOAD_ID_PATTERN.match(upload_id):
+                if len(upload_id) == 64:
+                    urls[index] = blob_store.lookup(upload_id) if blob_store.claimed(upload_id, owner) else None
+                else:
+                    paths[index] = ImageIngestionService._blob_path(owner, upload_id)
+
+        if paths:
+            found = StorageService.get_download_urls(settings.FIREBASE_STORAGE_BUCKET, list(paths.values()))
+            for index, url in zip(paths, found):
+                urls[index] = url
+
+        for reference, url in zip(references, urls):
+            if url is None:
+                raise ImageIngestionError(f"Unknown upload ID: {reference}")
+        return urls
+
+    @staticmethod
+    def _store(normalized: bytes, owner: str) -> Tuple[str, Optional[str]]:
+        """Upload a normalized image under its content hash, returning (upload ID, URL or None)"""
+        if settings.STORAGE_CAS_ENABLED:
+            digest = hashlib.sha256(normalized).hexdigest()
+            stored = blob_store.put(normalized, "image/jpeg", digest=digest)
+            if stored is None:
+                return digest, None
+            blob_store.claim(digest, owner)
+            return digest, stored[1]
+
+        upload_id = hashlib.sha256(normalized).hexdigest()[:32]
+        url = StorageService.upload_bytes(
+            settings.FIREBASE_STORAGE_BUCKET,
+            ImageIngestionService._blob_path(owner, upload_id),
+            normalized,
+            content_type="image/jpeg"
+        )
+        return upload_id, url
+
+    @staticmethod
+    def _blob_path(owner: str, upload_id: str) -> str:
+        return f"uploaded-images/{owner}/{upload_id}.jpg"
+
+    @staticmethod
+    def _direct_path(owner: str, upload_key: str) -> str:
+        return f"direct-uploads/{owner}/{upload_key}"
@@ -0,0 +1,490 @@
+"""
+Generation job queue
+Runs photoshoot generations in the background and tracks their status
+"""
+
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+
+TERMINAL_STATUSES = (JOB_COMPLETED, JOB_FAILED)
+
+# Signs event stream tokens; with a random key, tokens only work on this process
+_STREAM_TOKEN_KEY = settings.JOB_STREAM_TOKEN_SECRET.encode() or os.urandom(32)
+
+
+class JobQueueFullError(Exception):
+    """Raised when the job queue cannot accept more work"""
+
+
+class JobStore(ABC):
+    """Storage backend for generation jobs"""
+
+    @abstractmethod
+    def put(self, job: Dict[str, Any]) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get(self, shoot_id: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def update(self, shoot_id: str, **fields: Any) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def list_by_status(self, status: str) -> List[str]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def prune(self, older_than: str) -> int:
+        """Delete finished jobs last updated before the given ISO timestamp"""
+        raise NotImplementedError
+
+    def open(self) -> None:
+        """Acquire resources; called by JobQueue.start(), so a stopped queue can start again"""
+
+    def close(self) -> None:
+        """Release what open() acquired"""
+
+
+class InMemoryJobStore(JobStore):
+    """Process-local job store (jobs are lost on restart)"""
+
+    def __init__(self):
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def put(self, job: Dict[str, Any]) -> None:
+        with self._lock:
+            self._jobs[job["shoot_id"]] = dict(job)
+
+    def get(self, shoot_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self._jobs.get(shoot_id)
+            return dict(job) if job else None
+
+    def update(self, shoot_id: str, **fields: Any) -> None:
+        with self._lock:
+            if shoot_id in self._jobs:
+                self._jobs[shoot_id].update(fields)
+
+    def list_by_status(self, status: str) -> List[str]:
+        with self._lock:
+            jobs = [job for job in self._jobs.values() if job["status"] == status]
+        jobs.sort(key=lambda job: job["createdAt"])
+        return [job["shoot_id"] for job in jobs]
+
+    def prune(self, older_than: str) -> int:
+        with self._lock:
+            expired = [
+                shoot_id for shoot_id, job in self._jobs.items()
+                if job["status"] in TERMINAL_STATUSES and job["updatedAt"] < older_than
+            ]
+            for shoot_id in expired:
+                del self._jobs[shoot_id]
+        return len(expired)
+
+
+class SQLiteJobStore(JobStore):
+    """Durable local job store backed by a SQLite file"""
+
+    _JSON_FIELDS = ("payload", "result", "error")
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+
+    def open(self) -> None:
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                shoot_id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                owner TEXT,
+                payload TEXT,
+                result TEXT,
+                error TEXT,
+                createdAt TEXT NOT NULL,
+                updatedAt TEXT NOT NULL
+            )
+            """
+        )
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+        if "owner" not in columns:
+            # Files created before jobs recorded their owner
+            conn.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, createdAt)")
+        with self._lock:
+            self._conn = conn
+
+    def put(self, job: Dict[str, Any]) -> None:
+        row = self._encode(job)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO jobs (shoot_id, status, owner, payload, result, error, createdAt, updatedAt) "
+                "VALUES (:shoot_id, :status, :owner, :payload, :result, :error, :createdAt, :updatedAt)",
+                row
+            )
+
+    def get(self, shoot_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            cursor = self._conn.execute("SELECT * FROM jobs WHERE shoot_id = ?", (shoot_id,))
+            row = cursor.fetchone()
+            columns = [col[0] for col in cursor.description]
+        return self._decode(dict(zip(columns, row))) if row else None
+
+    def update(self, shoot_id: str, **fields: Any) -> None:
+        if not fields:
+            return
+        row = self._encode(fields)
+        assignments = ", ".join(f"{name} = :{name}" for name in row)
+        row["_shoot_id"] = shoot_id
+        with self._lock:
+            self._conn.execute(f"UPDATE jobs SET {assignments} WHERE shoot_id = :_shoot_id", row)
+
+    def list_by_status(self, status: str) -> List[str]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT shoot_id FROM jobs WHERE status = ? ORDER BY createdAt", (status,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def prune(self, older_than: str) -> int:
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND updatedAt < ?",
+                (*TERMINAL_STATUSES, older_than)
+            )
+        return cursor.rowcount
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    @classmethod
+    def _encode(cls, job: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            key: json.dumps(value) if key in cls._JSON_FIELDS and value is not None else value
+            for key, value in job.items()
+        }
+
+    @classmethod
+    def _decode(cls, row: Dict[str, Any]) -> Dict[str, Any]:
+        for key in cls._JSON_FIELDS:
+            if row.get(key) is not None:
+                row[key] = json.loads(row[key])
+        return row
+
+
+JobHandler = Callable[[str, Dict[str, Any]], Awaitable[Dict[str, Any]]]
+
+# Emitted by JobQueue.events() while no event arrives, so streams can send keep-alives
+KEEPALIVE_EVENT = "keepalive"
+
+
+class _JobChannel:
+    """Events published for one job in this process, kept until the job finishes"""
+
+    def __init__(self):
+        self.events: List[Tuple[str, Dict[str, Any]]] = []
+        self.changed = asyncio.Event()
+
+    def publish(self, event: str, data: Dict[str, Any]) -> None:
+        self.events.append((event, data))
+        # Wake current waiters and give later ones a fresh event to wait on
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+
+class JobQueue:
+    """Bounded pool of async workers draining generation jobs from a JobStore"""
+
+    def __init__(self, store: JobStore, workers: int, max_pending: int, result_ttl_seconds: int):
+        self.store = store
+        self.workers = workers
+        self.max_pending = max_pending
+        self.result_ttl_seconds = result_ttl_seconds
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._handler: Optional[JobHandler] = None
+        self._channels: Dict[str, _JobChannel] = {}
+
+    async def start(self, handler: JobHandler) -> None:
+        """Open the store, start the worker pool and resume jobs left over from a previous run"""
+        self.store.open()
+        self._handler = handler
+        self._queue = asyncio.Queue()
+
+        now = datetime.utcnow().isoformat()
+        # A job that was running when the process died may already have been
+        # charged for, so it is failed rather than silently re-run.
+        for shoot_id in self.store.list_by_status(JOB_RUNNING):
+            self.store.update(
+                shoot_id,
+                status=JOB_FAILED,
+                error={"status_code": 500, "detail": "Generation interrupted, please retry"},
+                updatedAt=now
+            )
+        for shoot_id in self.store.list_by_status(JOB_QUEUED):
+            self._channels[shoot_id] = _JobChannel()
+            self._queue.put_nowait(shoot_id)
+
+        self._tasks = [
+            asyncio.create_task(self._worker(index), name=f"generation-worker-{index}")
+            for index in range(self.workers)
+        ]
+        logger.info(f"Started job queue with {self.workers} workers ({self._queue.qsize()} jobs resumed)")
+
+    async def stop(self) -> None:
+        """Cancel the workers and close the store"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+        self.store.close()
+        logger.info("Stopped job queue")
+
+    def enqueue(self, shoot_id: str, payload: Dict[str, Any], owner: str) -> Dict[str, Any]:
+        """
+        Add a job to the queue
+
+        Args:
+            shoot_id: Job ID
+            payload: Handler input, dropped once the job finishes
+            owner: Who may read the job's status and events
+
+        Raises:
+            JobQueueFullError: if max_pending jobs are already waiting
+        """
+        if self._queue is None:
+            raise RuntimeError("Job queue is not running")
+        if self._queue.qsize() >= self.max_pending:
+            raise JobQueueFullError(f"Job queue is full ({self.max_pending} pending)")
+
+        now = datetime.utcnow().isoformat()
+        job = {
+            "shoot_id": shoot_id,
+            "status": JOB_QUEUED,
+            "owner": owner,
+            "payload": payload,
+            "result": None,
+            "error": None,
+            "createdAt": now,
+            "updatedAt": now
+        }
+        self.store.put(job)
+        self._channels[shoot_id] = _JobChannel()
+        self._queue.put_nowait(shoot_id)
+        logger.info(f"Queued generation job {shoot_id} ({self._queue.qsize()} pending)")
+        return job
+
+    def get(self, shoot_id: str) -> Optional[Dict[str, Any]]:
+        """Get a job by shoot ID"""
+        return self.store.get(shoot_id)
+
+    def publish(self, shoot_id: str, event: str, data: Dict[str, Any]) -> None:
+        """Publish a progress event (e.g. a finished image) for a running job"""
+        channel = self._channels.get(shoot_id)
+        if channel:
+            channel.publish(event, data)
+
+    async def events(
+        self,
+        shoot_id: str,
+        keepalive_seconds: float = 15.0,
+        poll_seconds: float = 1.0
+    ) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """
+        Yield (event, data) pairs for a job until it completes or fails
+
+        Events already published are replayed first. Jobs that finished
+        earlier, or that are run by another process sharing a SQLite store,
+        are followed by polling the store instead.
+        """
+        channel = self._channels.get(shoot_id)
+        if channel is None:
+            async for item in self._poll_events(shoot_id, keepalive_seconds, poll_seconds):
+                yield item
+            return
+
+        position = 0
+        while True:
+            while position < len(channel.events):
+                event, data = channel.events[position]
+                position += 1
+                yield event, data
+                if event in TERMINAL_STATUSES:
+                    return
+            try:
+                await asyncio.wait_for(channel.changed.wait(), timeout=keepalive_seconds)
+            except asyncio.TimeoutError:
+                yield KEEPALIVE_EVENT, {}
+
+    def stats(self) -> Dict[str, int]:
+        """Current queue depth and worker count"""
+        return {
+            "pending": self._queue.qsize() if self._queue else 0,
+            "workers": len(self._tasks),
+            "streams": len(self._channels)
+        }
+
+    async def _poll_events(
+        self,
+        shoot_id: str,
+        keepalive_seconds: float,
+        poll_seconds: float
+    ) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        last_status = None
+        idle = 0.0
+        while True:
+            job = self.store.get(shoot_id)
+            if not job:
+                return
+            if job["status"] in TERMINAL_STATUSES:
+                for event, data in _final_events(job):
+                    yield event, data
+                return
+            if job["status"] != last_status:
+                last_status = job["status"]
+                idle = 0.0
+                yield "status", {"status": last_status}
+            elif idle >= keepalive_seconds:
+                idle = 0.0
+                yield KEEPALIVE_EVENT, {}
+            await asyncio.sleep(poll_seconds)
+            idle += poll_seconds
+
+    async def _worker(self, index: int) -> None:
+        while True:
+            shoot_id = await self._queue.get()
+            try:
+                await self._run(shoot_id)
+            except Exception as e:
+                logger.error(f"Worker {index} failed on job {shoot_id}: {str(e)}", exc_info=True)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, shoot_id: str) -> None:
+        job = self.store.get(shoot_id)
+        if not job or job["status"] != JOB_QUEUED:
+            return
+
+        self.store.update(shoot_id, status=JOB_RUNNING, updatedAt=datetime.utcnow().isoformat())
+        self.publish(shoot_id, "status", {"status": JOB_RUNNING})
+
+        try:
+            result = await self._handler(shoot_id, job["payload"])
+            self.store.update(
+                shoot_id,
+                status=JOB_COMPLETED,
+                result=result,
+                payload=None,
+                updatedAt=datetime.utcnow().isoformat()
+            )
+            self.publish(shoot_id, JOB_COMPLETED, _summary(result))
+            logger.info(f"Generation job {shoot_id} completed")
+        except Exception as e:
+            # Route handlers raise HTTPException; keep its status code and detail
+            status_code = getattr(e, "status_code", 500)
+            detail = getattr(e, "detail", None) or "Generation failed"
+            if status_code >= 500:
+                logger.error(f"Generation job {shoot_id} failed: {str(e)}", exc_info=True)
+            error = {"status_code": status_code, "detail": detail}
+            self.store.update(
+                shoot_id,
+                status=JOB_FAILED,
+                error=error,
+                payload=None,
+                updatedAt=datetime.utcnow().isoformat()
+            )
+            self.publish(shoot_id, JOB_FAILED, error)
+        finally:
+            # Live subscribers keep their reference; later ones read the store
+            self._channels.pop(shoot_id, None)
+
+        cutoff = (datetime.utcnow() - timedelta(seconds=self.result_ttl_seconds)).isoformat()
+        self.store.prune(cutoff)
+
+
+def issue_stream_token(shoot_id: str, owner: str) -> str:
+    """
+    Short-lived token that lets its holder stream one job's events
+
+    EventSource cannot send an Authorization header, so the token returned
+    when the job is queued goes in the stream URL instead of the ID token.
+    """
+    expires = int(time.time()) + settings.JOB_STREAM_TOKEN_TTL
+    return f"{expires}.{_stream_signature(shoot_id, owner, expires)}"
+
+
+def verify_stream_token(shoot_id: str, owner: str, token: str) -> bool:
+    """Whether token was issued for this job and owner and has not expired"""
+    expires, _, signature = (token or "").partition(".")
+    if not expires.isdigit() or int(expires) < time.time():
+        return False
+    return hmac.compare_digest(signature, _stream_signature(shoot_id, owner, int(expires)))
+
+
+def _stream_signature(shoot_id: str, owner: str, expires: int) -> str:
+    message = f"{shoot_id}\n{owner}\n{expires}".encode()
+    return hmac.new(_STREAM_TOKEN_KEY, message, hashlib.sha256).hexdigest()
+
+
+def _summary(result: Dict[str, Any]) -> Dict[str, Any]:
+    """Completion event payload: the result without the (already streamed) images"""
+    summary = {key: value for key, value in result.items() if key != "generatedImages"}
+    summary["imageCount"] = len(result.get("generatedImages", []))
+    return summary
+
+
+def _final_events(job: Dict[str, Any]) -> List[Tuple[str, Dict[str, Any]]]:
+    """Rebuild the event sequence of a finished job from its stored record"""
+    if job["status"] == JOB_FAILED:
+        return [(JOB_FAILED, job["error"])]
+    result = job["result"] or {}
+    events = [
+        ("image", {"index": index, "image": image})
+        for index, image in enumerate(result.get("generatedImages", []))
+    ]
+    events.append((JOB_COMPLETED, _summary(result)))
+    return events
+
+
+def _create_store() -> JobStore:
+    """Build the job store selected by JOB_QUEUE_BACKEND"""
+    if settings.JOB_QUEUE_BACKEND == "sqlite":
+        return SQLiteJobStore(settings.JOB_QUEUE_SQLITE_PATH)
+    return InMemoryJobStore()
+
+
+job_queue = JobQueue(
+    store=_create_store(),
+    workers=settings.JOB_QUEUE_WORKERS,
+    max_pending=settings.JOB_QUEUE_MAX_PENDING,
+    result_ttl_seconds=settings.JOB_RESULT_TTL_SECONDS
+)
@@ -3,27 +3,82 @@ Nano Banana API integration for image generation
 Handles calls to Nano Banana API for AI image generation
 """
 
-import requests
+import asyncio
+import httpx
 import logging
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Callable, Awaitable, Tuple
 import base64
 
 from app.config import settings
+from app.services.blob_store import blob_store, blob_path
+from app.services.admission import generation_admission, PRIORITY_ANON
+from app.services.generation_cache import generation_cache, fingerprint
+from app.services.provider_stream import OutputsStreamParser, ProviderOutput, EXTENSIONS
+from app.services.renditions import RenditionService
+from app.services.singleflight import generation_flight
+from app.services.storage import StorageService
 
 logger = logging.getLogger(__name__)
 
 NANO_BANANA_API_URL = "https://api.nanobana.com/v1/generate"
+NUM_OUTPUTS = 3  # Images generated per photoshoot
+
+# Callback receiving (index, image) as each generated image becomes ready
+OnImage = Callable[[int, str], Awaitable[None]]
+
+
+class ProviderClient:
+    """Shared keep-alive HTTP connection pool for provider calls"""
+    
+    _client: Optional[httpx.AsyncClient] = None
+    
+    @classmethod
+    async def start(cls) -> None:
+        """Open the connection pool (called from the app lifespan)"""
+        if cls._client is None:
+            cls._client = cls._create_client()
+            logger.info(f"Opened provider connection pool (size {settings.PROVIDER_POOL_SIZE})")
+    
+    @classmethod
+    async def close(cls) -> None:
+        """Close the connection pool (called on shutdown)"""
+        if cls._client is not None:
+            await cls._client.aclose()
+            cls._client = None
+            logger.info("Closed provider connection pool")
+    
+    @classmethod
+    def get(cls) -> httpx.AsyncClient:
+        """Get the shared client, creating it if the lifespan did not run"""
+        if cls._client is None:
+            cls._client = cls._create_client()
+        return cls._client
+    
+    @staticmethod
+    def _create_client() -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=settings.PROVIDER_POOL_SIZE,
+                max_keepalive_connections=settings.PROVIDER_POOL_SIZE
+            ),
+            timeout=httpx.Timeout(
+                settings.PROVIDER_READ_TIMEOUT,
+                connect=settings.PROVIDER_CONNECT_TIMEOUT
+            )
+        )
 
 
 class NanoBananaService:
     """Nano Banana API service for image generation"""
     
     @staticmethod
-    def generate_photoshoot(
+    async def generate_photoshoot(
         reference_images: List[str],
         article_type: str,
         style_notes: str,
-        image_size: str
+        image_size: str,
+        on_image: Optional[OnImage] = None,
+        output_prefix: Optional[str] = None
     ) -> Dict[str, Any]:
         """
         Generate fashion photoshoot images using Nano Banana API
@@ -33,69 +88,106 @@ class NanoBananaService:
             article_type: Type of article (shirt, dress, pants, etc.)
             style_notes: Style description and notes
             image_size: Output size (small: 512x512, medium: 768x768, large: 1024x1024)
+            on_image: Optional callback awaited with (index, image) as each
+                image is stored, while the rest of the provider response is
+                still arriving. Indexes follow the order of the outputs in the
+                response; images may be delivered out of order.
+            output_prefix: Storage folder for generated images, e.g.
+                "generated-images/{uid}/{shoot_id}". Images are streamed from
+                the provider response straight into storage and returned as
+                URLs. Without it (or without storage) they are returned as
+                data URLs.
             
         Returns:
             {
                 "success": bool,
-                "images": List[str],  # List of generated image URLs or base64
+                "images": List[str],  # List of generated image URLs (data URLs if not stored)
+                "renditions": List[Optional[Dict]],  # Per image, see RenditionService (None if not stored)
                 "message": str
             }
         """
+        # Map image size to dimensions
+        size_map = {
+            "small": "512x512",
+            "medium": "768x768",
+            "large": "1024x1024"
+        }
+        
+        output_size = size_map.get(image_size, "768x768")
+        width, height = output_size.split("x")
+        
+        # Prepare prompt
+        prompt = NanoBananaService._build_prompt(
+            article_type,
+            style_notes,
+            reference_images
+        )
+        
+        logger.info(f"Generating photoshoot: {article_type}, size: {output_size}")
+        
+        payload = {
+            "model_id": settings.NANO_BANANA_MODEL_ID,
+            "prompt": prompt,
+            "width": int(width),
+            "height": int(height),
+            "num_outputs": NUM_OUTPUTS,
+            "num_inference_steps": 50,
+            "guidance_scale": 7.5
+        }
+        
+        return await NanoBananaService._request_outputs(payload, output_prefix, on_image)
+    
+    @staticmethod
+    async def _request_outputs(
+        payload: Dict[str, Any],
+        output_prefix: Optional[str] = None,
+        on_image: Optional[OnImage] = None
+    ) -> Dict[str, Any]:
+        """
+        Call the Nano Banana API once and return the outputs it produced
+        
+        The response body is streamed: each base64 output is decoded in chunks
+        into a spooled temp file and uploaded while the rest of the body is
+        still arriving, so memory use does not depend on image size.
+        Outputs are stored in the content-addressed blob store (or as
+        {output_prefix}/image-{n}.{ext} when it is disabled), with their
+        renditions next to them, and passed to on_image once stored.
+        
+        A response with fewer outputs than num_outputs counts as a failure,
+        so a short result is never charged for or cached.
+        """
+        parser = OutputsStreamParser()
+        uploads = []
         try:
-            # Map image size to dimensions
-            size_map = {
-                "small": "512x512",
-                "medium": "768x768",
-                "large": "1024x1024"
-            }
-            
-            output_size = size_map.get(image_size, "768x768")
-            width, height = output_size.split("x")
-            
-            # Prepare prompt
-            prompt = NanoBananaService._build_prompt(
-                article_type,
-                style_notes,
-                reference_images
-            )
-            
-            logger.info(f"Generating photoshoot: {article_type}, size: {output_size}")
-            
-            # Call Nano Banana API
-            payload = {
-                "model_id": settings.NANO_BANANA_MODEL_ID,
-                "prompt": prompt,
-                "width": int(width),
-                "height": int(height),
-                "num_outputs": 3,  # Generate 3 images
-                "num_inference_steps": 50,
-                "guidance_scale": 7.5
-            }
-            
             headers = {
                 "Authorization": f"Bearer {settings.NANO_BANANA_API_KEY}",
                 "Content-Type": "application/json"
             }
             
-            response = requests.post(
+            async with ProviderClient.get().stream(
+                "POST",
                 NANO_BANANA_API_URL,
                 json=payload,
-                headers=headers,
-                timeout=60  # 60 second timeout for generation
-            )
-            
-            if response.status_code != 200:
-                logger.error(f"Nano Banana API error: {response.status_code} - {response.text}")
-                return {
-                    "success": False,
-                    "images": [],
-                    "message": f"API error: {response.status_code}"
-                }
-            
-            data = response.json()
+                headers=headers
+            ) as response:
+                if response.status_code != 200:
+                    await response.aread()
+                    logger.error(f"Nano Banana API error: {response.status_code} - {response.text}")
+                    return {
+                        "success": False,
+                        "images": [],
+                        "message": f"API error: {response.status_code}"
+                    }
+                
+                # Extract image URLs/base64 from response as it arrives
+                async for chunk in response.aiter_text():
+                    for output in parser.feed(chunk):
+                        uploads.append(asyncio.create_task(
+                            NanoBananaService._store_output(output, output_prefix, len(uploads), on_image)
+                        ))
             
-            # Extract image URLs/base64 from response
-            images = data.get("outputs", [])
+            stored = await asyncio.gather(*uploads)
+            images = [url for url, _ in stored]
             
             if not images:
                 logger.warning("No images returned from Nano Banana API")
@@ -104,17 +196,25 @@ class NanoBananaService:
                     "images": [],
                     "message": "No images generated"
                 }
+            if len(images) < payload["num_outputs"]:
+                logger.warning(f"Nano Banana API returned {len(images)} of {payload['num_outputs']} images")
+                return {
+                    "success": False,
+                    "images": [],
+                    "message": f"Only {len(images)} of {payload['num_outputs']} images were generated"
+                }
             
             logger.info(f"Successfully generated {len(images)} images")
             
             return {
                 "success": True,
                 "images": images,
+                "renditions": [renditions for _, renditions in stored],
                 "message": f"Generated {len(images)} images"
             }
             
-        except requests.Timeout:
-            logger.error("Nano Banana API timeout (>60 seconds)")
+        except httpx.TimeoutException:
+            logger.error(f"Nano Banana API timeout (>{settings.PROVIDER_READ_TIMEOUT:g} seconds)")
             return {
                 "success": False,
                 "images": [],
@@ -127,6 +227,82 @@ class NanoBananaService:
                 "images": [],
                 "message": f"Generation error: {str(e)}"
             }
+        finally:
+            parser.discard()
+            for task in uploads:
+                task.cancel()
+    
+    @staticmethod
+    async def _store_output(
+        output: ProviderOutput,
+        output_prefix: Optional[str],
+        index: int,
+        on_image: Optional[OnImage] = None
+    ) -> Tuple[str, Optional[Dict[str, Any]]]:
+        """
+        Upload one decoded output and its renditions, then publish it
+        
+        Returns:
+            (URL, renditions); a data URL and None if it can't be stored
+        """
+        url, renditions = await NanoBananaService._upload_output(output, output_prefix, index)
+        if on_image is not None:
+            await on_image(index, url)
+        return url, renditions
+    
+    @staticmethod
+    async def _upload_output(
+        output: ProviderOutput,
+        output_prefix: Optional[str],
+        index: int
+    ) -> Tuple[str, Optional[Dict[str, Any]]]:
+        """Store one output; a data URL and None if it can't be stored"""
+        if output.url is not None:
+            return output.url, None
+        
+        try:
+            if output_prefix and StorageService.is_configured():
+                if settings.STORAGE_CAS_ENABLED:
+                    path = blob_path(output.digest)
+                    stored = await StorageService.run_upload(
+                        blob_store.put, output.file, output.content_type, output.digest
+                    )
+                    url = stored[1] if stored else None
+                else:
+                    extension = EXTENSIONS.get(output.content_type, "jpg")
+                    path = f"{output_prefix}/image-{index + 1}.{extension}"
+                    url = await StorageService.run_upload(
+                        StorageService.upload_file,
+                        settings.FIREBASE_STORAGE_BUCKET,
+                        path,
+                        output.file,
+                        output.content_type
+                    )
+                if url:
+                    return url, await NanoBananaService._renditions(output, path)
+            return output.read_base64(), None
+        finally:
+            output.discard()
+    
+    @staticmethod
+    async def _renditions(output: ProviderOutput, path: str) -> Optional[Dict[str, Any]]:
+        """Create an output's renditions, reusing those of an identical stored image"""
+        if not settings.RENDITIONS_ENABLED:
+            return None
+        if settings.STORAGE_CAS_ENABLED:
+            known = blob_store.renditions(output.digest)
+            if known:
+                return known
+        
+        renditions = await asyncio.to_thread(
+            RenditionService.create_renditions,
+            settings.FIREBASE_STORAGE_BUCKET,
+            path,
+            output.file
+        )
+        if renditions and settings.STORAGE_CAS_ENABLED:
+            blob_store.set_renditions(output.digest, renditions)
+        return renditions
     
     @staticmethod
     def _build_prompt(article_type: str, style_notes: str, reference_images: List[str]) -> str:
@@ -164,11 +340,13 @@ class MockNanoBananaService:
     """Mock Nano Banana service for testing without API key"""
     
     @staticmethod
-    def generate_photoshoot(
+    async def generate_photoshoot(
         reference_images: List[str],
         article_type: str,
         style_notes: str,
-        image_size: str
+        image_size: str,
+        on_image: Optional[OnImage] = None,
+        output_prefix: Optional[str] = None
     ) -> Dict[str, Any]:
         """
         Mock image generation for testing
@@ -183,6 +361,10 @@ class MockNanoBananaService:
             f"https://via.placeholder.com/768x768?text=Back+Shot"
         ]
         
+        if on_image is not None:
+            for index, image in enumerate(mock_images):
+                await on_image(index, image)
+        
         return {
             "success": True,
             "images": mock_images,
@@ -191,4 +373,98 @@ class MockNanoBananaService:
 
 
 # Use mock service if API key not configured
-GenerationService = NanoBananaService if settings.NANO_BANANA_API_KEY else MockNanoBananaService
+ProviderService = NanoBananaService if settings.NANO_BANANA_API_KEY else MockNanoBananaService
+
+
+class CachedGenerationService:
+    """
+    Deduplicates generations with identical inputs
+    
+    Results are served from the result cache when the same inputs were
+    generated before, and concurrent identical requests share one provider call.
+    Provider calls go through the admission controller.
+    """
+    
+    @staticmethod
+    async def generate_photoshoot(
+        reference_images: List[str],
+        article_type: str,
+        style_notes: str,
+        image_size: str,
+        on_image: Optional[OnImage] = None,
+        priority: str = PRIORITY_ANON,
+        output_prefix: Optional[str] = None,
+        owner: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Generate a photoshoot, reusing a cached or in-flight result for the
+        same inputs from the same owner
+        
+        on_image is called once per image, in order; images from a cached or
+        shared result are delivered when that result is available. priority
+        is the scheduling class (PRIORITY_PAID, PRIORITY_BONUS or
+        PRIORITY_ANON) used when a provider call has to wait for capacity.
+        output_prefix is where a provider call stores its images; callers
+        that share a cached or in-flight result get that call's URLs, which
+        is why results are only shared between requests of one owner (uid or
+        "anon-{ipHash}").
+        
+        Returns:
+            Same shape as NanoBananaService.generate_photoshoot, plus
+            "cached": True on a cache hit and "shared": True for a caller
+            that joined another request's provider call
+            
+        Raises:
+            SingleFlightLimitError: too many identical requests already waiting
+            AdmissionRejectedError: provider capacity and wait queue are full
+        """
+        key = fingerprint(reference_images, article_type, style_notes, image_size, owner or "")
+        
+        if settings.GENERATION_CACHE_ENABLED:
+            cached = generation_cache.get(key)
+            if cached is not None:
+                logger.info(f"Generation cache hit: {key[:12]}")
+                if on_image is not None:
+                    for index, image in enumerate(cached["images"]):
+                        await on_image(index, image)
+                return {**cached, "cached": True}
+        
+        delivered = set()
+        
+        async def deliver(index: int, image: str) -> None:
+            delivered.add(index)
+            await on_image(index, image)
+        
+        led = False
+        
+        async def call_provider() -> Dict[str, Any]:
+            nonlocal led
+            led = True
+            async with generation_admission.slot(priority):
+                result = await ProviderService.generate_photoshoot(
+                    reference_images=reference_images,
+                    article_type=article_type,
+                    style_notes=style_notes,
+                    image_size=image_size,
+                    on_image=deliver if on_image is not None else None,
+                    output_prefix=output_prefix
+                )
+            if result.get("success") and settings.GENERATION_CACHE_ENABLED:
+                generation_cache.put(key, result)
+            return result
+        
+        # Keyed by owner and inputs, so only one user's duplicates coalesce
+        result = await generation_flight.do(key, call_provider)
+        if not led and result.get("success"):
+            result = {**result, "shared": True}
+        
+        # Callers that joined another request's provider call get its images now
+        if on_image is not None and result.get("success"):
+            for index, image in enumerate(result["images"]):
+                if index not in delivered:
+                    await on_image(index, image)
+        
+        return result
+
+
+GenerationService = CachedGenerationService
@@ -0,0 +1,207 @@
+"""
+Streaming parser for provider responses
+Extracts the "outputs" array from the JSON body as it arrives and decodes
+base64 images chunk by chunk into spooled temp files
+"""
+
+import base64
+import hashlib
+import re
+from tempfile import SpooledTemporaryFile
+from typing import List, Optional
+
+# Decoded bytes kept in memory per image before spilling to disk
+SPOOL_MAX_BYTES = 1024 * 1024
+
+_OUTPUTS_KEY = re.compile(r'"outputs"\s*:\s*\[')
+_STRING_SPECIAL = re.compile(r'["\\]')
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+_SEEK, _ARRAY, _STRING, _DONE = range(4)
+
+# Leading bytes of the image formats the provider returns
+_MAGIC = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG", "image/png"),
+    (b"RIFF", "image/webp")
+)
+
+EXTENSIONS = {"image/jpeg": "jpg", "image/png": "png", "image/webp": "webp"}
+
+
+class ProviderOutput:
+    """One entry of the outputs array: a URL, or an image decoded into a temp file"""
+
+    def __init__(self):
+        self.url: Optional[str] = None
+        self.file: Optional[SpooledTemporaryFile] = None
+        self.content_type: Optional[str] = None
+        self.size = 0
+        self._mode: Optional[str] = None  # "url" | "base64", decided from the first characters
+        self._head = ""
+        self._url_parts: List[str] = []
+        self._pending = ""  # base64 characters not yet forming a full 4-character group
+        self._sha256 = hashlib.sha256()
+
+    def feed(self, text: str) -> None:
+        """Append the next piece of the JSON string value"""
+        if self._mode is None:
+            self._head += text
+            if self._head.startswith("data:"):
+                if "," not in self._head:
+                    if len(self._head) > 256:
+                        raise ValueError("Malformed data URL in provider output")
+                    return
+                meta, text = self._head.split(",", 1)
+                self.content_type = meta[len("data:"):].split(";", 1)[0] or None
+                self._mode = "base64"
+            elif len(self._head) >= 5:
+                self._mode = "url" if self._head.startswith("http") else "base64"
+                text = self._head
+            else:
+                return
+            self._head = ""
+
+        if self._mode == "url":
+            self._url_parts.append(text)
+        else:
+            self._decode(text)
+
+    def close(self) -> None:
+        """Finish the value once its closing quote has been read"""
+        if self._mode is None:
+            head, self._head = self._head, ""
+            self._mode = "url" if head.startswith("http") else "base64"
+            self.feed(head)
+        if self._mode == "url":
+            self.url = "".join(self._url_parts)
+            return
+
+        if self._pending:
+            self._write(base64.b64decode(self._pending + "=" * (-len(self._pending) % 4)))
+            self._pending = ""
+        if self.file is None:
+            raise ValueError("Empty image in provider output")
+        self.file.seek(0)
+
+    def read_base64(self) -> str:
+        """The decoded image as a data URL (fallback when it could not be stored)"""
+        self.file.seek(0)
+        return f"data:{self.content_type};base64," + base64.b64encode(self.file.read()).decode()
+
+    def discard(self) -> None:
+        """Release the temp file"""
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def _decode(self, text: str) -> None:
+        data = self._pending + "".join(text.split())
+        usable = len(data) - len(data) % 4
+        self._pending = data[usable:]
+        if usable:
+            self._write(base64.b64decode(data[:usable]))
+
+    def _write(self, chunk: bytes) -> None:
+        if self.file is None:
+            self.file = SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+            if self.content_type is None:
+                self.content_type = next(
+                    (content_type for magic, content_type in _MAGIC if chunk.startswith(magic)),
+                    "image/jpeg"
+                )
+        self.file.write(chunk)
+        self.size += len(chunk)
+        self._sha256.update(chunk)
+
+    @property
+    def digest(self) -> str:
+        """SHA-256 (hex) of the decoded image, computed while decoding"""
+        return self._sha256.hexdigest()
+
+
+class OutputsStreamParser:
+    """
+    Incremental parser for a provider response of the form {"outputs": ["...", ...]}
+
+    Only the outputs array is parsed; other keys are skipped without being
+    buffered. Each string in the array is streamed into a ProviderOutput as it
+    arrives, so no image is ever held in memory as a whole.
+    """
+
+    def __init__(self):
+        self._state = _SEEK
+        self._buffer = ""
+        self._current: Optional[ProviderOutput] = None
+        self._escape = False
+
+    @property
+    def found_outputs(self) -> bool:
+        return self._state != _SEEK
+
+    def feed(self, text: str) -> List[ProviderOutput]:
+        """
+        Consume the next chunk of the response body
+
+        Returns:
+            Outputs completed within this chunk, in order
+
+        Raises:
+            ValueError: the outputs array is not a list of strings
+        """
+        completed = []
+        i = 0
+        while i < len(text) and self._state != _DONE:
+            if self._state == _SEEK:
+                self._buffer += text[i:]
+                match = _OUTPUTS_KEY.search(self._buffer)
+                if not match:
+                    # Keep enough of the tail to match a key split across chunks
+                    self._buffer = self._buffer[-64:]
+                    return completed
+                text, i = self._buffer[match.end():], 0
+                self._buffer = ""
+                self._state = _ARRAY
+
+            elif self._state == _ARRAY:
+                char = text[i]
+                i += 1
+                if char == '"':
+                    self._current = ProviderOutput()
+                    self._state = _STRING
+                elif char == "]":
+                    self._state = _DONE
+                elif char not in " \t\r\n,":
+                    raise ValueError(f"Unexpected {char!r} in provider outputs")
+
+            elif self._escape:
+                if text[i] not in _ESCAPES:
+                    raise ValueError("Unsupported escape in provider output")
+                self._current.feed(_ESCAPES[text[i]])
+                self._escape = False
+                i += 1
+
+            else:
+                match = _STRING_SPECIAL.search(text, i)
+                end = match.start() if match else len(text)
+                if end > i:
+                    self._current.feed(text[i:end])
+                if not match:
+                    i = end
+                elif match.group() == '"':
+                    self._current.close()
+                    completed.append(self._current)
+                    self._current = None
+                    self._state = _ARRAY
+                    i = end + 1
+                else:
+                    self._escape = True
+                    i = end + 1
+
+        return completed
+
+    def discard(self) -> None:
+        """Release a partially read output"""
+        if self._current is not None:
+            self._current.discard()
+            self._current = None
@@ -0,0 +1,99 @@
+"""
+Derived renditions of generated images
+Produces WebP (and AVIF when available) variants at fixed widths plus a tiny
+blur placeholder, stored next to the original
+"""
+
+import base64
+import logging
+from io import BytesIO
+from typing import Any, BinaryIO, Dict, List, Optional
+
+from PIL import Image
+
+from app.config import settings
+from app.services.storage import StorageService
+
+logger = logging.getLogger(__name__)
+
+# AVIF is built into newer Pillow releases; older ones need pillow-avif-plugin
+try:
+    import pillow_avif  # noqa: F401
+except ImportError:
+    pass
+
+Image.init()
+
+# (MIME type, Pillow format, file extension), smallest first
+_FORMATS = [("image/webp", "WEBP", "webp")]
+if "AVIF" in Image.SAVE:
+    _FORMATS.insert(0, ("image/avif", "AVIF", "avif"))
+
+
+class RenditionService:
+    """Creates and stores responsive variants of generated images"""
+
+    @staticmethod
+    def create_renditions(bucket_name: str, blob_path: str, source: BinaryIO) -> Optional[Dict[str, Any]]:
+        """
+        Encode and upload the renditions of one stored image
+
+        Variants are written next to the original, e.g. image-1.jpg gets
+        image-1-256w.webp. Widths at or above the original width are skipped.
+
+        Args:
+            bucket_name: Firebase Storage bucket name
+            blob_path: Path of the original image in the bucket
+            source: Original image file, positioned anywhere
+
+        Returns:
+            {
+                "placeholder": str,  # Tiny blurred data URL to show while loading
+                "sources": [{"type": str, "width": int, "url": str}, ...]
+            }
+            or None if the image could not be processed
+        """
+        try:
+            source.seek(0)
+            with Image.open(source) as original:
+                original.load()
+                image = original.convert("RGB")
+        except Exception as e:
+            logger.error(f"Failed to open {blob_path} for renditions: {str(e)}")
+            return None
+
+        base_path = blob_path.rsplit(".", 1)[0]
+        variants = []
+        for width in settings.RENDITION_WIDTHS:
+            if width >= image.width:
+                continue
+            resized = image.resize((width, round(image.height * width / image.width)), Image.LANCZOS)
+            for content_type, pil_format, extension in _FORMATS:
+                output = BytesIO()
+                resized.save(output, format=pil_format, quality=settings.RENDITION_QUALITY)
+                variants.append((content_type, width, f"{base_path}-{width}w.{extension}", output.getvalue()))
+
+        urls = StorageService.upload_many(
+            bucket_name,
+            [(path, data, content_type) for content_type, _, path, data in variants]
+        )
+        sources: List[Dict[str, Any]] = [
+            {"type": content_type, "width": width, "url": url}
+            for (content_type, width, _, _), url in zip(variants, urls)
+            if url
+        ]
+
+        logger.info(f"Created {len(sources)} renditions for {blob_path}")
+        return {
+            "placeholder": RenditionService._placeholder(image),
+            "sources": sources
+        }
+
+    @staticmethod
+    def _placeholder(image: Image.Image) -> str:
+        """A few-hundred-byte preview, inlined so it needs no extra request"""
+        width = settings.RENDITION_PLACEHOLDER_WIDTH
+        tiny = image.resize((width, max(1, round(image.height * width / image.width))), Image.BILINEAR)
+        output = BytesIO()
+        tiny.save(output, format="WEBP", quality=30)
+        return "data:image/webp;base64," + base64.b64encode(output.getvalue()).decode()
@@ -0,0 +1,231 @@
+"""
+Firebase ID token signing keys
+Google's public signing certificates, prefetched on startup and refreshed in
+the background before their Cache-Control max-age runs out, so verifying an
+ID token is local CPU work instead of a blocking HTTPS fetch
+"""
+
+import asyncio
+import base64
+import binascii
+import json
+import logging
+import re
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import firebase_admin
+import httpx
+from firebase_admin import auth
+from google.auth import crypt
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+ID_TOKEN_ISSUER_PREFIX = "https://securetoken.google.com/"
+
+_MAX_AGE = re.compile(r"max-age=(\d+)")
+
+
+class SigningKeyCache:
+    """
+    Key id -> RSA verifier for Firebase ID tokens
+
+    Verifiers are built once per refresh, not once per token. verify() returns
+    None whenever it cannot decide locally (keys not loaded yet, expired, or
+    an unknown key id after a rotation) so the caller can fall back to
+    firebase_admin; an unknown key id also wakes the refresh loop early.
+    """
+
+    def __init__(
+        self,
+        certs_url: str,
+        project_id: str,
+        refresh_fraction: float,
+        min_refresh_seconds: float,
+        retry_seconds: float,
+        default_max_age: float = 3600
+    ):
+        self.certs_url = certs_url
+        self.project_id = project_id
+        self.refresh_fraction = refresh_fraction
+        self.min_refresh_seconds = min_refresh_seconds
+        self.retry_seconds = retry_seconds
+        self.default_max_age = default_max_age
+        self._verifiers: Dict[str, crypt.RSAVerifier] = {}
+        self._expires_at = 0.0
+        self._loaded_at = 0.0
+        self._attempted_at = 0.0
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stats = {"verified": 0, "rejected": 0, "fallbacks": 0, "refreshes": 0, "refreshFailures": 0}
+
+    async def start(self) -> None:
+        """Fetch the keys now, then keep them fresh in the background"""
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        await self.refresh()
+        self._task = asyncio.create_task(self._refresh_loop(), name="signing-key-refresh")
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def refresh(self) -> bool:
+        """
+        Download the current certificates
+
+        Returns:
+            True if the keys were replaced; on failure the old keys stay in use
+            until they expire
+        """
+        self._attempted_at = time.time()
+        try:
+            async with httpx.AsyncClient(timeout=10.0) as client:
+                response = await client.get(self.certs_url)
+                response.raise_for_status()
+            certs = response.json()
+            verifiers = {kid: crypt.RSAVerifier.from_string(cert) for kid, cert in certs.items()}
+        except Exception as e:
+            self._stats["refreshFailures"] += 1
+            logger.warning(f"Failed to fetch token signing keys from {self.certs_url}: {str(e)}")
+            return False
+
+        max_age = self._max_age(response.headers)
+        with self._lock:
+            self._verifiers = verifiers
+            self._loaded_at = self._attempted_at
+            self._expires_at = self._attempted_at + max_age
+        self._stats["refreshes"] += 1
+        logger.info(f"Loaded {len(verifiers)} token signing keys, valid for {int(max_age)}s")
+        return True
+
+    def verify(self, id_token: str) -> Optional[Dict[str, Any]]:
+        """
+        Verify an ID token against the cached keys, as firebase_admin would
+
+        Args:
+            id_token: Firebase ID token from client
+
+        Returns:
+            Decoded claims with "uid" set, or None if the keys cannot decide
+
+        Raises:
+            auth.ExpiredIdTokenError: Signature fine, token expired
+            auth.InvalidIdTokenError: Malformed, wrongly signed or wrong project
+        """
+        try:
+            signed_section, _, encoded_signature = id_token.rpartition(".")
+            encoded_header, _, encoded_payload = signed_section.partition(".")
+            header = json.loads(self._b64decode(encoded_header))
+            payload = json.loads(self._b64decode(encoded_payload))
+            signature = self._b64decode(encoded_signature)
+            if not isinstance(header, dict) or not isinstance(payload, dict):
+                raise ValueError("header and payload must be JSON objects")
+        except (ValueError, binascii.Error) as e:
+            self._stats["rejected"] += 1
+            raise auth.InvalidIdTokenError(f"Malformed ID token: {str(e)}", cause=e)
+
+        kid = header.get("kid")
+        with self._lock:
+            verifier = self._verifiers.get(kid) if self._expires_at > time.time() else None
+        if verifier is None:
+            self._stats["fallbacks"] += 1
+            if kid and self._verifiers:
+                self._request_refresh()
+            return None
+
+        project_id = self._project_id()
+        now = time.time()
+        error = None
+        if header.get("alg") != "RS256":
+            error = f"Unexpected algorithm {header.get('alg')}"
+        elif not verifier.verify(signed_section.encode(), signature):
+            error = "Invalid signature"
+        elif payload.get("aud") != project_id:
+            error = f"Unexpected audience {payload.get('aud')}"
+        elif payload.get("iss") != ID_TOKEN_ISSUER_PREFIX + project_id:
+            error = f"Unexpected issuer {payload.get('iss')}"
+        elif not isinstance(payload.get("sub"), str) or not 0 < len(payload["sub"]) <= 128:
+            error = "Missing or invalid subject"
+        elif not isinstance(payload.get("iat"), (int, float)) or payload["iat"] > now:
+            error = "Token used too early"
+        if error:
+            self._stats["rejected"] += 1
+            raise auth.InvalidIdTokenError(error)
+        if not isinstance(payload.get("exp"), (int, float)) or payload["exp"] < now:
+            self._stats["rejected"] += 1
+            raise auth.ExpiredIdTokenError("Token expired", cause=None)
+
+        payload["uid"] = payload["sub"]
+        self._stats["verified"] += 1
+        return payload
+
+    def stats(self) -> Dict[str, Any]:
+        """Verification counters and key freshness"""
+        return {
+            **self._stats,
+            "keys": len(self._verifiers),
+            "expiresIn": max(0, int(self._expires_at - time.time()))
+        }
+
+    def _project_id(self) -> str:
+        if not self.project_id:
+            try:
+                self.project_id = firebase_admin.get_app().project_id or ""
+            except ValueError:
+                pass
+        return self.project_id
+
+    def _next_refresh_in(self) -> float:
+        now = time.time()
+        if self._expires_at <= now:
+            return self.retry_seconds
+        if self._attempted_at > self._loaded_at:
+            # Last refresh failed; retry while the old keys are still valid
+            return min(self.retry_seconds, self._expires_at - now)
+        refresh_at = self._loaded_at + (self._expires_at - self._loaded_at) * self.refresh_fraction
+        return max(refresh_at - now, 1.0)
+
+    def _request_refresh(self) -> None:
+        # Called from request threads; a forged kid must not trigger a fetch per request
+        if self._loop is None or time.time() - self._attempted_at < self.min_refresh_seconds:
+            return
+        self._loop.call_soon_threadsafe(self._wake.set)
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self._next_refresh_in())
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.refresh()
+
+    def _max_age(self, headers: httpx.Headers) -> float:
+        match = _MAX_AGE.search(headers.get("cache-control", ""))
+        max_age = float(match.group(1)) if match else self.default_max_age
+        try:
+            max_age -= float(headers.get("age", 0))
+        except ValueError:
+            pass
+        return max(max_age, 0.0)
+
+    @staticmethod
+    def _b64decode(segment: str) -> bytes:
+        return base64.urlsafe_b64decode(segment + "=" * (-len(segment) % 4))
+
+
+signing_keys = SigningKeyCache(
+    certs_url=settings.FIREBASE_CERTS_URL,
+    project_id=settings.FIREBASE_PROJECT_ID,
+    refresh_fraction=settings.SIGNING_KEYS_REFRESH_FRACTION,
+    min_refresh_seconds=settings.SIGNING_KEYS_MIN_REFRESH_SECONDS,
+    retry_seconds=settings.SIGNING_KEYS_RETRY_SECONDS
+)
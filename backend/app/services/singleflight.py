@@ -0,0 +1,82 @@
+"""
+Single-flight request coalescing
+Concurrent calls with the same key share one execution and its result
+"""
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlightLimitError(Exception):
+    """Raised when too many callers are already waiting on the same key"""
+
+
+class _Call:
+    """An in-flight execution and the number of callers awaiting it"""
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Deduplicates concurrent async calls by key"""
+
+    def __init__(self, max_waiters: int):
+        self.max_waiters = max_waiters
+        self._calls: Dict[str, _Call] = {}
+        self._stats = {"executions": 0, "coalesced": 0, "rejected": 0, "abandoned": 0}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Run fn() once per key at a time and share its result
+
+        The first caller starts the execution; later callers with the same key
+        wait for it. A caller that is cancelled stops waiting without affecting
+        the others; the execution itself is cancelled only when every caller
+        has gone away.
+
+        Raises:
+            SingleFlightLimitError: if max_waiters callers already share the key
+        """
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.create_task(fn()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _: self._forget(key, call))
+            self._stats["executions"] += 1
+        elif call.waiters >= self.max_waiters:
+            self._stats["rejected"] += 1
+            raise SingleFlightLimitError(f"{call.waiters} requests already waiting on {key[:12]}")
+        else:
+            self._stats["coalesced"] += 1
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        except asyncio.CancelledError:
+            if call.waiters == 1 and not call.task.done():
+                # Last caller left: nobody wants the result any more
+                self._forget(key, call)
+                call.task.cancel()
+                self._stats["abandoned"] += 1
+                logger.info(f"Cancelled abandoned call {key[:12]}")
+            raise
+        finally:
+            call.waiters -= 1
+
+    def stats(self) -> Dict[str, int]:
+        """Execution/coalescing counters and number of keys in flight"""
+        return {**self._stats, "inFlight": len(self._calls)}
+
+    def _forget(self, key: str, call: _Call) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+
+generation_flight = SingleFlight(max_waiters=settings.SINGLEFLIGHT_MAX_WAITERS)
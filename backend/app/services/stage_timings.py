@@ -0,0 +1,56 @@
+"""
+Request stage timings
+Latency percentiles for the stages of the generation request path
+"""
+
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, Iterator
+
+# Recent samples kept per stage for percentiles
+_SAMPLES = 1000
+
+
+class StageTimings:
+    """Rolling latency samples per named stage"""
+
+    def __init__(self, samples: int = _SAMPLES):
+        self.samples = samples
+        self._durations: Dict[str, Deque[float]] = {}
+        self._counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def measure(self, stage: str) -> Iterator[None]:
+        """Time the enclosed block; failed attempts are recorded too"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - started)
+
+    def record(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            if stage not in self._durations:
+                self._durations[stage] = deque(maxlen=self.samples)
+                self._counts[stage] = 0
+            self._durations[stage].append(seconds)
+            self._counts[stage] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Count and p50/p99 milliseconds per stage"""
+        with self._lock:
+            snapshot = {stage: (self._counts[stage], sorted(durations)) for stage, durations in self._durations.items()}
+        return {
+            stage: {
+                "count": count,
+                "p50Ms": round(ordered[int(0.50 * (len(ordered) - 1))] * 1000, 1),
+                "p99Ms": round(ordered[int(0.99 * (len(ordered) - 1))] * 1000, 1)
+            }
+            for stage, (count, ordered) in snapshot.items()
+        }
+
+
+generation_stages = StageTimings()
@@ -1,20 +1,138 @@
 """
-Firebase Storage operations
-Handles image upload and retrieval from Firebase Storage
+Storage operations
+Handles image upload and retrieval through the configured storage backend
 """
 
-import firebase_admin
-from firebase_admin import storage
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import logging
-from typing import Optional
+import threading
+import time
+from typing import Any, BinaryIO, Callable, Dict, List, Optional, Tuple, TypeVar, Union
 import uuid
 
+from app.config import settings
+from app.services.storage_backends import StorageBackend, get_backend, validate_blob_path
+
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
+# Shared pool for blocking uploads, bounded so one shoot can't exhaust connections
+_upload_executor = ThreadPoolExecutor(
+    max_workers=settings.STORAGE_UPLOAD_WORKERS,
+    thread_name_prefix="storage-upload"
+)
+
+
+class BlobUrlCache:
+    """
+    LRU of public URLs, and of paths known not to exist, per backend
+
+    Blob paths are never rewritten with different content, so a known URL
+    stays valid until the blob is deleted. Misses are remembered only briefly,
+    since the blob may be uploaded at any time.
+    """
+
+    def __init__(self, max_entries: int, negative_ttl: float):
+        self.max_entries = max_entries
+        self.negative_ttl = negative_ttl
+        # (backend, blob_path) -> (URL or None, negative entry expiry)
+        self._entries: "OrderedDict[Tuple[StorageBackend, str], Tuple[Optional[str], float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "negativeHits": 0, "misses": 0, "invalidations": 0}
+
+    def get(self, backend: StorageBackend, blob_path: str) -> Tuple[bool, Optional[str]]:
+        """(found, URL); a found None means the blob is known not to exist"""
+        key = (backend, blob_path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                url, expires_at = entry
+                if url is not None:
+                    self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return True, url
+                if expires_at > time.monotonic():
+                    self._stats["negativeHits"] += 1
+                    return True, None
+                del self._entries[key]
+            self._stats["misses"] += 1
+            return False, None
+
+    def put(self, backend: StorageBackend, blob_path: str, url: Optional[str]) -> None:
+        """Remember a URL, or None for a blob that does not exist"""
+        key = (backend, blob_path)
+        with self._lock:
+            self._entries[key] = (url, time.monotonic() + self.negative_ttl if url is None else 0.0)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, backend: StorageBackend, blob_path: str) -> None:
+        with self._lock:
+            if self._entries.pop((backend, blob_path), None) is not None:
+                self._stats["invalidations"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters"""
+        lookups = self._stats["hits"] + self._stats["negativeHits"] + self._stats["misses"]
+        return {
+            **self._stats,
+            "hitRate": round((lookups - self._stats["misses"]) / lookups, 3) if lookups else 0.0,
+            "entries": len(self._entries)
+        }
+
+
+url_cache = BlobUrlCache(
+    max_entries=settings.STORAGE_URL_CACHE_MAX_ENTRIES,
+    negative_ttl=settings.STORAGE_URL_NEGATIVE_TTL
+)
+
+
+def _upload_public(
+    backend: StorageBackend,
+    blob_path: str,
+    data: Union[bytes, BinaryIO],
+    content_type: str,
+    cache_control: Optional[str] = None
+) -> str:
+    """
+    Upload bytes or a file object as a public blob, retrying transient failures
+
+    Public access is set by the upload itself, so each attempt is a single
+    request.
+
+    Returns:
+        Public URL
+
+    Raises:
+        The last upload error once all attempts have failed
+    """
+    validate_blob_path(blob_path)
+    attempts = settings.STORAGE_UPLOAD_RETRIES + 1
+    for attempt in range(1, attempts + 1):
+        try:
+            url = backend.upload(blob_path, data, content_type, cache_control)
+            url_cache.put(backend, blob_path, url)
+            return url
+        except Exception as e:
+            if attempt == attempts:
+                raise
+            delay = 0.5 * 2 ** (attempt - 1)
+            logger.warning(f"Upload of {blob_path} failed (attempt {attempt}/{attempts}), retrying in {delay}s: {str(e)}")
+            time.sleep(delay)
+
 
 class StorageService:
-    """Firebase Storage service for image management"""
+    """Image storage on the configured backend (Firebase Storage or local disk)"""
+    
+    @staticmethod
+    def is_configured() -> bool:
+        """True if images can be stored (a bucket is set or the local backend is used)"""
+        return settings.STORAGE_BACKEND == "local" or bool(settings.FIREBASE_STORAGE_BUCKET)
     
     @staticmethod
     def upload_image(
@@ -25,7 +143,10 @@ class StorageService:
         shoot_id: str
     ) -> Optional[str]:
         """
-        Upload image to Firebase Storage
+        Upload image to storage
+        
+        With STORAGE_CAS_ENABLED the file is stored once by content hash in
+        the default bucket and folder/uid/shoot_id are not used.
         
         Args:
             bucket_name: Firebase Storage bucket name
@@ -37,15 +158,20 @@ class StorageService:
         Returns:
             Download URL or None if failed
         """
+        if settings.STORAGE_CAS_ENABLED:
+            # Imported here: the blob store is built on this service
+            from app.services.blob_store import blob_store
+            
+            with open(file_path, "rb") as f:
+                stored = blob_store.put(f, "image/jpeg")
+            return stored[1] if stored else None
+        
         try:
-            bucket = storage.bucket(bucket_name)
             blob_path = f"{folder}/{uid}/{shoot_id}/{uuid.uuid4().hex}.jpg"
-            blob = bucket.blob(blob_path)
             
-            blob.upload_from_filename(file_path)
-            blob.make_public()
+            with open(file_path, "rb") as f:
+                download_url = get_backend(bucket_name).upload(blob_path, f, "image/jpeg")
             
-            download_url = blob.public_url
             logger.info(f"Uploaded image to {blob_path}")
             return download_url
         except Exception as e:
@@ -53,80 +179,163 @@ class StorageService:
             return None
     
     @staticmethod
-    def save_generated_images(
+    def upload_bytes(
         bucket_name: str,
-        images: list,
-        uid: str,
-        shoot_id: str
-    ) -> list:
+        blob_path: str,
+        data: bytes,
+        content_type: str = "image/jpeg",
+        cache_control: Optional[str] = None
+    ) -> Optional[str]:
         """
-        Save generated images to Firebase Storage
+        Upload in-memory data to a fixed path in Firebase Storage
         
         Args:
             bucket_name: Firebase Storage bucket name
-            images: List of image data (base64 or file paths)
-            uid: User ID or anon IP hash
-            shoot_id: Photoshoot ID
-            
+            blob_path: Destination path in the bucket
+            data: File contents
+            content_type: MIME type stored with the blob
+            cache_control: Optional Cache-Control header served with the blob
+        
         Returns:
-            List of download URLs
+            Public URL or None if failed
         """
         try:
-            bucket = storage.bucket(bucket_name)
-            download_urls = []
-            
-            for idx, image_data in enumerate(images):
-                try:
-                    # If image is already a URL (from API), store the URL
-                    if isinstance(image_data, str) and image_data.startswith("http"):
-                        download_urls.append(image_data)
-                    else:
-                        # If base64 encoded, decode and save
-                        import base64
-                        from io import BytesIO
-                        
-                        if isinstance(image_data, str):
-                            image_bytes = base64.b64decode(image_data)
-                        else:
-                            image_bytes = image_data
-                        
-                        blob_path = f"generated-images/{uid}/{shoot_id}/image-{idx+1}.jpg"
-                        blob = bucket.blob(blob_path)
-                        blob.upload_from_string(image_bytes, content_type="image/jpeg")
-                        blob.make_public()
-                        
-                        download_urls.append(blob.public_url)
-                        logger.info(f"Saved generated image: {blob_path}")
-                except Exception as e:
-                    logger.error(f"Failed to save image {idx}: {str(e)}")
-                    continue
-            
-            return download_urls
+            url = _upload_public(get_backend(bucket_name), blob_path, data, content_type, cache_control)
+            logger.info(f"Uploaded {len(data)} bytes to {blob_path}")
+            return url
         except Exception as e:
-            logger.error(f"Failed to process generated images: {str(e)}", exc_info=True)
-            return []
+            logger.error(f"Failed to upload {blob_path}: {str(e)}")
+            return None
     
     @staticmethod
-    def get_download_url(bucket_name: str, blob_path: str) -> Optional[str]:
-        """Get download URL for stored image"""
+    def upload_file(
+        bucket_name: str,
+        blob_path: str,
+        file_obj: BinaryIO,
+        content_type: str = "image/jpeg",
+        cache_control: Optional[str] = None
+    ) -> Optional[str]:
+        """
+        Upload a file object to a fixed path without reading it into memory
+        
+        Args:
+            bucket_name: Firebase Storage bucket name
+            blob_path: Destination path in the bucket
+            file_obj: Seekable binary file
+            content_type: MIME type stored with the blob
+            cache_control: Optional Cache-Control header served with the blob
+            
+        Returns:
+            Public URL or None if failed
+        """
         try:
-            bucket = storage.bucket(bucket_name)
-            blob = bucket.blob(blob_path)
-            if blob.exists():
-                return blob.public_url
-            return None
+            url = _upload_public(get_backend(bucket_name), blob_path, file_obj, content_type, cache_control)
+            logger.info(f"Uploaded {blob_path}")
+            return url
         except Exception as e:
-            logger.error(f"Failed to get download URL: {str(e)}")
+            logger.error(f"Failed to upload {blob_path}: {str(e)}")
             return None
     
+    @staticmethod
+    def upload_many(
+        bucket_name: str,
+        items: List[Tuple[str, bytes, str]]
+    ) -> List[Optional[str]]:
+        """
+        Upload several in-memory files concurrently on the upload pool
+        
+        Args:
+            bucket_name: Firebase Storage bucket name
+            items: (blob_path, data, content_type) tuples
+            
+        Returns:
+            Public URL per item, in order (None where the upload failed)
+        """
+        backend = get_backend(bucket_name)
+        futures = [
+            _upload_executor.submit(_upload_public, backend, blob_path, data, content_type)
+            for blob_path, data, content_type in items
+        ]
+        urls = []
+        for (blob_path, _, _), future in zip(items, futures):
+            try:
+                urls.append(future.result())
+            except Exception as e:
+                logger.error(f"Failed to upload {blob_path}: {str(e)}")
+                urls.append(None)
+        return urls
+    
+    @staticmethod
+    async def run_upload(func: Callable[..., T], *args: Any) -> T:
+        """
+        Run a blocking upload on the shared upload pool
+        
+        Use this instead of asyncio.to_thread for storage writes, so concurrent
+        shoots share STORAGE_UPLOAD_WORKERS connections instead of the default
+        executor.
+        """
+        return await asyncio.get_running_loop().run_in_executor(_upload_executor, lambda: func(*args))
+    
+    @staticmethod
+    def get_download_url(bucket_name: str, blob_path: str) -> Optional[str]:
+        """
+        Get download URL for stored image
+        
+        Answered from the URL cache when possible, so only the first lookup of
+        a path checks that the blob exists.
+        """
+        return StorageService.get_download_urls(bucket_name, [blob_path])[0]
+    
+    @staticmethod
+    def get_download_urls(bucket_name: str, blob_paths: List[str]) -> List[Optional[str]]:
+        """
+        Get download URLs for many stored images at once
+        
+        Cached paths cost nothing; the rest are checked concurrently on the
+        storage pool.
+        
+        Args:
+            bucket_name: Firebase Storage bucket name
+            blob_paths: Paths in the bucket
+            
+        Returns:
+            URL per path, in order (None where the blob does not exist or the check failed)
+        """
+        backend = get_backend(bucket_name)
+        urls: List[Optional[str]] = []
+        missing: Dict[str, Any] = {}
+        for blob_path in blob_paths:
+            found, url = url_cache.get(backend, blob_path)
+            urls.append(url)
+            if not found and blob_path not in missing:
+                missing[blob_path] = _upload_executor.submit(StorageService._lookup_url, backend, blob_path)
+        
+        if missing:
+            for index, blob_path in enumerate(blob_paths):
+                if blob_path in missing:
+                    try:
+                        urls[index] = missing[blob_path].result()
+                    except Exception as e:
+                        logger.error(f"Failed to get download URL: {str(e)}")
+        return urls
+    
+    @staticmethod
+    def _lookup_url(backend: StorageBackend, blob_path: str) -> Optional[str]:
+        """Check one blob in storage and cache the answer (runs on the storage pool)"""
+        url = backend.public_url(blob_path) if backend.exists(blob_path) else None
+        url_cache.put(backend, blob_path, url)
+        return url
+    
     @staticmethod
     def delete_image(bucket_name: str, blob_path: str) -> bool:
-        """Delete image from Firebase Storage"""
+        """Delete image from storage"""
+        backend = get_backend(bucket_name)
         try:
-            bucket = storage.bucket(bucket_name)
-            bucket.delete_blob(blob_path)
+            backend.delete(blob_path)
             logger.info(f"Deleted image: {blob_path}")
             return True
         except Exception as e:
             logger.error(f"Failed to delete image: {str(e)}")
             return False
+        finally:
+            url_cache.invalidate(backend, blob_path)
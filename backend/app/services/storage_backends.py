@@ -0,0 +1,300 @@
+"""
+Storage backends
+Firebase Storage for production and a local filesystem backend for
+development, tests and offline benchmarks
+"""
+
+import hashlib
+import hmac
+import os
+import shutil
+import time
+import uuid
+from abc import ABC, abstractmethod
+from datetime import timedelta
+from functools import lru_cache
+from typing import Any, BinaryIO, Dict, Optional, Union
+from urllib.parse import urlencode
+
+from firebase_admin import storage
+from google.api_core.exceptions import NotFound
+
+from app.config import settings
+
+
+def validate_blob_path(blob_path: str) -> str:
+    """
+    Reject paths that could escape the storage root
+
+    Raises:
+        ValueError: absolute path or ".." segment
+    """
+    if not blob_path or blob_path.startswith("/") or "\\" in blob_path:
+        raise ValueError(f"Invalid blob path: {blob_path!r}")
+    if any(part in ("", ".", "..") for part in blob_path.split("/")):
+        raise ValueError(f"Invalid blob path: {blob_path!r}")
+    return blob_path
+
+
+class StorageBackend(ABC):
+    """Blob storage used by StorageService"""
+
+    @abstractmethod
+    def upload(
+        self,
+        blob_path: str,
+        data: Union[bytes, BinaryIO],
+        content_type: str,
+        cache_control: Optional[str] = None
+    ) -> str:
+        """Store bytes or a seekable file as a public blob and return its URL"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def exists(self, blob_path: str) -> bool:
+        raise NotImplementedError
+
+    @abstractmethod
+    def public_url(self, blob_path: str) -> str:
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete(self, blob_path: str) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def download(self, blob_path: str, file_obj: BinaryIO) -> bool:
+        """Write a blob into file_obj; False if it does not exist"""
+        raise NotImplementedError
+
+    def local_path(self, blob_path: str) -> Optional[str]:
+        """Filesystem path of a blob if the backend is local, else None"""
+        return None
+
+    @abstractmethod
+    def stat(self, blob_path: str) -> Optional[Dict[str, Any]]:
+        """{"size": int, "contentType": str} of a blob, or None if it does not exist"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def read_head(self, blob_path: str, length: int) -> bytes:
+        """First length bytes of a blob"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def signed_upload(
+        self,
+        blob_path: str,
+        content_type: str,
+        max_bytes: int,
+        expires_in: int
+    ) -> Dict[str, Any]:
+        """
+        Short-lived URL a client can PUT one public blob to directly
+
+        Returns:
+            {"url": str, "method": "PUT", "headers": {...}} - the client must
+            send exactly these headers with the upload
+        """
+        raise NotImplementedError
+
+
+class FirebaseStorageBackend(StorageBackend):
+    """Blobs in a Firebase Storage bucket, uploaded with a public-read ACL"""
+
+    def __init__(self, bucket_name: str):
+        self.bucket_name = bucket_name
+        self._bucket = None
+
+    @property
+    def bucket(self):
+        # Resolved on first use so the backend can be built before Firebase is initialized
+        if self._bucket is None:
+            self._bucket = storage.bucket(self.bucket_name)
+        return self._bucket
+
+    def upload(
+        self,
+        blob_path: str,
+        data: Union[bytes, BinaryIO],
+        content_type: str,
+        cache_control: Optional[str] = None
+    ) -> str:
+        blob = self.bucket.blob(blob_path)
+        if cache_control:
+            blob.cache_control = cache_control
+        if isinstance(data, bytes):
+            blob.upload_from_string(
+                data,
+                content_type=content_type,
+                predefined_acl="publicRead",
+                timeout=settings.STORAGE_UPLOAD_TIMEOUT,
+                retry=None
+            )
+        else:
+            # Streamed from the file in chunks
+            data.seek(0)
+            blob.upload_from_file(
+                data,
+                content_type=content_type,
+                predefined_acl="publicRead",
+                timeout=settings.STORAGE_UPLOAD_TIMEOUT,
+                retry=None
+            )
+        return blob.public_url
+
+    def exists(self, blob_path: str) -> bool:
+        return self.bucket.blob(blob_path).exists()
+
+    def public_url(self, blob_path: str) -> str:
+        return self.bucket.blob(blob_path).public_url
+
+    def delete(self, blob_path: str) -> None:
+        self.bucket.delete_blob(blob_path)
+
+    def download(self, blob_path: str, file_obj: BinaryIO) -> bool:
+        try:
+            self.bucket.blob(blob_path).download_to_file(file_obj)
+            return True
+        except NotFound:
+            return False
+
+    def stat(self, blob_path: str) -> Optional[Dict[str, Any]]:
+        blob = self.bucket.get_blob(blob_path)
+        if blob is None:
+            return None
+        return {"size": blob.size, "contentType": blob.content_type}
+
+    def read_head(self, blob_path: str, length: int) -> bytes:
+        return self.bucket.blob(blob_path).download_as_bytes(start=0, end=length - 1)
+
+    def signed_upload(
+        self,
+        blob_path: str,
+        content_type: str,
+        max_bytes: int,
+        expires_in: int
+    ) -> Dict[str, Any]:
+        # Signed headers are enforced by GCS: the object is created public and
+        # anything larger than max_bytes is rejected before it is stored
+        extra_headers = {
+            "x-goog-acl": "public-read",
+            "x-goog-content-length-range": f"0,{max_bytes}"
+        }
+        url = self.bucket.blob(blob_path).generate_signed_url(
+            version="v4",
+            expiration=timedelta(seconds=expires_in),
+            method="PUT",
+            content_type=content_type,
+            # Copied: the client library adds Host to the dict it is given
+            headers=dict(extra_headers)
+        )
+        return {
+            "url": url,
+            "method": "PUT",
+            "headers": {"Content-Type": content_type, **extra_headers}
+        }
+
+
+class LocalStorageBackend(StorageBackend):
+    """Blobs as files under a local directory, served by GET /api/images/{blob_path}"""
+
+    def __init__(self, root: str, base_url: str, signing_key: bytes):
+        self.root = os.path.abspath(root)
+        self.base_url = base_url.rstrip("/")
+        self.signing_key = signing_key
+
+    def upload(
+        self,
+        blob_path: str,
+        data: Union[bytes, BinaryIO],
+        content_type: str,
+        cache_control: Optional[str] = None
+    ) -> str:
+        path = self._path(blob_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write to a temp file and rename, so readers never see a partial blob
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                if isinstance(data, bytes):
+                    f.write(data)
+                else:
+                    data.seek(0)
+                    shutil.copyfileobj(data, f)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return self.public_url(blob_path)
+
+    def exists(self, blob_path: str) -> bool:
+        return os.path.isfile(self._path(blob_path))
+
+    def public_url(self, blob_path: str) -> str:
+        return f"{self.base_url}/api/images/{blob_path}"
+
+    def delete(self, blob_path: str) -> None:
+        os.remove(self._path(blob_path))
+
+    def download(self, blob_path: str, file_obj: BinaryIO) -> bool:
+        path = self._path(blob_path)
+        if not os.path.isfile(path):
+            return False
+        with open(path, "rb") as f:
+            shutil.copyfileobj(f, file_obj)
+        return True
+
+    def local_path(self, blob_path: str) -> Optional[str]:
+        path = self._path(blob_path)
+        return path if os.path.isfile(path) else None
+
+    def stat(self, blob_path: str) -> Optional[Dict[str, Any]]:
+        path = self._path(blob_path)
+        if not os.path.isfile(path):
+            return None
+        # No metadata is kept on disk; uploads are checked against their signed type
+        return {"size": os.path.getsize(path), "contentType": None}
+
+    def read_head(self, blob_path: str, length: int) -> bytes:
+        with open(self._path(blob_path), "rb") as f:
+            return f.read(length)
+
+    def signed_upload(
+        self,
+        blob_path: str,
+        content_type: str,
+        max_bytes: int,
+        expires_in: int
+    ) -> Dict[str, Any]:
+        expires = int(time.time()) + expires_in
+        query = urlencode({
+            "contentType": content_type,
+            "maxBytes": max_bytes,
+            "expires": expires,
+            "signature": self.upload_signature(blob_path, content_type, max_bytes, expires)
+        })
+        return {
+            "url": f"{self.base_url}/api/uploads/direct/{validate_blob_path(blob_path)}?{query}",
+            "method": "PUT",
+            "headers": {"Content-Type": content_type}
+        }
+
+    def upload_signature(self, blob_path: str, content_type: str, max_bytes: int, expires: int) -> str:
+        """HMAC over everything the PUT /api/uploads/direct route enforces"""
+        message = f"PUT\n{blob_path}\n{content_type}\n{max_bytes}\n{expires}".encode()
+        return hmac.new(self.signing_key, message, hashlib.sha256).hexdigest()
+
+    def _path(self, blob_path: str) -> str:
+        return os.path.join(self.root, *validate_blob_path(blob_path).split("/"))
+
+
+@lru_cache(maxsize=None)
+def get_backend(bucket_name: str) -> StorageBackend:
+    """Backend selected by STORAGE_BACKEND, one instance per bucket"""
+    if settings.STORAGE_BACKEND == "local":
+        # Without a configured secret, signed URLs are only valid for this process
+        signing_key = settings.UPLOAD_SIGNING_SECRET.encode() or os.urandom(32)
+        return LocalStorageBackend(settings.LOCAL_STORAGE_DIR, settings.BACKEND_URL, signing_key)
+    return FirebaseStorageBackend(bucket_name)
@@ -0,0 +1,90 @@
+"""
+Verified ID token cache
+Decoded Firebase ID token claims kept until the token expires, so repeat
+requests with the same token skip signature verification
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from app.config import settings
+
+
+class TokenCache:
+    """
+    LRU of decoded claims keyed by SHA-256 of the token
+
+    Tokens themselves are never stored. Revoking a user drops their entries
+    and rejects any of their tokens issued before the revocation.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        # token digest -> (expires_at, claims)
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        # uid -> time of the last revocation
+        self._revoked: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "expired": 0, "revocations": 0}
+
+    def get(self, id_token: str) -> Optional[Dict[str, Any]]:
+        """Cached claims for a token, or None if it must be verified"""
+        key = self._key(id_token)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            expires_at, claims = entry
+            if expires_at <= now:
+                del self._entries[key]
+                self._stats["expired"] += 1
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return dict(claims)
+
+    def put(self, id_token: str, claims: Dict[str, Any]) -> None:
+        """Remember verified claims until the token's exp"""
+        expires_at = claims.get("exp")
+        if not expires_at or self._issued_before_revocation(claims):
+            return
+        with self._lock:
+            key = self._key(id_token)
+            self._entries[key] = (float(expires_at), dict(claims))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def revoke_user(self, uid: str) -> None:
+        """Forget a user's tokens and refuse to cache ones issued earlier"""
+        with self._lock:
+            self._revoked[uid] = time.time()
+            for key in [key for key, (_, claims) in self._entries.items() if claims.get("uid") == uid]:
+                del self._entries[key]
+            self._stats["revocations"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters"""
+        lookups = self._stats["hits"] + self._stats["misses"]
+        return {
+            **self._stats,
+            "hitRate": round(self._stats["hits"] / lookups, 3) if lookups else 0.0,
+            "entries": len(self._entries)
+        }
+
+    def _issued_before_revocation(self, claims: Dict[str, Any]) -> bool:
+        revoked_at = self._revoked.get(claims.get("uid"))
+        return revoked_at is not None and claims.get("iat", 0) < revoked_at
+
+    @staticmethod
+    def _key(id_token: str) -> str:
+        return hashlib.sha256(id_token.encode()).hexdigest()
+
+
+token_cache = TokenCache(max_entries=settings.TOKEN_CACHE_MAX_ENTRIES)
@@ -0,0 +1,188 @@
+"""
+Exhausted anonymous trial filter
+Bloom filter of IP hashes whose free trial is used up, so their requests are
+refused without reading anonUsers from Firestore
+"""
+
+import asyncio
+import hashlib
+import logging
+import math
+import os
+import struct
+import threading
+from typing import Callable, Dict, Iterable, List, Optional
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Bumped when the meaning of an entry changes, so older snapshots are rebuilt
+_SNAPSHOT_MAGIC = b"BLM2"
+# magic, capacity, hash count, bit count, items added
+_SNAPSHOT_HEADER = struct.Struct(">4sQIQQ")
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings"""
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = capacity
+        self.bit_count = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.bit_count / capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.bit_count + 7) // 8)
+
+    def add(self, key: str) -> bool:
+        """Add a key; returns False if it was (probably) present already"""
+        added = False
+        for position in self._positions(key):
+            byte, bit = divmod(position, 8)
+            if not self._bits[byte] & (1 << bit):
+                self._bits[byte] |= 1 << bit
+                added = True
+        if added:
+            self.count += 1
+        return added
+
+    def __contains__(self, key: str) -> bool:
+        return all(self._bits[position // 8] & (1 << (position % 8)) for position in self._positions(key))
+
+    @property
+    def size_bytes(self) -> int:
+        return len(self._bits)
+
+    def to_bytes(self) -> bytes:
+        header = _SNAPSHOT_HEADER.pack(_SNAPSHOT_MAGIC, self.capacity, self.hash_count, self.bit_count, self.count)
+        return header + bytes(self._bits)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "BloomFilter":
+        magic, capacity, hash_count, bit_count, count = _SNAPSHOT_HEADER.unpack_from(data)
+        if magic != _SNAPSHOT_MAGIC:
+            raise ValueError("Not a Bloom filter snapshot")
+        bloom = cls.__new__(cls)
+        bloom.capacity = capacity
+        bloom.hash_count = hash_count
+        bloom.bit_count = bit_count
+        bloom.count = count
+        bloom._bits = bytearray(data[_SNAPSHOT_HEADER.size:])
+        if len(bloom._bits) != (bit_count + 7) // 8:
+            raise ValueError("Truncated Bloom filter snapshot")
+        return bloom
+
+    def _positions(self, key: str) -> Iterable[int]:
+        # Double hashing: k positions from two 64-bit halves of one digest
+        digest = hashlib.sha256(key.encode()).digest()
+        first, second = struct.unpack_from(">QQ", digest)
+        return ((first + index * second) % self.bit_count for index in range(self.hash_count))
+
+
+class ExhaustedIpFilter:
+    """
+    Process-local set of IP hashes known to have no free generations left
+
+    A false positive refuses an eligible IP, so the error rate is kept low.
+    The filter is loaded from a snapshot on startup, then warmed from
+    Firestore in the background and snapshotted periodically.
+    """
+
+    def __init__(self, capacity: int, error_rate: float, snapshot_path: Optional[str], snapshot_seconds: float):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.snapshot_path = snapshot_path
+        self.snapshot_seconds = snapshot_seconds
+        self._bloom = BloomFilter(capacity, error_rate)
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._tasks: List[asyncio.Task] = []
+        self._stats = {"hits": 0, "checks": 0, "warmed": 0}
+
+        if snapshot_path and os.path.exists(snapshot_path):
+            try:
+                with open(snapshot_path, "rb") as f:
+                    self._bloom = BloomFilter.from_bytes(f.read())
+                logger.info(f"Loaded exhausted-IP filter snapshot ({self._bloom.count} entries)")
+            except (OSError, ValueError, struct.error) as e:
+                logger.warning(f"Ignoring exhausted-IP filter snapshot: {str(e)}")
+
+        if snapshot_path and not os.access(os.path.dirname(os.path.abspath(snapshot_path)), os.W_OK):
+            logger.warning(f"Cannot write exhausted-IP filter snapshots to {snapshot_path}, keeping the filter in memory only")
+            self.snapshot_path = None
+
+    def add(self, ip_hash: str) -> None:
+        """Record an IP whose trial exhaustion has been committed"""
+        with self._lock:
+            if self._bloom.add(ip_hash):
+                self._dirty = True
+                if self._bloom.count == self.capacity:
+                    logger.warning(f"Exhausted-IP filter reached its capacity of {self.capacity}")
+
+    def __contains__(self, ip_hash: str) -> bool:
+        with self._lock:
+            found = ip_hash in self._bloom
+        self._stats["checks"] += 1
+        if found:
+            self._stats["hits"] += 1
+        return found
+
+    async def start(self, load_exhausted: Callable[[], Iterable[str]]) -> None:
+        """Warm from Firestore and start periodic snapshots, in the background"""
+        self._tasks = [asyncio.create_task(self._warm(load_exhausted), name="trial-filter-warm")]
+        if self.snapshot_path:
+            self._tasks.append(asyncio.create_task(self._snapshot_loop(), name="trial-filter-snapshot"))
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self.snapshot_path:
+            await asyncio.to_thread(self.snapshot)
+
+    def snapshot(self) -> None:
+        """Write the filter to snapshot_path if it changed"""
+        with self._lock:
+            if not self._dirty:
+                return
+            data = self._bloom.to_bytes()
+            self._dirty = False
+        tmp_path = f"{self.snapshot_path}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, self.snapshot_path)
+        except OSError as e:
+            self._dirty = True
+            logger.warning(f"Failed to snapshot exhausted-IP filter: {str(e)}")
+
+    def stats(self) -> Dict[str, int]:
+        """Lookup counters and size"""
+        return {**self._stats, "entries": self._bloom.count, "bytes": self._bloom.size_bytes}
+
+    async def _warm(self, load_exhausted: Callable[[], Iterable[str]]) -> None:
+        def warm() -> int:
+            count = 0
+            for ip_hash in load_exhausted():
+                self.add(ip_hash)
+                count += 1
+            return count
+
+        try:
+            self._stats["warmed"] = await asyncio.to_thread(warm)
+            logger.info(f"Warmed exhausted-IP filter with {self._stats['warmed']} IPs")
+        except Exception as e:
+            logger.error(f"Failed to warm exhausted-IP filter: {str(e)}")
+
+    async def _snapshot_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.snapshot_seconds)
+            await asyncio.to_thread(self.snapshot)
+
+
+exhausted_ips = ExhaustedIpFilter(
+    capacity=settings.TRIAL_FILTER_CAPACITY,
+    error_rate=settings.TRIAL_FILTER_ERROR_RATE,
+    snapshot_path=settings.TRIAL_FILTER_SNAPSHOT_PATH or None,
+    snapshot_seconds=settings.TRIAL_FILTER_SNAPSHOT_SECONDS
+)
@@ -0,0 +1,156 @@
+"""
+User document cache
+Read-through TTL + LRU cache of Firestore user documents with an optional
+SQLite tier shared by worker processes on the same host
+"""
+
+import copy
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class UserCache:
+    """
+    Recently read user documents
+
+    Entries live for ttl_seconds, so a write made by another process is seen
+    within that time. Writes made through FirestoreService update the entry in
+    place. Callers get copies, never the cached dict itself.
+    """
+
+    def __init__(self, ttl_seconds: float, max_entries: int, sqlite_path: Optional[str] = None):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        # uid -> (expires_at, user document)
+        self._memory: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "sharedHits": 0, "misses": 0, "updates": 0, "invalidations": 0}
+
+        if sqlite_path:
+            try:
+                self._conn = sqlite3.connect(sqlite_path, check_same_thread=False, isolation_level=None)
+                self._conn.execute("PRAGMA journal_mode=WAL")
+                self._conn.execute(
+                    """
+                    CREATE TABLE IF NOT EXISTS users (
+                        uid TEXT PRIMARY KEY,
+                        data TEXT NOT NULL,
+                        expiresAt REAL NOT NULL
+                    )
+                    """
+                )
+            except sqlite3.Error as e:
+                logger.warning(f"User cache falling back to memory only: {str(e)}")
+                self._conn = None
+
+    def get(self, uid: str) -> Optional[Dict[str, Any]]:
+        """Cached user document, or None on a miss"""
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(uid)
+            if entry and entry[0] > now:
+                self._memory.move_to_end(uid)
+                self._stats["hits"] += 1
+                return copy.deepcopy(entry[1])
+            if entry:
+                del self._memory[uid]
+
+            if self._conn is not None:
+                try:
+                    row = self._conn.execute(
+                        "SELECT data, expiresAt FROM users WHERE uid = ? AND expiresAt > ?",
+                        (uid, now)
+                    ).fetchone()
+                except sqlite3.Error as e:
+                    logger.warning(f"User cache read failed for {uid}: {str(e)}")
+                    row = None
+                if row:
+                    data = json.loads(row[0])
+                    self._remember(uid, row[1], data)
+                    self._stats["sharedHits"] += 1
+                    return copy.deepcopy(data)
+
+            self._stats["misses"] += 1
+            return None
+
+    def put(self, uid: str, data: Dict[str, Any]) -> None:
+        """Cache a user document as just read from or written to Firestore"""
+        expires_at = time.time() + self.ttl_seconds
+        data = copy.deepcopy(data)
+        with self._lock:
+            self._remember(uid, expires_at, data)
+            self._write_shared(uid, expires_at, data)
+
+    def update(self, uid: str, fields: Dict[str, Any]) -> None:
+        """
+        Apply a write to the cached document, if there is one
+
+        Only the memory tier is consulted, so an entry is never rebuilt from a
+        possibly older shared copy; the shared copy is replaced or dropped.
+        """
+        with self._lock:
+            entry = self._memory.get(uid)
+            if entry is None:
+                self._delete_shared(uid)
+                return
+            expires_at, data = entry
+            data.update(copy.deepcopy(fields))
+            self._write_shared(uid, expires_at, data)
+            self._stats["updates"] += 1
+
+    def invalidate(self, uid: str) -> None:
+        with self._lock:
+            self._memory.pop(uid, None)
+            self._delete_shared(uid)
+            self._stats["invalidations"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters"""
+        lookups = self._stats["hits"] + self._stats["sharedHits"] + self._stats["misses"]
+        return {
+            **self._stats,
+            "hitRate": round((lookups - self._stats["misses"]) / lookups, 3) if lookups else 0.0,
+            "entries": len(self._memory)
+        }
+
+    def _remember(self, uid: str, expires_at: float, data: Dict[str, Any]) -> None:
+        self._memory[uid] = (expires_at, data)
+        self._memory.move_to_end(uid)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _write_shared(self, uid: str, expires_at: float, data: Dict[str, Any]) -> None:
+        if self._conn is None:
+            return
+        try:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO users (uid, data, expiresAt) VALUES (?, ?, ?)",
+                (uid, json.dumps(data, default=str), expires_at)
+            )
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to persist cached user {uid}: {str(e)}")
+
+    def _delete_shared(self, uid: str) -> None:
+        if self._conn is None:
+            return
+        try:
+            self._conn.execute("DELETE FROM users WHERE uid = ?", (uid,))
+        except sqlite3.Error as e:
+            logger.warning(f"Failed to drop cached user {uid}: {str(e)}")
+
+
+user_cache = UserCache(
+    ttl_seconds=settings.USER_CACHE_TTL_SECONDS,
+    max_entries=settings.USER_CACHE_MAX_ENTRIES,
+    sqlite_path=settings.USER_CACHE_SQLITE_PATH or None
+)
@@ -0,0 +1,141 @@
+"""
+Local stand-in for Google's ID token signing key endpoint
+
+Serves X.509 certificates in the same shape and with the same Cache-Control
+header as the securetoken endpoint, and mints ID tokens signed with the
+matching private keys, so token verification can be exercised offline.
+
+    python scripts/key_server.py --project demo-project --port 9100
+    FIREBASE_CERTS_URL=http://127.0.0.1:9100/certs FIREBASE_PROJECT_ID=demo-project uvicorn app.main:app
+    curl "http://127.0.0.1:9100/token?uid=alice&email=alice@example.com"
+
+With --rotate, a new key is added every --max-age seconds and the oldest of
+three is dropped, like Google's rotation.
+"""
+
+import argparse
+import datetime
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+from google.auth import crypt, jwt
+
+
+class KeyRing:
+    """Signing keys, newest last"""
+
+    def __init__(self, keep: int = 3):
+        self.keep = keep
+        self._keys = []
+        self._lock = threading.Lock()
+        self.rotate()
+
+    def rotate(self) -> None:
+        key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "securetoken.system.gserviceaccount.com")])
+        now = datetime.datetime.now(datetime.timezone.utc)
+        cert = (
+            x509.CertificateBuilder()
+            .subject_name(name)
+            .issuer_name(name)
+            .public_key(key.public_key())
+            .serial_number(x509.random_serial_number())
+            .not_valid_before(now - datetime.timedelta(minutes=5))
+            .not_valid_after(now + datetime.timedelta(days=2))
+            .sign(key, hashes.SHA256())
+        )
+        private_pem = key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption()
+        )
+        kid = uuid.uuid4().hex
+        with self._lock:
+            self._keys.append((kid, cert.public_bytes(serialization.Encoding.PEM).decode(), private_pem))
+            del self._keys[:-self.keep]
+
+    def certs(self) -> dict:
+        with self._lock:
+            return {kid: cert for kid, cert, _ in self._keys}
+
+    def mint(self, project_id: str, uid: str, email: str = None, lifetime: int = 3600) -> str:
+        with self._lock:
+            kid, _, private_pem = self._keys[-1]
+        now = int(time.time())
+        claims = {
+            "iss": f"https://securetoken.google.com/{project_id}",
+            "aud": project_id,
+            "auth_time": now,
+            "user_id": uid,
+            "sub": uid,
+            "iat": now,
+            "exp": now + lifetime,
+            "firebase": {"identities": {}, "sign_in_provider": "custom"}
+        }
+        if email:
+            claims["email"] = email
+            claims["email_verified"] = True
+        signer = crypt.RSASigner.from_string(private_pem, key_id=kid)
+        return jwt.encode(signer, claims).decode()
+
+
+def make_handler(keys: KeyRing, project_id: str, max_age: int):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == "/certs":
+                self._send(keys.certs(), {"Cache-Control": f"public, max-age={max_age}, must-revalidate, no-transform"})
+            elif url.path == "/token":
+                query = {name: values[0] for name, values in parse_qs(url.query).items()}
+                token = keys.mint(project_id, query.get("uid", "local-user"), query.get("email"), int(query.get("lifetime", 3600)))
+                self._send({"idToken": token}, {"Cache-Control": "no-store"})
+            else:
+                self.send_error(404)
+
+        def _send(self, body: dict, headers: dict):
+            data = json.dumps(body).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json; charset=UTF-8")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--project", required=True, help="Firebase project ID used as audience and issuer")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--max-age", type=int, default=21600, help="Cache-Control max-age of /certs in seconds")
+    parser.add_argument("--rotate", action="store_true", help="Add a new key every --max-age seconds")
+    args = parser.parse_args()
+
+    keys = KeyRing()
+    if args.rotate:
+        def rotate_forever():
+            while True:
+                time.sleep(args.max_age)
+                keys.rotate()
+
+        threading.Thread(target=rotate_forever, daemon=True).start()
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(keys, args.project, args.max_age))
+    print(f"Serving signing keys on http://{args.host}:{args.port}/certs (max-age={args.max_age}s)")
+    print(f"Set FIREBASE_CERTS_URL=http://{args.host}:{args.port}/certs and FIREBASE_PROJECT_ID={args.project}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
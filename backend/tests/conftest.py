@@ -0,0 +1,37 @@
+"""
+Shared test setup
+
+Module-level singletons read settings at import time, so on-disk tiers are
+switched off and the Firestore client is replaced with an in-memory fake
+before any app module is imported.
+"""
+
+import os
+
+import firebase_admin.firestore
+import pytest
+
+from tests.fake_firestore import FakeFirestore, transactional
+
+for name in (
+    "IDEMPOTENCY_SQLITE_PATH",
+    "CAS_INDEX_SQLITE_PATH",
+    "JOB_QUEUE_SQLITE_PATH",
+    "USER_CACHE_SQLITE_PATH",
+    "TRIAL_FILTER_SNAPSHOT_PATH",
+    "GENERATION_CACHE_DIR",
+    "IMAGE_CACHE_DIR"
+):
+    os.environ[name] = ""
+
+_fake_db = FakeFirestore()
+firebase_admin.firestore.client = lambda *args, **kwargs: _fake_db
+firebase_admin.firestore.transactional = transactional
+
+
+@pytest.fixture
+def fake_db():
+    """The in-memory Firestore used by FirestoreService, emptied for each test"""
+    _fake_db.data.clear()
+    yield _fake_db
+    _fake_db.data.clear()
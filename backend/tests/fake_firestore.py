@@ -0,0 +1,116 @@
+"""
+In-memory stand-in for the Firestore client, enough for FirestoreService
+
+Documents are plain dicts keyed by their full path. Transactions apply
+writes immediately; tests here are single-threaded.
+"""
+
+import uuid
+from typing import Any, Dict, Optional
+
+_OPERATORS = {
+    "==": lambda a, b: a == b,
+    "<": lambda a, b: a is not None and a < b,
+    ">=": lambda a, b: a is not None and a >= b
+}
+
+
+class FakeSnapshot:
+    def __init__(self, doc_id: str, data: Optional[Dict[str, Any]]):
+        self.id = doc_id
+        self._data = data
+        self.exists = data is not None
+
+    def get(self, field: str, default: Any = None) -> Any:
+        return (self._data or {}).get(field, default)
+
+    def to_dict(self) -> Optional[Dict[str, Any]]:
+        return dict(self._data) if self._data is not None else None
+
+
+class FakeDocument:
+    def __init__(self, db: "FakeFirestore", path: str):
+        self._db = db
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+
+    def get(self, transaction=None) -> FakeSnapshot:
+        data = self._db.data.get(self.path)
+        return FakeSnapshot(self.id, dict(data) if data is not None else None)
+
+    def set(self, data: Dict[str, Any], merge: bool = False) -> None:
+        if merge and self.path in self._db.data:
+            self._db.data[self.path].update(data)
+        else:
+            self._db.data[self.path] = dict(data)
+
+    def update(self, data: Dict[str, Any]) -> None:
+        if self.path not in self._db.data:
+            raise KeyError(f"No document to update: {self.path}")
+        self._db.data[self.path].update(data)
+
+    def delete(self) -> None:
+        self._db.data.pop(self.path, None)
+
+    def collection(self, name: str) -> "FakeCollection":
+        return FakeCollection(self._db, f"{self.path}/{name}")
+
+
+class FakeCollection:
+    def __init__(self, db: "FakeFirestore", path: str, filters=(), limit: Optional[int] = None):
+        self._db = db
+        self.path = path
+        self._filters = tuple(filters)
+        self._limit = limit
+
+    def document(self, doc_id: Optional[str] = None) -> FakeDocument:
+        return FakeDocument(self._db, f"{self.path}/{doc_id or uuid.uuid4().hex}")
+
+    def where(self, filter) -> "FakeCollection":
+        condition = (filter.field_path, filter.op_string, filter.value)
+        return FakeCollection(self._db, self.path, self._filters + (condition,), self._limit)
+
+    def limit(self, count: int) -> "FakeCollection":
+        return FakeCollection(self._db, self.path, self._filters, count)
+
+    def select(self, fields) -> "FakeCollection":
+        return self
+
+    def stream(self):
+        matches = [
+            FakeSnapshot(path.rsplit("/", 1)[-1], dict(data))
+            for path, data in list(self._db.data.items())
+            if path.rsplit("/", 1)[0] == self.path
+            and all(_OPERATORS[op](data.get(field), value) for field, op, value in self._filters)
+        ]
+        return iter(matches[:self._limit] if self._limit is not None else matches)
+
+
+class FakeTransaction:
+    def get(self, ref: FakeDocument) -> FakeSnapshot:
+        return ref.get()
+
+    def set(self, ref: FakeDocument, data: Dict[str, Any], merge: bool = False) -> None:
+        ref.set(data, merge=merge)
+
+    def update(self, ref: FakeDocument, data: Dict[str, Any]) -> None:
+        ref.update(data)
+
+    def delete(self, ref: FakeDocument) -> None:
+        ref.delete()
+
+
+class FakeFirestore:
+    def __init__(self):
+        self.data: Dict[str, Dict[str, Any]] = {}
+
+    def collection(self, name: str) -> FakeCollection:
+        return FakeCollection(self, name)
+
+    def transaction(self, **kwargs) -> FakeTransaction:
+        return FakeTransaction()
+
+
+def transactional(fn):
+    """Stand-in for firestore.transactional: run once with the given transaction"""
+    return fn
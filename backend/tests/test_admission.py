@@ -0,0 +1,108 @@
+import asyncio
+
+from fastapi import HTTPException
+import pytest
+
+from app.routes import generate
+from app.services.admission import (
+    AdmissionController, AdmissionRejectedError, PRIORITY_ANON, PRIORITY_BONUS, PRIORITY_PAID
+)
+
+
+def make_controller(max_concurrency=1, max_queue=5):
+    return AdmissionController(
+        max_concurrency=max_concurrency,
+        weights={PRIORITY_PAID: 6, PRIORITY_BONUS: 3, PRIORITY_ANON: 1},
+        class_concurrency={},
+        class_queue={PRIORITY_PAID: max_queue, PRIORITY_BONUS: max_queue, PRIORITY_ANON: max_queue},
+        expected_seconds=1.0
+    )
+
+
+def test_waiter_cancelled_as_slot_frees_does_not_leak_slot():
+    async def scenario():
+        controller = make_controller()
+        release = asyncio.Event()
+
+        async def holder():
+            async with controller.slot(PRIORITY_PAID):
+                await release.wait()
+            return "done"
+
+        async def queued():
+            async with controller.slot(PRIORITY_PAID):
+                pass
+
+        holding = asyncio.create_task(holder())
+        await asyncio.sleep(0)
+        waiting = asyncio.create_task(queued())
+        await asyncio.sleep(0)
+        assert controller.stats()["waiting"] == 1
+
+        # Same tick: the holder is woken to release, then the waiter is cancelled
+        release.set()
+        waiting.cancel()
+        results = await asyncio.gather(holding, waiting, return_exceptions=True)
+
+        assert results[0] == "done"
+        assert isinstance(results[1], asyncio.CancelledError)
+        assert controller.stats()["inFlight"] == 0
+        assert controller.stats()["waiting"] == 0
+
+        async with controller.slot(PRIORITY_PAID):
+            assert controller.stats()["inFlight"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_full_class_queue_rejects_with_retry_after():
+    async def scenario():
+        controller = make_controller(max_queue=1)
+        release = asyncio.Event()
+
+        async def hold(priority):
+            async with controller.slot(priority):
+                await release.wait()
+
+        tasks = [asyncio.create_task(hold(PRIORITY_ANON)) for _ in range(2)]
+        await asyncio.sleep(0)
+        assert controller.saturated(PRIORITY_ANON)
+        assert not controller.saturated(PRIORITY_PAID)
+
+        with pytest.raises(AdmissionRejectedError) as excinfo:
+            async with controller.slot(PRIORITY_ANON):
+                pass
+        # One waiting plus the rejected call, at 1s each on one slot
+        assert excinfo.value.retry_after == 2
+        assert controller.stats()["classes"][PRIORITY_ANON]["rejected"] == 1
+
+        release.set()
+        await asyncio.gather(*tasks)
+        assert controller.stats()["inFlight"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_saturated_class_is_turned_away_before_any_work(monkeypatch):
+    async def scenario():
+        controller = make_controller(max_queue=0)
+        monkeypatch.setattr(generate, "generation_admission", controller)
+        release = asyncio.Event()
+
+        async def hold():
+            async with controller.slot(PRIORITY_PAID):
+                await release.wait()
+
+        holding = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+
+        with pytest.raises(HTTPException) as excinfo:
+            generate._check_capacity(PRIORITY_ANON)
+        assert excinfo.value.status_code == 503
+        assert excinfo.value.headers["Retry-After"] == "1"
+
+        release.set()
+        await holding
+        generate._check_capacity(PRIORITY_ANON)
+
+    asyncio.run(scenario())
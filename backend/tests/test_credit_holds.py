@@ -0,0 +1,106 @@
+import asyncio
+
+import pytest
+
+from app.config import settings
+from app.services.credit_holds import CreditHoldSweeper
+from app.services.firestore import FirestoreService, InsufficientCreditsError
+
+
+@pytest.fixture
+def user(fake_db):
+    fake_db.collection("users").document("alice").set({"credits": 5})
+    return fake_db
+
+
+def credits(db, uid="alice"):
+    return db.collection("users").document(uid).get().get("credits")
+
+
+def hold(db, shoot_id):
+    return db.collection("creditHolds").document(shoot_id).get()
+
+
+def test_reserve_holds_credits_and_release_returns_them_once(user):
+    assert FirestoreService.reserve_credits("alice", 2, "shoot-1") == 3
+    assert credits(user) == 3
+    assert hold(user, "shoot-1").get("amount") == 2
+
+    assert FirestoreService.release_credits("shoot-1")
+    assert credits(user) == 5
+    assert not hold(user, "shoot-1").exists
+
+    assert not FirestoreService.release_credits("shoot-1")
+    assert credits(user) == 5
+
+
+def test_reserve_rejects_insufficient_balance(user):
+    with pytest.raises(InsufficientCreditsError):
+        FirestoreService.reserve_credits("alice", 6, "shoot-1")
+
+    assert credits(user) == 5
+    assert not hold(user, "shoot-1").exists
+
+
+def test_commit_settles_hold_without_charging_again(user):
+    FirestoreService.reserve_credits("alice", 2, "shoot-1")
+
+    assert FirestoreService.commit_generation("alice", 2, "shoot-1", {"articleType": "dress"}) == 3
+    assert credits(user) == 3
+    assert not hold(user, "shoot-1").exists
+    shoot = user.collection("photoshoots").document("alice").collection("shoots").document("shoot-1").get()
+    assert shoot.get("articleType") == "dress"
+
+    # A late release (e.g. from the sweeper) must not refund a settled shoot
+    assert not FirestoreService.release_credits("shoot-1")
+    assert credits(user) == 3
+
+
+def test_commit_for_less_than_the_hold_returns_the_rest(user):
+    FirestoreService.reserve_credits("alice", 1, "shoot-1")
+
+    # e.g. a repeat served from the user's own result cache
+    assert FirestoreService.commit_generation("alice", 0, "shoot-1", {"creditsCost": 0}) == 5
+    assert credits(user) == 5
+    assert not hold(user, "shoot-1").exists
+
+
+def test_commit_without_hold_charges_directly(user):
+    assert FirestoreService.commit_generation("alice", 2, "shoot-1", {}) == 3
+    assert credits(user) == 3
+
+    with pytest.raises(InsufficientCreditsError):
+        FirestoreService.commit_generation("alice", 4, "shoot-2", {})
+
+
+def test_sweep_releases_only_expired_holds(user, monkeypatch):
+    monkeypatch.setattr(settings, "CREDIT_HOLD_TTL_SECONDS", -1)
+    FirestoreService.reserve_credits("alice", 1, "abandoned")
+    monkeypatch.setattr(settings, "CREDIT_HOLD_TTL_SECONDS", 600)
+    FirestoreService.reserve_credits("alice", 1, "running")
+
+    assert FirestoreService.release_expired_holds() == 1
+    assert credits(user) == 4
+    assert not hold(user, "abandoned").exists
+    assert hold(user, "running").exists
+
+
+def test_sweeper_releases_expired_holds_in_the_background(user, monkeypatch):
+    monkeypatch.setattr(settings, "CREDIT_HOLD_TTL_SECONDS", -1)
+    FirestoreService.reserve_credits("alice", 2, "abandoned")
+
+    async def scenario():
+        sweeper = CreditHoldSweeper(interval_seconds=60)
+        await sweeper.start()
+        try:
+            while not sweeper.stats()["sweeps"]:
+                await asyncio.sleep(0.01)
+        finally:
+            await sweeper.stop()
+        return sweeper.stats()
+
+    stats = asyncio.run(scenario())
+
+    assert stats == {"sweeps": 1, "released": 1, "failures": 0}
+    assert credits(user) == 5
+    assert not hold(user, "abandoned").exists
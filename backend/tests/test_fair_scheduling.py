@@ -0,0 +1,76 @@
+import asyncio
+
+from app.services.admission import AdmissionController, PRIORITY_ANON, PRIORITY_BONUS, PRIORITY_PAID
+
+
+def make_controller(max_queue=10):
+    return AdmissionController(
+        max_concurrency=1,
+        weights={PRIORITY_PAID: 6, PRIORITY_BONUS: 3, PRIORITY_ANON: 1},
+        class_concurrency={},
+        class_queue={PRIORITY_PAID: max_queue, PRIORITY_BONUS: max_queue, PRIORITY_ANON: max_queue},
+        expected_seconds=1.0
+    )
+
+
+def test_slots_are_shared_by_weight():
+    async def scenario():
+        controller = make_controller()
+        release = asyncio.Event()
+        order = []
+
+        async def hold():
+            async with controller.slot(PRIORITY_PAID):
+                await release.wait()
+
+        async def record(priority):
+            async with controller.slot(priority):
+                order.append(priority)
+
+        holder = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        # Anonymous calls queue first, yet paid calls (weight 6 vs 1) overtake them
+        tasks = [asyncio.create_task(record(PRIORITY_ANON)) for _ in range(3)]
+        tasks += [asyncio.create_task(record(PRIORITY_PAID)) for _ in range(6)]
+        await asyncio.sleep(0)
+        assert controller.stats()["waiting"] == 9
+
+        release.set()
+        await asyncio.gather(holder, *tasks)
+
+        paid, anon = PRIORITY_PAID, PRIORITY_ANON
+        assert order == [paid, paid, paid, paid, paid, anon, paid, anon, anon]
+        assert controller.stats()["inFlight"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_class_concurrency_cap_leaves_room_for_other_classes():
+    async def scenario():
+        controller = AdmissionController(
+            max_concurrency=2,
+            weights={PRIORITY_PAID: 6, PRIORITY_ANON: 1},
+            class_concurrency={PRIORITY_ANON: 1},
+            class_queue={PRIORITY_PAID: 5, PRIORITY_ANON: 5},
+            expected_seconds=1.0
+        )
+        release = asyncio.Event()
+
+        async def hold(priority):
+            async with controller.slot(priority):
+                await release.wait()
+
+        anon = [asyncio.create_task(hold(PRIORITY_ANON)) for _ in range(2)]
+        await asyncio.sleep(0)
+        stats = controller.stats()["classes"][PRIORITY_ANON]
+        assert (stats["inFlight"], stats["waiting"]) == (1, 1)
+
+        paid = asyncio.create_task(hold(PRIORITY_PAID))
+        await asyncio.sleep(0)
+        assert controller.stats()["classes"][PRIORITY_PAID]["inFlight"] == 1
+
+        release.set()
+        await asyncio.gather(*anon, paid)
+        assert controller.stats()["inFlight"] == 0
+
+    asyncio.run(scenario())
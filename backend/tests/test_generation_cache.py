@@ -0,0 +1,87 @@
+import asyncio
+import base64
+
+from app.services import nano_banana
+from app.services.generation_cache import GenerationCache, fingerprint
+
+RESULT = {"generatedImages": ["https://example.com/1.jpg"], "creditsCost": 1}
+
+
+def test_fingerprint_ignores_formatting_and_image_encoding():
+    raw = base64.b64encode(b"same picture").decode()
+
+    first = fingerprint([raw], "  Summer  Dress ", "Soft light", "1K")
+    second = fingerprint([f"data:image/jpeg;base64,{raw}"], "summer dress", "soft   light", " 1k ")
+
+    assert first == second
+    assert first != fingerprint([raw], "summer dress", "hard light", "1k")
+
+
+def test_generation_cache_expires_entries():
+    cache = GenerationCache(ttl_seconds=0, max_entries=10, max_bytes=10_000)
+    cache.put("key", RESULT)
+
+    assert cache.get("key") is None
+    assert cache.stats()["expirations"] == 1
+
+
+def test_generation_cache_evicts_least_recently_used():
+    cache = GenerationCache(ttl_seconds=60, max_entries=2, max_bytes=10_000)
+    cache.put("a", RESULT)
+    cache.put("b", RESULT)
+    cache.get("a")
+    cache.put("c", RESULT)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == RESULT
+    assert cache.get("c") == RESULT
+    assert cache.stats()["evictions"] == 1
+
+
+def test_generation_cache_skips_results_over_byte_budget():
+    cache = GenerationCache(ttl_seconds=60, max_entries=10, max_bytes=10)
+    cache.put("key", RESULT)
+
+    assert cache.get("key") is None
+    assert cache.stats()["bytes"] == 0
+
+
+def test_generation_cache_reads_disk_tier_from_another_instance(tmp_path):
+    GenerationCache(ttl_seconds=60, max_entries=10, max_bytes=10_000, disk_dir=str(tmp_path)).put("ab12", RESULT)
+    cache = GenerationCache(ttl_seconds=60, max_entries=10, max_bytes=10_000, disk_dir=str(tmp_path))
+
+    assert cache.get("ab12") == RESULT
+    assert cache.get("ab12") == RESULT
+    assert cache.stats()["diskHits"] == 1
+
+
+def test_fingerprint_is_scoped_to_the_owner():
+    inputs = (["https://example.com/a.jpg"], "dress", "", "1k")
+
+    assert fingerprint(*inputs, "alice") == fingerprint(*inputs, "alice")
+    assert fingerprint(*inputs, "alice") != fingerprint(*inputs, "bob")
+
+
+def test_cached_results_are_not_shared_between_owners(monkeypatch):
+    calls = []
+
+    async def provider(**kwargs):
+        calls.append(kwargs["output_prefix"])
+        return {"success": True, "images": [f"https://example.com/{kwargs['output_prefix']}/1.jpg"]}
+
+    monkeypatch.setattr(nano_banana.ProviderService, "generate_photoshoot", staticmethod(provider))
+    monkeypatch.setattr(nano_banana, "generation_cache", GenerationCache(60, 10, 10_000))
+
+    async def generate(owner):
+        return await nano_banana.CachedGenerationService.generate_photoshoot(
+            ["https://example.com/a.jpg"], "dress", "", "1K",
+            output_prefix=f"generated-images/{owner}/shoot", owner=owner
+        )
+
+    alice = asyncio.run(generate("alice"))
+    bob = asyncio.run(generate("bob"))
+    again = asyncio.run(generate("alice"))
+
+    assert calls == ["generated-images/alice/shoot", "generated-images/bob/shoot"]
+    assert bob["images"] == ["https://example.com/generated-images/bob/shoot/1.jpg"]
+    assert again["cached"] and again["images"] == alice["images"]
@@ -0,0 +1,96 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from app.services.idempotency import IdempotencyConflictError, IdempotencyStore, request_hash
+
+
+def make_store(tmp_path=None):
+    sqlite_path = str(tmp_path / "idempotency.db") if tmp_path else None
+    return IdempotencyStore(ttl_seconds=60, max_entries=10, sqlite_path=sqlite_path)
+
+
+def counting_handler(results):
+    calls = []
+
+    async def handler():
+        calls.append(len(calls))
+        result = results[min(len(calls) - 1, len(results) - 1)]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    return handler, calls
+
+
+def run(store, handler, key="k", body=None):
+    return asyncio.run(store.run(key, request_hash(body or {"a": 1}), handler))
+
+
+def test_success_is_replayed():
+    store = make_store()
+    handler, calls = counting_handler([(200, {"ok": True})])
+    assert run(store, handler) == (200, {"ok": True}, False)
+    assert run(store, handler) == (200, {"ok": True}, True)
+    assert len(calls) == 1
+
+
+@pytest.mark.parametrize("status_code", [400, 422])
+def test_deterministic_client_error_is_replayed(status_code):
+    store = make_store()
+    handler, calls = counting_handler([HTTPException(status_code=status_code, detail="bad")])
+    with pytest.raises(HTTPException):
+        run(store, handler)
+    assert run(store, handler) == (status_code, {"detail": "bad"}, True)
+    assert len(calls) == 1
+
+
+@pytest.mark.parametrize("status_code", [401, 402, 403, 404, 409, 429, 500, 503])
+def test_state_dependent_errors_are_not_stored(status_code):
+    store = make_store()
+    handler, calls = counting_handler([HTTPException(status_code=status_code, detail="later"), (200, {"ok": True})])
+    with pytest.raises(HTTPException):
+        run(store, handler)
+    assert run(store, handler) == (200, {"ok": True}, False)
+    assert len(calls) == 2
+
+
+def test_key_reused_with_different_body_conflicts():
+    store = make_store()
+    handler, _ = counting_handler([(200, {"ok": True})])
+    run(store, handler, body={"a": 1})
+    with pytest.raises(IdempotencyConflictError):
+        run(store, handler, body={"a": 2})
+
+
+def test_concurrent_repeat_joins_first_request():
+    store = make_store()
+    release = asyncio.Event()
+    calls = []
+
+    async def handler():
+        calls.append(1)
+        await release.wait()
+        return 200, {"ok": True}
+
+    async def scenario():
+        body = request_hash({"a": 1})
+        first = asyncio.create_task(store.run("k", body, handler))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(store.run("k", body, handler))
+        await asyncio.sleep(0)
+        release.set()
+        return await asyncio.gather(first, second)
+
+    first, second = asyncio.run(scenario())
+    assert first == (200, {"ok": True}, False)
+    assert second == (200, {"ok": True}, True)
+    assert len(calls) == 1
+
+
+def test_records_survive_in_sqlite_tier(tmp_path):
+    handler, calls = counting_handler([(201, {"id": "x"})])
+    run(make_store(tmp_path), handler)
+    assert run(make_store(tmp_path), handler) == (201, {"id": "x"}, True)
+    assert len(calls) == 1
@@ -0,0 +1,41 @@
+from app.services.image_cache import DiskImageCache
+
+
+class FakeBackend:
+    def __init__(self, blobs):
+        self.blobs = blobs
+        self.downloads = 0
+
+    def download(self, blob_path, f):
+        self.downloads += 1
+        if blob_path not in self.blobs:
+            return False
+        f.write(self.blobs[blob_path])
+        return True
+
+
+def test_fetch_returns_an_open_copy_and_downloads_once(tmp_path):
+    cache = DiskImageCache(str(tmp_path), max_bytes=1000)
+    backend = FakeBackend({"a.jpg": b"a" * 10})
+
+    for _ in range(2):
+        with cache.fetch(backend, "a.jpg") as f:
+            assert f.read() == b"a" * 10
+
+    assert backend.downloads == 1
+    assert cache.fetch(backend, "missing.jpg") is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["notFound"]) == (1, 2, 1)
+
+
+def test_evicted_file_stays_readable_through_an_open_handle(tmp_path):
+    cache = DiskImageCache(str(tmp_path), max_bytes=15)
+    backend = FakeBackend({"a.jpg": b"a" * 10, "b.jpg": b"b" * 10})
+
+    held = cache.fetch(backend, "a.jpg")
+    cache.fetch(backend, "b.jpg").close()
+
+    with held:
+        assert held.read() == b"a" * 10
+    stats = cache.stats()
+    assert (stats["evictions"], stats["entries"], stats["bytes"]) == (1, 1, 10)
@@ -0,0 +1,164 @@
+import asyncio
+import sqlite3
+from urllib.parse import parse_qs, urlparse
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+import pytest
+
+from app.config import settings
+from app.dependencies import AuthContext
+from app.models.request import GenerateRequest
+from app.routes import generate
+from app.services.auth import AuthService
+from app.services.firestore import FirestoreService
+from app.services.jobs import (
+    InMemoryJobStore, JobQueue, SQLiteJobStore, JOB_COMPLETED, issue_stream_token, verify_stream_token
+)
+
+NOW = "2026-01-01T00:00:00"
+
+
+def job(shoot_id, owner):
+    return {
+        "shoot_id": shoot_id,
+        "status": JOB_COMPLETED,
+        "owner": owner,
+        "payload": None,
+        "result": {
+            "shoot_id": shoot_id,
+            "status": JOB_COMPLETED,
+            "generatedImages": ["https://example.com/1.jpg"],
+            "creditsCost": 1,
+            "creditsRemaining": 4
+        },
+        "error": None,
+        "createdAt": NOW,
+        "updatedAt": NOW
+    }
+
+
+@pytest.fixture
+def queue(fake_db, monkeypatch):
+    queue = JobQueue(InMemoryJobStore(), workers=1, max_pending=10, result_ttl_seconds=60)
+    monkeypatch.setattr(generate, "job_queue", queue)
+    # Tokens in these tests are the uid they stand for
+    monkeypatch.setattr(
+        AuthService, "verify_id_token",
+        staticmethod(lambda id_token, check_revoked=False: {"uid": id_token})
+    )
+    return queue
+
+
+@pytest.fixture
+def client(queue):
+    app = FastAPI()
+    app.include_router(generate.router, prefix="/api")
+    return TestClient(app)
+
+
+def bearer(uid):
+    return {"Authorization": f"Bearer {uid}"}
+
+
+def test_owner_can_read_job_status(queue, client):
+    queue.store.put(job("shoot-1", "alice"))
+
+    response = client.get("/api/photoshoots/shoot-1", headers=bearer("alice"))
+
+    assert response.status_code == 200
+    assert response.json()["status"] == JOB_COMPLETED
+
+
+def test_other_users_cannot_read_a_job(queue, client):
+    queue.store.put(job("shoot-1", "alice"))
+
+    assert client.get("/api/photoshoots/shoot-1", headers=bearer("mallory")).status_code == 404
+    assert client.get("/api/photoshoots/shoot-1").status_code == 404
+    # ID tokens in the query string are ignored
+    assert client.get("/api/photoshoots/shoot-1?id_token=alice").status_code == 404
+
+
+def test_events_need_the_job_stream_token(queue, client):
+    queue.store.put(job("shoot-1", "alice"))
+    queue.store.put(job("shoot-2", "alice"))
+    token = issue_stream_token("shoot-1", "alice")
+
+    response = client.get(f"/api/photoshoots/shoot-1/events?token={token}")
+    assert response.status_code == 200
+    assert "event: completed" in response.text
+
+    # Not for another job, not without a token, and never an ID token
+    assert client.get(f"/api/photoshoots/shoot-2/events?token={token}").status_code == 404
+    assert client.get("/api/photoshoots/shoot-1/events").status_code == 404
+    assert client.get("/api/photoshoots/shoot-1/events", headers=bearer("alice")).status_code == 404
+
+
+def test_queued_job_returns_a_stream_url_for_its_owner(queue):
+    request = GenerateRequest(articleType="dress", imageSize="1K", uploadedImageUrls=["https://example.com/a.jpg"])
+
+    async def scenario():
+        await queue.start(lambda shoot_id, payload: asyncio.sleep(0, result={}))
+        try:
+            return generate._enqueue_generation(request, AuthContext.for_uid("alice"), "shoot-1", "203.0.113.7")
+        finally:
+            await queue.stop()
+
+    accepted = asyncio.run(scenario())
+
+    url = urlparse(accepted.streamUrl)
+    assert url.path == "/api/photoshoots/shoot-1/events"
+    token = parse_qs(url.query)["token"][0]
+    assert verify_stream_token("shoot-1", "alice", token)
+    assert queue.get("shoot-1")["owner"] == "alice"
+
+
+def test_expired_stream_token_is_rejected(queue, client, monkeypatch):
+    queue.store.put(job("shoot-1", "alice"))
+    monkeypatch.setattr(settings, "JOB_STREAM_TOKEN_TTL", -1)
+    token = issue_stream_token("shoot-1", "alice")
+
+    assert client.get(f"/api/photoshoots/shoot-1/events?token={token}").status_code == 404
+
+
+def test_anonymous_job_is_bound_to_client_ip(queue, client):
+    queue.store.put(job("shoot-1", f"anon-{FirestoreService.hash_ip('testclient')}"))
+    queue.store.put(job("shoot-2", f"anon-{FirestoreService.hash_ip('203.0.113.7')}"))
+
+    assert client.get("/api/photoshoots/shoot-1").status_code == 200
+    assert client.get("/api/photoshoots/shoot-2").status_code == 404
+    assert client.get("/api/photoshoots/shoot-1", headers=bearer("alice")).status_code == 404
+
+
+def test_sqlite_store_adds_owner_column_to_old_files(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE jobs (shoot_id TEXT PRIMARY KEY, status TEXT NOT NULL, payload TEXT, "
+        "result TEXT, error TEXT, createdAt TEXT NOT NULL, updatedAt TEXT NOT NULL)"
+    )
+    conn.commit()
+    conn.close()
+
+    store = SQLiteJobStore(path)
+    store.open()
+    try:
+        store.put(job("shoot-1", "alice"))
+        assert store.get("shoot-1")["owner"] == "alice"
+    finally:
+        store.close()
+
+
+def test_stopped_queue_can_start_again(tmp_path):
+    queue = JobQueue(SQLiteJobStore(str(tmp_path / "jobs.db")), workers=1, max_pending=10, result_ttl_seconds=60)
+
+    async def scenario():
+        for _ in range(2):
+            await queue.start(lambda shoot_id, payload: asyncio.sleep(0, result={}))
+            try:
+                queue.store.put(job("shoot-1", "alice"))
+                assert queue.get("shoot-1")["owner"] == "alice"
+            finally:
+                await queue.stop()
+
+    asyncio.run(scenario())
@@ -0,0 +1,99 @@
+import asyncio
+import base64
+import json
+
+import httpx
+import pytest
+
+from app.services.nano_banana import NanoBananaService, ProviderClient, NUM_OUTPUTS
+from app.services.provider_stream import OutputsStreamParser
+
+PNG = b"\x89PNG\r\n\x1a\n" + bytes(range(256)) * 20
+JPEG = b"\xff\xd8\xff\xe0" + bytes(range(255, -1, -1)) * 20
+
+
+def feed_in_chunks(parser, body, size):
+    outputs = []
+    for start in range(0, len(body), size):
+        outputs.extend(parser.feed(body[start:start + size]))
+    return outputs
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 7, 64, 100000])
+def test_parser_decodes_outputs_split_across_chunks(chunk_size):
+    body = json.dumps({
+        "id": "job-1",
+        "outputs": [
+            "data:image/png;base64," + base64.b64encode(PNG).decode(),
+            base64.b64encode(JPEG).decode(),
+            "https://cdn.example.com/image.webp"
+        ],
+        "meta": {"seconds": 3}
+    }).replace("/", "\\/")  # JSON may escape slashes
+    outputs = feed_in_chunks(OutputsStreamParser(), body, chunk_size)
+
+    assert [output.content_type for output in outputs[:2]] == ["image/png", "image/jpeg"]
+    assert outputs[0].file.read() == PNG
+    assert outputs[1].file.read() == JPEG
+    assert outputs[0].size == len(PNG)
+    assert outputs[2].url == "https://cdn.example.com/image.webp"
+
+
+def test_parser_ignores_body_without_outputs():
+    parser = OutputsStreamParser()
+    assert parser.feed('{"error": "quota"}') == []
+    assert not parser.found_outputs
+
+
+def test_parser_rejects_non_string_outputs():
+    with pytest.raises(ValueError):
+        OutputsStreamParser().feed('{"outputs": [1, 2]}')
+
+
+def provider_returning(outputs, requests):
+    def handler(request):
+        requests.append(json.loads(request.content))
+        body = {"outputs": [base64.b64encode(image).decode() for image in outputs]}
+        return httpx.Response(200, json=body)
+
+    return handler
+
+
+def generate(handler, on_image=None):
+    async def scenario():
+        ProviderClient._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        try:
+            return await NanoBananaService.generate_photoshoot(
+                reference_images=[],
+                article_type="shirt",
+                style_notes="",
+                image_size="small",
+                on_image=on_image
+            )
+        finally:
+            await ProviderClient.close()
+
+    return asyncio.run(scenario())
+
+
+def test_streamed_images_come_from_one_provider_call():
+    requests = []
+    delivered = {}
+
+    async def on_image(index, image):
+        delivered[index] = image
+
+    result = generate(provider_returning([PNG] * NUM_OUTPUTS, requests), on_image)
+
+    assert result["success"] is True
+    assert len(requests) == 1
+    assert requests[0]["num_outputs"] == NUM_OUTPUTS
+    assert sorted(delivered) == list(range(NUM_OUTPUTS))
+    assert [delivered[index] for index in range(NUM_OUTPUTS)] == result["images"]
+
+
+def test_short_provider_result_is_a_failure():
+    result = generate(provider_returning([PNG] * (NUM_OUTPUTS - 1), []))
+
+    assert result["success"] is False
+    assert result["images"] == []
@@ -0,0 +1,111 @@
+import asyncio
+
+import pytest
+
+from app.config import settings
+from app.services import nano_banana
+from app.services.singleflight import SingleFlight, SingleFlightLimitError
+
+
+def test_concurrent_calls_share_one_execution():
+    async def scenario():
+        flight = SingleFlight(max_waiters=5)
+        calls = []
+
+        async def work():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "result"
+
+        results = await asyncio.gather(*(flight.do("key", work) for _ in range(3)))
+        return flight, calls, results
+
+    flight, calls, results = asyncio.run(scenario())
+
+    assert results == ["result"] * 3
+    assert len(calls) == 1
+    assert flight.stats() == {"executions": 1, "coalesced": 2, "rejected": 0, "abandoned": 0, "inFlight": 0}
+
+
+def test_waiter_limit_rejects_extra_callers():
+    async def scenario():
+        flight = SingleFlight(max_waiters=1)
+        release = asyncio.Event()
+
+        async def work():
+            await release.wait()
+            return "result"
+
+        first = asyncio.create_task(flight.do("key", work))
+        await asyncio.sleep(0)
+        with pytest.raises(SingleFlightLimitError):
+            await flight.do("key", work)
+        release.set()
+        return await first
+
+    assert asyncio.run(scenario()) == "result"
+
+
+def test_execution_survives_until_the_last_caller_leaves():
+    async def scenario():
+        flight = SingleFlight(max_waiters=5)
+        release = asyncio.Event()
+        cancelled = []
+
+        async def work():
+            try:
+                await release.wait()
+                return "result"
+            except asyncio.CancelledError:
+                cancelled.append(1)
+                raise
+
+        first = asyncio.create_task(flight.do("key", work))
+        second = asyncio.create_task(flight.do("key", work))
+        await asyncio.sleep(0)
+
+        first.cancel()
+        await asyncio.sleep(0)
+        assert not cancelled
+        release.set()
+        assert await second == "result"
+
+        # Once every caller is gone the execution itself is cancelled
+        release.clear()
+        third = asyncio.create_task(flight.do("other", work))
+        await asyncio.sleep(0)
+        third.cancel()
+        await asyncio.gather(third, return_exceptions=True)
+        await asyncio.sleep(0)
+        assert cancelled == [1]
+        assert flight.stats()["abandoned"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_concurrent_duplicates_share_one_provider_call_per_owner(monkeypatch):
+    calls = []
+
+    async def provider(**kwargs):
+        calls.append(kwargs["output_prefix"])
+        await asyncio.sleep(0.01)
+        return {"success": True, "images": [f"https://example.com/{kwargs['output_prefix']}/1.jpg"]}
+
+    monkeypatch.setattr(nano_banana.ProviderService, "generate_photoshoot", staticmethod(provider))
+    monkeypatch.setattr(settings, "GENERATION_CACHE_ENABLED", False)
+
+    async def generate(owner, shoot_id):
+        return await nano_banana.CachedGenerationService.generate_photoshoot(
+            ["https://example.com/a.jpg"], "dress", "", "1K",
+            output_prefix=f"generated-images/{owner}/{shoot_id}", owner=owner
+        )
+
+    async def scenario():
+        return await asyncio.gather(generate("alice", "1"), generate("alice", "2"), generate("bob", "3"))
+
+    first, duplicate, bob = asyncio.run(scenario())
+
+    assert calls == ["generated-images/alice/1", "generated-images/bob/3"]
+    assert duplicate["images"] == first["images"]
+    # Only the caller whose request made the provider call pays for it
+    assert not first.get("shared") and duplicate["shared"] and not bob.get("shared")
@@ -0,0 +1,47 @@
+import pytest
+
+from app.services import storage
+from app.services.storage import BlobUrlCache, StorageService
+from app.services.storage_backends import LocalStorageBackend
+
+
+@pytest.fixture
+def backend(tmp_path, monkeypatch):
+    backend = LocalStorageBackend(str(tmp_path), "http://localhost:8000", b"key")
+    checks = []
+    exists = backend.exists
+
+    def counting_exists(blob_path):
+        checks.append(blob_path)
+        return exists(blob_path)
+
+    backend.exists = counting_exists
+    backend.checks = checks
+    monkeypatch.setattr(storage, "get_backend", lambda bucket_name: backend)
+    monkeypatch.setattr(storage, "url_cache", BlobUrlCache(max_entries=10, negative_ttl=60))
+    return backend
+
+
+def test_download_urls_are_looked_up_once(backend):
+    url = StorageService.upload_bytes("bucket", "blobs/a.jpg", b"image", "image/jpeg")
+
+    assert StorageService.get_download_urls("bucket", ["blobs/a.jpg", "blobs/missing.jpg"]) == [url, None]
+    assert StorageService.get_download_urls("bucket", ["blobs/a.jpg", "blobs/missing.jpg"]) == [url, None]
+    # The upload seeded the URL; only the missing path was checked, once
+    assert backend.checks == ["blobs/missing.jpg"]
+    assert storage.url_cache.stats()["negativeHits"] == 1
+
+
+def test_delete_invalidates_cached_url(backend):
+    StorageService.upload_bytes("bucket", "blobs/a.jpg", b"image", "image/jpeg")
+
+    assert StorageService.delete_image("bucket", "blobs/a.jpg")
+    assert StorageService.get_download_url("bucket", "blobs/a.jpg") is None
+    assert backend.checks == ["blobs/a.jpg"]
+
+
+def test_negative_entries_expire():
+    cache = BlobUrlCache(max_entries=10, negative_ttl=0)
+    cache.put("backend", "blobs/a.jpg", None)
+
+    assert cache.get("backend", "blobs/a.jpg") == (False, None)
@@ -0,0 +1,65 @@
+import time
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.routes import auth as auth_routes
+from app.services.auth import AuthService
+from app.services.token_cache import TokenCache
+
+
+def claims(uid, iat=None, exp=None):
+    now = time.time()
+    return {"uid": uid, "iat": now - 10 if iat is None else iat, "exp": now + 3600 if exp is None else exp}
+
+
+def test_token_cache_returns_claims_until_expiry():
+    cache = TokenCache(max_entries=10)
+    cache.put("live", claims("alice"))
+    cache.put("stale", claims("alice", exp=time.time() - 1))
+
+    assert cache.get("live")["uid"] == "alice"
+    assert cache.get("stale") is None
+    assert cache.stats()["expired"] == 1
+
+
+def test_token_cache_revocation_drops_and_refuses_older_tokens():
+    cache = TokenCache(max_entries=10)
+    cache.put("alice-token", claims("alice"))
+    cache.put("bob-token", claims("bob"))
+
+    cache.revoke_user("alice")
+    cache.put("alice-token", claims("alice"))
+
+    assert cache.get("alice-token") is None
+    assert cache.get("bob-token") is not None
+
+    cache.put("alice-new", claims("alice", iat=time.time() + 1))
+    assert cache.get("alice-new") is not None
+
+
+def test_token_cache_is_bounded():
+    cache = TokenCache(max_entries=2)
+    for token in ("a", "b", "c"):
+        cache.put(token, claims(token))
+
+    assert cache.get("a") is None
+    assert cache.stats()["entries"] == 2
+
+
+def test_sign_out_revokes_the_users_sessions(monkeypatch):
+    revoked = []
+    monkeypatch.setattr(
+        AuthService, "verify_id_token",
+        staticmethod(lambda id_token, check_revoked=False: {"uid": id_token} if id_token else None)
+    )
+    monkeypatch.setattr(AuthService, "revoke_sessions", staticmethod(lambda uid: revoked.append(uid) or True))
+    app = FastAPI()
+    app.include_router(auth_routes.router, prefix="/api/auth")
+    client = TestClient(app)
+
+    response = client.post("/api/auth/signout", headers={"Authorization": "Bearer alice"})
+
+    assert response.status_code == 200
+    assert revoked == ["alice"]
+    assert client.post("/api/auth/signout").status_code == 401
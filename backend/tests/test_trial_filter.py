@@ -0,0 +1,150 @@
+import asyncio
+import uuid
+
+from fastapi import HTTPException
+import pytest
+
+from app.config import settings
+from app.models.request import GenerateRequest
+from app.routes import generate
+from app.services import firestore as firestore_module
+from app.services.firestore import AnonTrialExhaustedError, FirestoreService
+from app.services.trial_filter import BloomFilter, ExhaustedIpFilter
+
+IP = "203.0.113.7"
+
+
+@pytest.fixture
+def exhausted_ips(fake_db, monkeypatch):
+    ips = ExhaustedIpFilter(capacity=1000, error_rate=0.001, snapshot_path=None, snapshot_seconds=60)
+    monkeypatch.setattr(firestore_module, "exhausted_ips", ips)
+    return ips
+
+
+def stored(path):
+    return firestore_module.db.data.get(path)
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(capacity=1000, error_rate=0.001)
+    keys = [f"ip-{index}" for index in range(1000)]
+    for key in keys:
+        bloom.add(key)
+    assert all(key in bloom for key in keys)
+    false_positives = sum(f"other-{index}" in bloom for index in range(10000))
+    assert false_positives < 50
+
+
+def test_bloom_filter_snapshot_round_trip():
+    bloom = BloomFilter(capacity=100, error_rate=0.01)
+    bloom.add("a")
+    restored = BloomFilter.from_bytes(bloom.to_bytes())
+    assert "a" in restored
+    assert restored.count == 1
+    with pytest.raises(ValueError):
+        BloomFilter.from_bytes(b"XXXX" + bloom.to_bytes()[4:])
+
+
+def test_snapshot_is_written_and_reloaded(tmp_path):
+    path = str(tmp_path / "ips.bloom")
+    ips = ExhaustedIpFilter(capacity=100, error_rate=0.01, snapshot_path=path, snapshot_seconds=60)
+    ips.add("hash-1")
+    ips.snapshot()
+    reloaded = ExhaustedIpFilter(capacity=100, error_rate=0.01, snapshot_path=path, snapshot_seconds=60)
+    assert "hash-1" in reloaded
+
+
+
+def test_unwritable_snapshot_path_falls_back_to_memory(tmp_path):
+    path = str(tmp_path / "missing" / "ips.bloom")
+    ips = ExhaustedIpFilter(capacity=100, error_rate=0.01, snapshot_path=path, snapshot_seconds=60)
+    ips.add("hash-1")
+
+    assert ips.snapshot_path is None
+    assert "hash-1" in ips
+
+def test_refunded_last_slot_does_not_mark_ip_exhausted(exhausted_ips):
+    ip_hash = FirestoreService.hash_ip(IP)
+    for _ in range(settings.FREE_TRIAL_LIMIT - 1):
+        FirestoreService.reserve_anon_trial(IP)
+        FirestoreService.commit_anon_generation(IP, str(uuid.uuid4()), {})
+
+    # The last slot is reserved, then generation fails and it is refunded
+    FirestoreService.reserve_anon_trial(IP)
+    with pytest.raises(AnonTrialExhaustedError):
+        FirestoreService.reserve_anon_trial(IP)
+    FirestoreService.refund_anon_trial(IP)
+
+    assert ip_hash not in exhausted_ips
+    assert list(FirestoreService.exhausted_ip_hashes()) == []
+    assert FirestoreService.check_anon_trial(IP)["eligible"] is True
+
+    FirestoreService.reserve_anon_trial(IP)
+    assert FirestoreService.commit_anon_generation(IP, "last-shoot", {"status": "completed"}) == settings.FREE_TRIAL_LIMIT
+    assert ip_hash in exhausted_ips
+    assert list(FirestoreService.exhausted_ip_hashes()) == [ip_hash]
+    shoot = stored(f"photoshoots/anon-{ip_hash}/shoots/last-shoot")
+    assert shoot["status"] == "completed"
+    with pytest.raises(AnonTrialExhaustedError):
+        FirestoreService.reserve_anon_trial(IP)
+
+
+def run_anonymous_generation(monkeypatch):
+    async def generate_images(request, priority, owner, shoot_id, on_image):
+        return {"images": ["https://example.com/1.jpg"]}
+
+    async def passthrough(request, owner):
+        return request
+
+    async def manifest(*args):
+        return None
+
+    monkeypatch.setattr(generate, "_generate", generate_images)
+    monkeypatch.setattr(generate, "_ingest_reference_images", passthrough)
+    monkeypatch.setattr(generate, "_write_manifest", manifest)
+    request = GenerateRequest(articleType="dress", imageSize="1K", uploadedImageUrls=["https://example.com/a.jpg"])
+    return asyncio.run(generate._handle_anonymous_generation(request, "shoot-1", IP))
+
+
+def test_anonymous_generation_commits_trial_and_shoot_together(exhausted_ips, monkeypatch):
+    response = run_anonymous_generation(monkeypatch)
+
+    ip_hash = FirestoreService.hash_ip(IP)
+    assert response.creditsRemaining == settings.FREE_TRIAL_LIMIT - 1
+    assert stored(f"anonUsers/{ip_hash}")["confirmedCount"] == 1
+    assert stored(f"photoshoots/anon-{ip_hash}/shoots/shoot-1")["generatedImages"] == ["https://example.com/1.jpg"]
+
+
+def test_failed_anonymous_commit_returns_the_trial_slot(exhausted_ips, monkeypatch):
+    def fail(*args):
+        raise RuntimeError("Firestore unavailable")
+
+    monkeypatch.setattr(FirestoreService, "commit_anon_generation", staticmethod(fail))
+
+    with pytest.raises(HTTPException) as excinfo:
+        run_anonymous_generation(monkeypatch)
+
+    assert excinfo.value.status_code == 500
+    assert stored(f"anonUsers/{FirestoreService.hash_ip(IP)}")["generationCount"] == 0
+
+
+def test_warm_up_includes_ips_exhausted_before_confirmed_counts(exhausted_ips, fake_db):
+    # Written by the old counter: no confirmedCount field
+    fake_db.collection("anonUsers").document("old-hash").set({
+        "generationCount": settings.FREE_TRIAL_LIMIT,
+        "status": "exhausted"
+    })
+    fake_db.collection("anonUsers").document("eligible-hash").set({"generationCount": 1, "status": "eligible"})
+
+    assert list(FirestoreService.exhausted_ip_hashes()) == ["old-hash"]
+
+
+def test_commit_counts_usage_recorded_before_confirmed_counts(exhausted_ips, fake_db):
+    ip_hash = FirestoreService.hash_ip(IP)
+    fake_db.collection("anonUsers").document(ip_hash).set({"generationCount": settings.FREE_TRIAL_LIMIT - 1})
+
+    FirestoreService.reserve_anon_trial(IP)
+
+    assert FirestoreService.commit_anon_generation(IP, "shoot-1", {}) == settings.FREE_TRIAL_LIMIT
+    assert ip_hash in exhausted_ips
+    assert stored(f"anonUsers/{ip_hash}")["status"] == "exhausted"
@@ -0,0 +1,80 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+import pytest
+
+from app.config import settings
+from app.routes import uploads
+from app.services.ingestion import ImageIngestionService
+
+BOUNDARY = "test-boundary"
+
+
+def multipart_chunks(files, chunk_size=1024):
+    """A multipart body as a generator, so the client sends it chunked"""
+    body = b""
+    for name, data in files:
+        body += (
+            f"--{BOUNDARY}\r\n"
+            f'Content-Disposition: form-data; name="files"; filename="{name}"\r\n'
+            "Content-Type: image/jpeg\r\n\r\n"
+        ).encode() + data + b"\r\n"
+    body += f"--{BOUNDARY}--\r\n".encode()
+
+    def chunks():
+        for start in range(0, len(body), chunk_size):
+            yield body[start:start + chunk_size]
+
+    return chunks()
+
+
+@pytest.fixture
+def client(fake_db, monkeypatch):
+    ingested = []
+
+    def ingest_upload(file_obj, owner):
+        ingested.append(file_obj.read())
+        return f"upload-{len(ingested)}"
+
+    monkeypatch.setattr(ImageIngestionService, "ingest_upload", staticmethod(ingest_upload))
+    app = FastAPI()
+    app.include_router(uploads.router, prefix="/api")
+    with TestClient(app) as test_client:
+        test_client.ingested = ingested
+        yield test_client
+
+
+def post_chunked(client, files):
+    return client.post(
+        "/api/uploads",
+        content=multipart_chunks(files),
+        headers={"Content-Type": f"multipart/form-data; boundary={BOUNDARY}"}
+    )
+
+
+def test_small_chunked_upload_is_accepted(client):
+    response = post_chunked(client, [("a.jpg", b"x" * 3000)])
+
+    assert response.status_code == 200
+    assert response.json() == {"uploadIds": ["upload-1"]}
+    assert client.ingested == [b"x" * 3000]
+
+
+def test_chunked_body_over_request_limit_is_rejected(client, monkeypatch):
+    monkeypatch.setattr(settings, "UPLOAD_MAX_REQUEST_BYTES", 10_000)
+    monkeypatch.setattr(settings, "INGEST_MAX_BYTES", 8_000)
+
+    response = post_chunked(client, [("a.jpg", b"x" * 6000), ("b.jpg", b"y" * 6000)])
+
+    assert response.status_code == 413
+    assert response.json()["detail"] == "Upload too large"
+    assert client.ingested == []
+
+
+def test_file_over_limit_is_rejected_before_ingestion(client, monkeypatch):
+    monkeypatch.setattr(settings, "INGEST_MAX_BYTES", 4_000)
+
+    response = post_chunked(client, [("a.jpg", b"x" * 3000), ("b.jpg", b"y" * 5000)])
+
+    assert response.status_code == 413
+    assert response.json()["detail"] == "File 2 exceeds 4000 bytes"
+    assert client.ingested == []
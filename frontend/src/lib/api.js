@@ -2,16 +2,18 @@ export function getBackendUrl() {
 	return import.meta.env.VITE_BACKEND_URL || 'http://localhost:8000';
 }
 
-export async function callBackendAPI(endpoint, options = {}) {
+// Adds the stored Firebase ID token as a Bearer header, so it never ends up in URLs or bodies
+export function authHeaders(headers = {}) {
 	const token = localStorage.getItem('firebaseToken');
-	const headers = {
+	return token ? { ...headers, Authorization: `Bearer ${token}` } : { ...headers };
+}
+
+export async function callBackendAPI(endpoint, options = {}) {
+	const baseHeaders = {
 		'Content-Type': 'application/json',
 		...options.headers
 	};
-
-	if (token && !options.skipAuth) {
-		headers['Authorization'] = `Bearer ${token}`;
-	}
+	const headers = options.skipAuth ? baseHeaders : authHeaders(baseHeaders);
 
 	const response = await fetch(`${getBackendUrl()}${endpoint}`, {
 		...options,
@@ -8,6 +8,7 @@ import {
 	updateProfile,
 	signOut
 } from 'firebase/auth';
+import { callBackendAPI } from '$lib/api';
 
 // Firebase configuration
 const firebaseConfig = {
@@ -60,6 +61,8 @@ export async function signInWithEmail(email, password) {
 
 export async function logout() {
 	try {
+		// Revoke the session server-side first, while the ID token is still at hand
+		await callBackendAPI('/api/auth/signout', { method: 'POST' }).catch(() => {});
 		await signOut(auth);
 		localStorage.removeItem('firebaseToken');
 	} catch (error) {
@@ -0,0 +1,21 @@
+// Renditions are stored per image as { placeholder, sources: [{ type, width, url }] }
+
+export function renditionTypes(rendition) {
+	if (!rendition) return [];
+	return [...new Set(rendition.sources.map((source) => source.type))];
+}
+
+export function srcsetFor(rendition, type) {
+	return rendition.sources
+		.filter((source) => source.type === type)
+		.map((source) => `${source.url} ${source.width}w`)
+		.join(', ');
+}
+
+export function smallestFitting(rendition, width, fallback) {
+	if (!rendition) return fallback;
+	const fitting = rendition.sources
+		.filter((source) => source.type === 'image/webp' && source.width >= width)
+		.sort((a, b) => a.width - b.width);
+	return fitting.length > 0 ? fitting[0].url : fallback;
+}